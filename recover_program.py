@@ -5,13 +5,25 @@ from semantic_codec.corruption.corruptors import JSONCorruptor, RandomCorruptor,
 from semantic_codec.metadata.metadata_collector import MetadataCollector
 from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict, from_instruction_dict_to_list, \
     from_functions_to_list_and_addr
-from semantic_codec.metadata.recuperator import ProbabilisticRecuperator, probabilistic_rules
+from semantic_codec.metadata.recuperator import ProbabilisticRecuperator, probabilistic_rules, \
+    remove_bad_candidates_at_addr
+from semantic_codec.metadata.sharded_recovery import ShardedRecovery
 from semantic_codec.solution.solution_builders import ForwardConstraintSolutionEnumerator
 from semantic_codec.solution.solution_io import SolutionWriter
+from semantic_codec.solution.ranking import CandidateRanking
 from semantic_codec.solution.solution_quality import SolutionQuality
 
 
-def print_report(instructions_output_file, original_program, recovered_program):
+def print_report(instructions_output_file, original_program, recovered_program, ranking=None):
+    """
+    Prints the candidates of each address, in the order of the ranking
+    :param recovered_program: Candidates of each instruction of the original program, in the same order
+    :param ranking: CandidateRanking of the recovered program, ranked here if not given
+    """
+    if ranking is None:
+        ranking = CandidateRanking({original_program[i].address: recovered_program[i]
+                                    for i in range(0, len(original_program))}, original_program)
+    equivalence = ranking.equivalence
 
     depths ={}
 
@@ -37,18 +49,9 @@ def print_report(instructions_output_file, original_program, recovered_program):
                 break
 
         if len(instructions) > 1:
-            instructions.sort(key=lambda x: x.score(), reverse=True)
-            #max_encoding = 0
-            #for inst in instructions:
-            #    if inst.encoding > max_encoding:
-            #        max_encoding = inst.encoding
-            #instructions.sort(key = lambda x: x.score() * 1000000000 + (1 - x.encoding / max_encoding), reverse=True)
-
             errors += 1
-            ori_str = str(original_program[i])
-            c1_str = str(instructions[0])
-            c2_str = str(instructions[1])
-            if c1_str != ori_str and instructions[0].encoding != instructions[1].encoding:
+            if not equivalence.is_original(addr, instructions[0]) and \
+                    instructions[0].encoding != instructions[1].encoding:
                 print(" * FAIL : 1st Instruction is not original. ")
                 print(" * WRONG SCORES [Recovered vs Original]:")
                 # Print the comparison with the original rule
@@ -65,7 +68,8 @@ def print_report(instructions_output_file, original_program, recovered_program):
                 print()
 
                 fail_looses += 1
-            elif instructions[0].score() == instructions[1].score() and c1_str != c2_str:
+            elif instructions[0].score() == instructions[1].score() and \
+                    not equivalence.same(addr, instructions[0], instructions[1]):
                 inst_count = 0
                 while inst_count < len(instructions) and \
                                 instructions[0].score() == instructions[inst_count].score():
@@ -123,37 +127,15 @@ def print_report(instructions_output_file, original_program, recovered_program):
     sys.stdout = orig_stdout
 
 
-def remove_bad_candidates_at_addr(v):
-    previous = len(v)
-    one_count = 0
-    less_than_one_count = 0
-    i = 0
-    while i < len(v):
-        score = v[i].score()
-        if score == 1:
-            one_count += 1
-            i += 1
-        elif score == 0:
-            v.pop(i)
-        else:
-            less_than_one_count += 1
-            if one_count > 0:
-                v.pop(i)
-            else:
-                i += 1
-
-    if less_than_one_count > 0:
-        i = 0
-        while i < len(v):
-            score = v[i].score()
-            if score < 1 and one_count > 0:
-                v.pop(i)
-            else:
-                i += 1
-
-    return previous - len(v)
-
-def run_recovery(original_program, corruptor, recuperator, passes=1):
+def run_recovery(original_program, corruptor, recuperator, passes=1, incremental=True, workers=None):
+    """
+    Corrupts a program and recovers it
+    :param incremental: After the first pass, only rescore the candidates affected by the removed ones
+    :param workers: If given, score each pass with a ShardedRecovery using this amount of processes. The scores
+                    are the same, the recuperator must be the ProbabilisticRecuperator.
+    """
+    if workers and recuperator is not ProbabilisticRecuperator:
+        raise RuntimeError('Sharded recovery only supports the ProbabilisticRecuperator')
     # Separe the instructions from the function addresses
     original_program, fns = from_functions_to_list_and_addr(original_program)
     # Clone the original program
@@ -169,32 +151,43 @@ def run_recovery(original_program, corruptor, recuperator, passes=1):
     print("[INFO]: Corrupting program")
     program = corruptor.corrupt(from_instruction_list_to_dict(program))
     print("[INFO]: Program corrupted")
-    SolutionQuality(program, original_program).report()
+    ranking = CandidateRanking(program, original_program)
+    SolutionQuality(program, original_program, ranking).report()
 
     print_report('corrupted_program.txt',
-                 original_program, from_instruction_dict_to_list(program))
+                 original_program, from_instruction_dict_to_list(program), ranking)
 
     initialwriter = SolutionWriter()
-    initialwriter.write_binary('initial_solution.sol', original_program, program)
+    initialwriter.write_binary('initial_solution.sol', original_program, program, corruptor.erasures, ranking)
 
 
     pass_count = 1
+    r, changed = None, []
     while (True):
         stable = True
-        r = recuperator(collector, program, functions=fns)
-        r.passes = passes
-        r.recover()
+        if r is None or not incremental:
+            if workers:
+                # The bad candidates are removed below, as in the serial recovery
+                r = ShardedRecovery(collector, program, fns, workers=workers, prune=False)
+            else:
+                r = recuperator(collector, program, functions=fns)
+                r.passes = passes
+            r.recover()
+        else:
+            r.rescore(changed)
         print("[INFO]: Heuristics computed  (pass {})".format(pass_count))
 
         print_report('instructions{}.txt'.format(pass_count),
                      original_program, from_instruction_dict_to_list(program))
 
         # Determine if there is any instruction that can be removed:
+        changed = []
         for k, v in program.items():
             # Remove 0 or less than 1 if any instruction has 1 score
             prev = len(v)
             if remove_bad_candidates_at_addr(v) > 0:
                 stable = False
+                changed.append(k)
             #if len(v) == 0:
             #    raise RuntimeError('Should not be empty')
         SolutionQuality(program, original_program).report()
@@ -216,21 +209,24 @@ def run_recovery(original_program, corruptor, recuperator, passes=1):
     b.build()
     print('[INFO]: Constrained solution size: {}'.format(b.solution_size))
     print('[INFO]: Constrained solution: {}'.format(b.solution))
-    a = SolutionQuality(program, original_program)
+    ranking = CandidateRanking(program, original_program)
+    a = SolutionQuality(program, original_program, ranking)
     a.report()
 
     pass_count += 1
     print_report('instructions{}.txt'.format(pass_count),
-        original_program, from_instruction_dict_to_list(program))
+        original_program, from_instruction_dict_to_list(program), ranking)
 
     writer = SolutionWriter()
-    writer.write_binary('final_solution.sol', original_program, program)
+    writer.write_binary('final_solution.sol', original_program, program, corruptor.erasures, ranking)
 
 
 # max_error_per_instruction, corrupted_program=None, generate_new=False, )
 if __name__ == "__main__":
     use_packets = True
     use_file = False
+    # Processes recovering the program in parallel, None for the serial recovery
+    workers = None
     recovered_program = None
     corruptor = None
 
@@ -261,4 +257,4 @@ if __name__ == "__main__":
 
     corruptor.corrupted_program_path = os.path.join(os.path.dirname(__file__), 'corrupted.json')
     #recovered_program = run_recovery(original_program, corruptor, Recuperator, 2)
-    run_recovery(original_program, corruptor, ProbabilisticRecuperator)
+    run_recovery(original_program, corruptor, ProbabilisticRecuperator, workers=workers)
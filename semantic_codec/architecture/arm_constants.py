@@ -33,6 +33,10 @@ class AReg:
     STORAGE_NAMES.extend(['STORE', 'CPSR'])
     STORAGE_COUNT = len(STORAGE_NAMES)
 
+    # Storages are packed in 32 bit masks. Storages that do not fit (i.e. registers outside the core set,
+    # numbered from STORAGE_COUNT on) all share this last bit
+    MASK_OTHER = 31
+
     CAPSTONE_REGS = {
         0: 0, # No register
         66: R0,  # ARM_REG_R0 =
@@ -53,6 +57,16 @@ class AReg:
         12: SP,  # ARM_REG_SP =
     }
 
+    @staticmethod
+    def storage_mask(storages):
+        """
+        Packs a list of storages into a 32 bit mask
+        """
+        mask = 0
+        for s in storages:
+            mask |= 1 << min(s, AReg.MASK_OTHER)
+        return mask
+
 class AOp(object):
     """
     ARM Opcodes and opcode types. The cryptic AOp name is to have short code
@@ -1,3 +1,6 @@
+import numpy
+
+
 class BitQueue(object):
 
     WORD_SIZE = 32
@@ -73,6 +76,29 @@ class BitQueue(object):
     def get_bytes(self):
         return self._bytes
 
+    def bits(self):
+        """
+        Bits waiting in the queue, as an array of 0 and 1 in the order they were enqueued
+        """
+        words = numpy.asarray(self._bytes, dtype='<u4')
+        bits = numpy.unpackbits(words.view(numpy.uint8), bitorder='little')
+        return bits[self._dq_bit:self._eq_word * BitQueue.WORD_SIZE + self._eq_bit]
+
+    @staticmethod
+    def from_bits(bits, word_size=1):
+        """
+        Builds the queue resulting of enqueuing some bits in order
+        :param bits: Array of 0 and 1
+        """
+        q = BitQueue(word_size)
+        n = len(bits)
+        padded = numpy.zeros(BitQueue.WORD_SIZE * (n // BitQueue.WORD_SIZE + 1), dtype=numpy.uint8)
+        padded[:n] = bits
+        q._bytes = numpy.packbits(padded, bitorder='little').view('<u4').tolist()
+        q._eq_word = n // BitQueue.WORD_SIZE
+        q._eq_bit = n % BitQueue.WORD_SIZE
+        return q
+
 
 class Bits(object):
     """
@@ -0,0 +1,377 @@
+"""
+Process wide Capstone decoding service.
+
+Building a Capstone handle is far more expensive than disassembling a single word, and corrupted programs contain
+tens of thousands of candidate words, many of them repeated across addresses. The decoder keeps one reusable
+handle per thread and caches the facts we use from every decoded word, keyed by its 32 bit encoding.
+"""
+import struct
+import threading
+
+from capstone import Cs, CS_ARCH_ARM, CS_MODE_ARM
+from capstone.arm_const import ARM_OP_REG, ARM_OP_MEM, ARM_OP_IMM, ARM_INS_B, ARM_INS_BL, ARM_INS_BLX, ARM_INS_BX, \
+    ARM_INS_STR, ARM_INS_STRBT
+
+from semantic_codec.architecture.arm_constants import AReg
+from semantic_codec.architecture.encoding_validity import EncodingValidity
+
+
+def to_int32(value):
+    """
+    Wraps a number into a signed 32 bit integer, the way Capstone reports immediate values
+    """
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+class DecodedOperand(object):
+    """
+    Address independent copy of a Capstone ARM operand
+    """
+
+    __slots__ = ('type', 'reg', 'base', 'index', 'imm')
+
+    def __init__(self, op_type, reg=0, base=0, index=0, imm=0):
+        self.type = op_type
+        self.reg = reg
+        self.base = base
+        self.index = index
+        self.imm = imm
+
+    @staticmethod
+    def from_capstone(op, address=0, pc_relative=False):
+        if op.type == ARM_OP_REG:
+            return DecodedOperand(op.type, reg=op.value.reg)
+        if op.type == ARM_OP_MEM:
+            return DecodedOperand(op.type, base=op.value.mem.base, index=op.value.mem.index)
+        if op.type == ARM_OP_IMM:
+            # Branch targets are reported by Capstone as absolute addresses, keep them relative to the instruction
+            return DecodedOperand(op.type, imm=op.value.imm - address if pc_relative else op.value.imm)
+        return DecodedOperand(op.type)
+
+
+class DecodedInstruction(object):
+    """
+    The facts of a decoded ARM word that do not depend on the address the word is placed at.
+    """
+
+    # Instructions whose immediate operand is an offset from the program counter
+    PC_RELATIVE = (ARM_INS_B, ARM_INS_BL, ARM_INS_BLX)
+
+    __slots__ = ('mnemonic', 'op_str', 'cc', 'id', 'operands', 'update_flags')
+
+    def __init__(self, mnemonic, op_str, cc, ins_id, operands, update_flags):
+        self.mnemonic = mnemonic
+        self.op_str = op_str
+        self.cc = cc
+        self.id = ins_id
+        self.operands = operands
+        self.update_flags = update_flags
+
+    @staticmethod
+    def from_capstone(insn):
+        pc_relative = insn.id in DecodedInstruction.PC_RELATIVE
+        operands = tuple(DecodedOperand.from_capstone(op, insn.address, pc_relative) for op in insn.operands)
+        return DecodedInstruction(insn.mnemonic, insn.op_str, insn.cc, insn.id, operands, insn.update_flags)
+
+    @property
+    def pc_relative(self):
+        return self.id in DecodedInstruction.PC_RELATIVE
+
+    def text(self, encoding, address):
+        """
+        Returns the assembly text of the instruction placed at a given address
+        """
+        if self.pc_relative:
+            # The printed branch target depends on the address. This is only needed to print, so no caching.
+            for i in CapstoneDecoder.handle().disasm(encoding.to_bytes(4, byteorder='little'), address):
+                return '{}\t{}'.format(i.mnemonic, i.op_str)
+        return '{}\t{}'.format(self.mnemonic, self.op_str)
+
+
+class DecodedFeatures(object):
+    """
+    Everything the rules ask an instruction about, computed once per encoding.
+
+    Registers and storages are kept both as ordered tuples and as 32 bit masks (see AReg.storage_mask),
+    so membership tests are a single AND.
+    """
+
+    BRANCHES = (ARM_INS_B, ARM_INS_BX, ARM_INS_BL, ARM_INS_BLX)
+
+    __slots__ = ('mnemonic', 'cond', 'opcode', 'is_push', 'is_pop', 'is_branch', 'reads_memory', 'writes_memory',
+                 'update_flags', 'pc_relative', 'has_memory_operand', 'jump', 'registers_used', 'registers_read',
+                 'registers_written', 'storages_used', 'storages_read', 'storages_written', 'used_mask', 'read_mask',
+                 'written_mask')
+
+    def __init__(self, decoded):
+        """
+        :param decoded: The DecodedInstruction of the encoding
+        """
+        is_stack = decoded.mnemonic.lower().startswith(('push', 'pop'))
+        used = [AReg.SP] if is_stack else []
+        has_memory_operand = False
+        jump = None
+        for op in decoded.operands:
+            if op.type == ARM_OP_REG:
+                if op.reg not in AReg.CAPSTONE_REGS:
+                    register = AReg.STORAGE_COUNT + op.reg
+                else:
+                    register = AReg.CAPSTONE_REGS[op.reg]
+                if register not in used:
+                    used.append(register)
+            elif op.type == ARM_OP_MEM:
+                has_memory_operand = True
+                for register in (AReg.CAPSTONE_REGS[op.base], AReg.CAPSTONE_REGS[op.index]):
+                    if register != 0 and register not in used:
+                        used.append(register)
+            elif op.type == ARM_OP_IMM and jump is None:
+                jump = op.imm
+        self._derive(decoded.mnemonic, decoded.cc, decoded.id, decoded.update_flags, decoded.pc_relative,
+                     used, has_memory_operand, jump)
+
+    @staticmethod
+    def from_fields(mnemonic, cc, ins_id, update_flags, pc_relative, used, has_memory_operand, jump):
+        """
+        Builds the features from the fields kept by the PersistentDecodeCache
+        """
+        features = DecodedFeatures.__new__(DecodedFeatures)
+        features._derive(mnemonic, cc, ins_id, update_flags, pc_relative, list(used), has_memory_operand, jump)
+        return features
+
+    def _derive(self, mnemonic, cc, ins_id, update_flags, pc_relative, used, has_memory_operand, jump):
+        """
+        Derives all the features from the registers used, the memory operand and the first immediate operand
+        """
+        self.mnemonic = mnemonic.lower()
+        self.cond = cc - 1
+        self.opcode = ins_id
+        self.is_push = self.mnemonic.startswith('push')
+        self.is_pop = self.mnemonic.startswith('pop')
+        self.update_flags = update_flags
+        self.pc_relative = pc_relative
+        self.has_memory_operand = has_memory_operand
+        self.jump = jump
+
+        if self.is_pop:
+            written = list(used)
+            read = []
+        elif self.is_push:
+            written = []
+            read = used[1:]
+        else:
+            written = used[:1]
+            read = used[1:]
+        if (self.is_push or self.is_pop) and AReg.SP not in read:
+            read.append(AReg.SP)
+
+        # Kept as in the original instruction: the range is empty, so no instruction is taken as a store
+        self.writes_memory = ARM_INS_STR >= ins_id >= ARM_INS_STRBT
+        self.reads_memory = has_memory_operand and not self.writes_memory
+        self.is_branch = ins_id in DecodedFeatures.BRANCHES or AReg.PC in written
+        if not self.is_branch:
+            self.jump = None
+
+        self.registers_used = tuple(used)
+        self.registers_read = tuple(read)
+        self.registers_written = tuple(written)
+
+        storages_used = list(used)
+        if self.writes_memory or self.reads_memory:
+            storages_used.append(AReg.STORE)
+        if not storages_used:
+            storages_used.append(AReg.NOREG)
+        storages_written = list(written)
+        if self.writes_memory:
+            storages_written.append(AReg.STORE)
+        if AReg.PC not in storages_written and self.is_branch:
+            storages_written.append(AReg.PC)
+        storages_read = list(read)
+        if self.reads_memory:
+            storages_read.append(AReg.STORE)
+
+        self.storages_used = tuple(storages_used)
+        self.storages_read = tuple(storages_read)
+        self.storages_written = tuple(storages_written)
+        self.used_mask = AReg.storage_mask(self.storages_used)
+        self.read_mask = AReg.storage_mask(self.storages_read)
+        self.written_mask = AReg.storage_mask(self.storages_written)
+
+    @staticmethod
+    def in_mask(mask, storages, r):
+        """
+        Tests if a storage is in a mask. Storages sharing the last bit of the mask are looked up in the tuple.
+        """
+        if r >= AReg.MASK_OTHER:
+            return r in storages
+        return mask >> r & 1 == 1
+
+    def jumping_address(self, address):
+        """
+        Jumping address of the instruction placed at a given address, None if it is not a direct branch
+        """
+        if self.jump is None:
+            return None
+        return to_int32(address + self.jump) if self.pc_relative else self.jump
+
+
+class _DecoderHandles(threading.local):
+    """
+    One Capstone handle per thread, as Capstone handles are not thread safe
+    """
+    def __init__(self):
+        self.md = None
+
+
+class CapstoneDecoder(object):
+    """
+    Shared decoder of ARM words. Decoded words are cached by encoding for the whole process.
+
+    Undefined words are cached as well, and decode to None.
+    """
+
+    # Amount of words disassembled by a single Capstone call when decoding in bulk
+    BATCH_WORDS = 4096
+
+    _handles = _DecoderHandles()
+
+    _cache = {}
+
+    _features = {}
+
+    # Optional PersistentDecodeCache looked up before decoding words
+    _persistent = None
+
+    @staticmethod
+    def handle():
+        """
+        Returns the Capstone handle of the current thread
+        """
+        md = CapstoneDecoder._handles.md
+        if md is None:
+            md = Cs(CS_ARCH_ARM, CS_MODE_ARM)
+            md.detail = True
+            CapstoneDecoder._handles.md = md
+        return md
+
+    @staticmethod
+    def decode(encoding):
+        """
+        Decodes an ARM word
+        :param encoding: 32 bit encoding of the instruction
+        :return: The DecodedInstruction or None if the word is undefined
+        """
+        try:
+            return CapstoneDecoder._cache[encoding]
+        except KeyError:
+            pass
+        result = None
+        for i in CapstoneDecoder.handle().disasm(encoding.to_bytes(4, byteorder='little'), 0):
+            result = DecodedInstruction.from_capstone(i)
+        CapstoneDecoder._cache[encoding] = result
+        return result
+
+    @staticmethod
+    def decode_many(encodings):
+        """
+        Decodes many ARM words at once. Words not in the cache are disassembled in bulk.
+        :param encodings: Iterable of 32 bit encodings
+        :return: A list with the DecodedInstruction of each word (None for undefined words)
+        """
+        cache = CapstoneDecoder._cache
+        encodings = [int(e) for e in encodings]
+        CapstoneDecoder._decode_pending([e for e in dict.fromkeys(encodings) if e not in cache])
+        return [cache[e] for e in encodings]
+
+    @staticmethod
+    def defined_many(encodings):
+        """
+        Tells which of many ARM words are defined. Unlike decode_many, undefined words are not cached,
+        so enumerating large sets of mostly undefined words does not grow the cache with them.
+        Words discarded by the EncodingValidity table are not decoded at all.
+        :param encodings: Iterable of 32 bit encodings
+        :return: A list of booleans, True for the defined words
+        """
+        cache = CapstoneDecoder._cache
+        encodings = [int(e) for e in encodings]
+        candidates = [e for e, v in zip(encodings, EncodingValidity.may_be_defined_many(encodings)) if v]
+        CapstoneDecoder._decode_pending([e for e in dict.fromkeys(candidates) if e not in cache], cache_undefined=False)
+        return [cache.get(e) is not None for e in encodings]
+
+    @staticmethod
+    def _decode_pending(pending, cache_undefined=True):
+        """
+        Disassembles words not in the cache, packed in little endian buffers. Capstone stops at undefined words,
+        in which case the disassembly is resumed right after them.
+        :param cache_undefined: Cache the undefined words as None
+        """
+        cache = CapstoneDecoder._cache
+        md = CapstoneDecoder.handle()
+        for start in range(0, len(pending), CapstoneDecoder.BATCH_WORDS):
+            batch = pending[start:start + CapstoneDecoder.BATCH_WORDS]
+            code = struct.pack('<{}I'.format(len(batch)), *batch)
+            offset = 0
+            while offset < len(code):
+                for i in md.disasm(code[offset:], offset):
+                    cache[batch[i.address >> 2]] = DecodedInstruction.from_capstone(i)
+                    offset = i.address + i.size
+                if offset < len(code):
+                    # Capstone stopped at an undefined word, skip it
+                    if cache_undefined:
+                        cache[batch[offset >> 2]] = None
+                    offset += 4
+
+    @staticmethod
+    def use_persistent_cache(cache):
+        """
+        Sets the PersistentDecodeCache looked up before decoding words, None to stop using it.
+        Words decoded are added to the cache, call its save method to keep them.
+        """
+        CapstoneDecoder._persistent = cache
+
+    @staticmethod
+    def features(encoding):
+        """
+        Returns the DecodedFeatures of an ARM word, or None if the word is undefined
+        """
+        try:
+            return CapstoneDecoder._features[encoding]
+        except KeyError:
+            pass
+        persistent = CapstoneDecoder._persistent
+        result = persistent.lookup(encoding) if persistent is not None else None
+        if persistent is None or result is persistent.MISSING:
+            decoded = CapstoneDecoder.decode(encoding)
+            result = DecodedFeatures(decoded) if decoded else None
+            if persistent is not None:
+                persistent.add(encoding, result)
+        CapstoneDecoder._features[encoding] = result
+        return result
+
+    @staticmethod
+    def features_many(encodings):
+        """
+        Returns the DecodedFeatures of many ARM words, decoding the missing ones in bulk
+        """
+        encodings = [int(e) for e in encodings]
+        missing = [e for e in dict.fromkeys(encodings) if e not in CapstoneDecoder._features]
+        persistent = CapstoneDecoder._persistent
+        if persistent is not None and missing:
+            for e, f in zip(missing, persistent.lookup_many(missing)):
+                if f is not persistent.MISSING:
+                    CapstoneDecoder._features[e] = f
+            missing = [e for e in missing if e not in CapstoneDecoder._features]
+        for e, decoded in zip(missing, CapstoneDecoder.decode_many(missing)):
+            result = DecodedFeatures(decoded) if decoded else None
+            CapstoneDecoder._features[e] = result
+            if persistent is not None:
+                persistent.add(e, result)
+        return [CapstoneDecoder._features[e] for e in encodings]
+
+    @staticmethod
+    def cache_size():
+        return len(CapstoneDecoder._cache)
+
+    @staticmethod
+    def clear_cache():
+        CapstoneDecoder._cache.clear()
+        CapstoneDecoder._features.clear()
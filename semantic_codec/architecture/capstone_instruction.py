@@ -1,157 +1,133 @@
-import struct
-
-from capstone import Cs, CS_ARCH_ARM, CS_MODE_ARM, CS_MODE_LITTLE_ENDIAN, CS_MODE_BIG_ENDIAN
-from capstone.arm_const import ARM_OP_REG, ARM_OP_MEM, ARM_INS_B, ARM_INS_BX, ARM_INS_BLX, ARM_INS_BL, ARM_INS_STR, \
-    ARM_INS_STRBT, ARM_OP_IMM
-
-from semantic_codec.architecture.arm_constants import AReg
+from semantic_codec.architecture.capstone_decoder import CapstoneDecoder, DecodedFeatures
+from semantic_codec.architecture.encoding_validity import EncodingValidity
 from semantic_codec.architecture.instruction import Instruction
 
 class CAPSInstruction(Instruction):
 
     def __init__(self, encoding, position):
         super(CAPSInstruction, self).__init__(encoding, position)
-        # CAPSTONE object
-        encoding_bytes = (self._encoding).to_bytes(4, byteorder='little')
-        #endian = CS_MODE_LITTLE_ENDIAN if little_endian else CS_MODE_BIG_ENDIAN
-        md = Cs(CS_ARCH_ARM, CS_MODE_ARM)
-        md.detail = True
-        self._cap = None
-        for i in md.disasm(encoding_bytes, position):
-            self._cap = i
+        # Facts of the encoding, shared by all instructions with the same encoding
+        self._features = CapstoneDecoder.features(self._encoding)
+        self._text = None
+
+    @property
+    def _cap(self):
+        return CapstoneDecoder.decode(self._encoding)
 
+    @property
+    def features(self):
+        """
+        The DecodedFeatures of the instruction, None for undefined instructions
+        """
+        return self._features
 
     def __str__(self):
-        if not self._cap:
+        if not self._features:
             return super(CAPSInstruction, self).__str__()
-        return '{}\t{}'.format(self._cap.mnemonic, self._cap.op_str)
-
-
-
+        if self._text is None:
+            self._text = self._cap.text(self._encoding, self._address)
+        return self._text
 
     @property
     def conditional_field(self):
         """
         Returns the conditional field of the instruction
         """
-        return self._cap.cc - 1
+        return self._features.cond
 
     @property
     def opcode_field(self):
         """
         Returns the opcode
         """
-        return self._cap.id
+        return self._features.opcode
 
     @property
     def opcode_type(self):
         """
         Returns the type of the opcode
         """
-        return self._cap.id
+        return self._features.opcode
 
     def registers_used(self):
         """
         Returns registers used
         :return: A list of the index of the registers used
         """
-        result = []
-        if self.is_push_pop:
-            result.append(AReg.SP)
-
-        for i in self._cap.operands:
-            if i.type == ARM_OP_REG:
-                if i.value.reg not in AReg.CAPSTONE_REGS:
-                    register = AReg.STORAGE_COUNT + i.value.reg
-                else:
-                    register = AReg.CAPSTONE_REGS[i.value.reg]
-                if not register in result:
-                    result.append(register)
-            if i.type == ARM_OP_MEM:
-                register = AReg.CAPSTONE_REGS[i.value.mem.base]
-                if register != 0 and not register in result:
-                    result.append(register)
-                register = AReg.CAPSTONE_REGS[i.value.mem.index]
-                if register != 0 and not register in result:
-                    result.append(register)
-
-        return result
+        return list(self._features.registers_used)
 
     def registers_written(self):
         """
         Returns registers written
         :return: A list of the index of the registers written
         """
-        if self.is_a('pop'):
-            return self.registers_used()
-        elif self.is_a('push'):
-            return []
-        else:
-            return self.registers_used()[:1]
+        return list(self._features.registers_written)
 
     def registers_read(self):
         """
         Returns registers read_instructions
         :return: A list of the index of the registers read_instructions
         """
+        return list(self._features.registers_read)
 
-        if self.is_a('pop'):
-            result = []
-        else:
-            result = self.registers_used()[1:]
+    def storages_used(self):
+        return list(self._features.storages_used)
 
-        if self.is_push_pop and not AReg.SP in result:
-            result.append(AReg.SP)
+    def storages_written(self):
+        return list(self._features.storages_written)
 
-        return result
-        #result = []
-        #if self._darm.Rn:
-        #    result.append(self._darm.Rn.idx)
-        #if self._darm.Rs:
-        #    result.append(self._darm.Rs.idx)
-        #if self._darm.Rm:
-        #    result.append(self._darm.Rm.idx)
+    def storages_read(self):
+        return list(self._features.storages_read)
 
-        #if self.conditional_field != AOpType.COND_ALWAYS:
-        #    result.append(AReg.CPSR)
+    def uses_storage(self, r):
+        """
+        Faster equivalent of 'r in self.storages_used()'
+        """
+        f = self._features
+        return DecodedFeatures.in_mask(f.used_mask, f.storages_used, r)
 
-        #if self._inst_is('push'):
-        #    if self._darm.reglist.reglist > 0:
-        #        result.extend(Instruction._get_register_list(self._darm.reglist.reglist))
+    def writes_storage(self, r):
+        """
+        Faster equivalent of 'r in self.storages_written()'
+        """
+        f = self._features
+        return DecodedFeatures.in_mask(f.written_mask, f.storages_written, r)
 
-        #eturn result
+    def reads_storage(self, r):
+        """
+        Faster equivalent of 'r in self.storages_read()'
+        """
+        f = self._features
+        return DecodedFeatures.in_mask(f.read_mask, f.storages_read, r)
 
     def _inst_is(self, inst):
-        str_lw = str(self).lower()
+        if not self._features:
+            return False
+        mnemonic = self._features.mnemonic
         if type(inst) == list:
             for i in inst:
-                if str_lw.startswith(i):
+                if mnemonic.startswith(i):
                     return True
+            return False
         else:
-            return str_lw.startswith(inst)
+            return mnemonic.startswith(inst)
 
     def _writes_to_memory(self):
-        # If its an store
-        return ARM_INS_STR >= self._cap.id >= ARM_INS_STRBT
+        return self._features.writes_memory
 
     def _read_from_memory(self):
-        for op in self._cap.operands:
-            if op.type == ARM_OP_MEM:
-                return not self._writes_to_memory()
-        return False
-
+        return self._features.reads_memory
 
     @property
     def is_branch(self):
         """
         Return if the instruction is a branching instruction
         """
-        return self.opcode_field in [ARM_INS_B, ARM_INS_BX, ARM_INS_BL, ARM_INS_BLX] or \
-               AReg.PC in self.registers_written()
+        return self._features.is_branch
 
     @property
     def is_push_pop(self):
-        return self._inst_is('push') or self._inst_is('pop')
+        return self._features.is_push or self._features.is_pop
 
     def is_a(self, value):
         return self._inst_is(value)
@@ -161,19 +137,17 @@ class CAPSInstruction(Instruction):
         """
         Determine if an instruction is undefined
         """
-        return not self._cap
+        return not self._features
 
     @property
     def jumping_address(self):
         """
         Jumping address for branching instructions
         """
-        if self.is_branch:
+        if self._features.is_branch:
             if self._jumping_address is None:
-                for op in self._cap.operands:
-                    if op.type == ARM_OP_IMM:
-                        self._jumping_address = op.value.imm
-                        break
+                # Relative branch targets are decoded independently of the address
+                self._jumping_address = self._features.jumping_address(self._address)
                 # On the other hand, one can compute the jumping address
                 #address = self.encoding & Bits.set(23, 0)
                 #if Bits.is_on(address, 23):
@@ -186,14 +160,33 @@ class CAPSInstruction(Instruction):
         return None
 
     def modifies_flags(self):
-        return self._cap.update_flags
+        return self._features.update_flags
         #return AReg.CPSR in self.storages_written()
 
     @staticmethod
-    def encodings_to_inst(encodings, return_undefined=False):
-        result = []
-        for e in encodings:
-            d = CAPSInstruction(e)
-            if not d.is_undefined or return_undefined:
-                result.append(d)
-        return result
+    def decode_many(encodings, addresses):
+        """
+        Builds the instructions of many words, decoding all of them in bulk
+        :param encodings: 32 bit encodings of the instructions
+        :param addresses: Memory address of each encoding
+        :return: A list of CAPSInstruction in the same order of the encodings
+        """
+        encodings = [int(e) for e in encodings]
+        CapstoneDecoder.features_many(encodings)
+        return [CAPSInstruction(e, int(a)) for e, a in zip(encodings, addresses)]
+
+    @staticmethod
+    def encodings_to_inst(encodings, return_undefined=False, addresses=None):
+        """
+        Turns a list of encodings into instructions
+        :param addresses: Address of each encoding. If not given, the encodings are placed one after the other from 0
+        """
+        if addresses is None:
+            addresses = range(0, 4 * len(encodings), 4)
+        encodings = [int(e) for e in encodings]
+        if not return_undefined:
+            # Skip the words that are undefined for sure without decoding them
+            valid = EncodingValidity.may_be_defined_many(encodings)
+            encodings = [e for e, v in zip(encodings, valid) if v]
+            addresses = [a for a, v in zip(addresses, valid) if v]
+        return [d for d in CAPSInstruction.decode_many(encodings, addresses) if not d.is_undefined or return_undefined]
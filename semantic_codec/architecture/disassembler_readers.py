@@ -1,7 +1,13 @@
 """
 Readers of disassemble files
 """
+import mmap
+import os
 import re
+import struct
+from array import array
+
+import numpy
 
 from semantic_codec.architecture.capstone_instruction import CAPSInstruction
 from semantic_codec.architecture.functions import ElfFunction
@@ -37,47 +43,102 @@ class DisassembleReader (object):
 
 
 class ElfioTextDisassembleReader(DisassembleReader):
+    """
+    Reads the text dumps of our Elfio based disassembler: a section listing the functions as 'address;name' lines,
+    followed by the code sections listing the words as 'address;encoding' lines.
+
+    The file is memory mapped and parsed once into compact arrays. All the views of the program (functions,
+    instructions, addresses) are built from them, decoding the words in bulk.
+    """
+
+    # Sections of the dump holding code
+    CODE_SECTIONS = ('init', 'text', 'plt', 'fini')
 
     def __init__(self, filename, instruction_set=DisassembleReader.ARM_SET):
         super(ElfioTextDisassembleReader, self).__init__(filename, instruction_set)
         self.functions = None
         self.instructions = None
+        self._parsed = None
 
-    def read(self):
-
-        functions = {}
+    def _records(self):
+        """
+        Parses the file lazily
+        :return: A generator of ('function', address, name) and ('code', address, encoding) tuples
+        """
+        with open(self._filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                section = None
+                for line in iter(data.readline, b''):
+                    if line.strip() == b'':
+                        continue
+                    elif line.startswith(b'.'):
+                        section = line.split(b'.')[1].decode()
+                    elif section is None:
+                        continue
+                    elif section.startswith('function'):
+                        address, name = line.split(b';')
+                        yield 'function', int(address, 16), name.rstrip().decode()
+                    elif section.startswith(ElfioTextDisassembleReader.CODE_SECTIONS):
+                        line_split = line.split(b';')
+                        try:
+                            address, encoding = line_split[0], line_split[1]
+                        except IndexError:
+                            print('[ERROR] Cannot parse line: {}'.format(line.decode()))
+                            continue
+                        yield 'code', int(address, 16), int(encoding, 16)
 
-        current_fn = None
+    def stream(self):
+        """
+        Parses the file lazily, without keeping anything in memory
+        :return: A generator of (address, encoding, function) tuples, function being the name of the function
+                 the word belongs to, or None
+        """
+        functions, current_fn = {}, None
+        for kind, address, value in self._records():
+            if kind == 'function':
+                functions[address] = value
+            else:
+                if address in functions:
+                    current_fn = functions[address]
+                yield address, value, current_fn
 
-        self.instructions = []
-        section = None
-        for line in open(self._filename):
-            if line.strip() == "":
-                continue
-            elif line.startswith('.'):
-                section = line.split(".")[1]
+    def parse(self):
+        """
+        Parses the file once. Later calls return the same result.
+        :return: A tuple (functions, addresses, encodings, owners), where functions is a dictionary {address: name}
+                 and owners is the position in the functions of the function owning each word, or -1
+        """
+        if self._parsed is not None:
+            return self._parsed
+        functions, position = {}, {}
+        addresses, encodings, owners = array('I'), array('I'), array('i')
+        current_fn = -1
+        for kind, address, value in self._records():
+            if kind == 'function':
+                position.setdefault(address, len(position))
+                functions[address] = value
             else:
-                if section.startswith('function'):
-                    address, name = line.split(';')
-                    functions[int(address, 16)] = ElfFunction(name.rstrip())
-                elif section.startswith('init') or section.startswith('text') or \
-                        section.startswith('plt') or section.startswith('fini'):
-                    line_split = line.split(';')
-                    try:
-                        address, encoding = line_split[0], line_split[1]
-                    except:
-                        print('[ERROR] Cannot parse line: {}'.format(line))
-                        continue
-                    encoding = int(encoding, 16)
-                    address = int(address, 16)
-                    inst = CAPSInstruction(encoding, position=address)
-                    if address in functions:
-                        current_fn = functions[address]
-                    if current_fn:
-                        current_fn.instructions.append(inst)
-                    self.instructions.append(inst)
+                current_fn = position.get(address, current_fn)
+                addresses.append(address)
+                encodings.append(value)
+                owners.append(current_fn)
+        self._parsed = (functions, numpy.frombuffer(addresses, dtype=numpy.uint32),
+                        numpy.frombuffer(encodings, dtype=numpy.uint32), numpy.frombuffer(owners, dtype=numpy.int32))
+        return self._parsed
+
+    def read(self):
+        functions, addresses, encodings, owners = self.parse()
+        fns = [ElfFunction(name) for name in functions.values()]
 
-        self.functions = [x for x in functions.values()]
+        # Words are decoded in bulk once the whole file is parsed
+        self.instructions = CAPSInstruction.decode_many(encodings, addresses)
+        for inst, fn in zip(self.instructions, owners.tolist()):
+            if fn >= 0:
+                fns[fn].instructions.append(inst)
+
+        self.functions = fns
 
         return self.functions, self.instructions
 
@@ -87,6 +148,13 @@ class ElfioTextDisassembleReader(DisassembleReader):
     def read_instructions(self):
         return self.read()[1]
 
+    def read_program(self):
+        """
+        Reads the program in the form {address: [instruction]}
+        """
+        _, addresses, encodings, _ = self.parse()
+        return {inst.address: [inst] for inst in CAPSInstruction.decode_many(encodings, addresses)}
+
 class TextDisassembleReader(DisassembleReader):
     """
     Reads the instructions in text format from the https://onlinedisassembler.com/static/home/,
@@ -108,6 +176,7 @@ class TextDisassembleReader(DisassembleReader):
 
         k, i = "no_method", 0
         result.append(ElfFunction(k))
+        addresses, encodings, owners = [], [], []
         for line in open(self._filename):
             line = line.rstrip('\n')
             if p.match(line):
@@ -118,9 +187,12 @@ class TextDisassembleReader(DisassembleReader):
                 result.append(ElfFunction(k))
             elif len(line) > 0 and line[0] == ' ':
                 e = line.split(":", 1)[1].split("  ", 1)[0].split(" ", 1)
-                f = result[len(result) - 1]
-                encoding = Instruction.reverse_endianess(e[1])
-                f.instructions.append(CAPSInstruction(encoding, position=int(e[0], 16)))
+                addresses.append(int(e[0], 16))
+                encodings.append(int(Instruction.reverse_endianess(e[1]), Instruction.HEX_STR))
+                owners.append(result[len(result) - 1])
+
+        for inst, f in zip(CAPSInstruction.decode_many(encodings, addresses), owners):
+            f.instructions.append(inst)
 
         return result
 
@@ -131,13 +203,182 @@ class TextDisassembleReader(DisassembleReader):
         if self._instruction_set != DisassembleReader.ARM_SET:
             raise RuntimeError("Instruction encoding not supported yet")
 
-        result = []
+        addresses, encodings = [], []
 
         for line in open(self._filename):
             if line[0] == ' ':
                 e = line.rstrip('\n').split(":", 1)[1].split("  ", 1)[0].split(" ", 1)
-                encoding = Instruction.reverse_endianess(e[1])
-                instruction = CAPSInstruction(encoding, position=int(e[0], 16))
-                result.append(instruction)
+                addresses.append(int(e[0], 16))
+                encodings.append(int(Instruction.reverse_endianess(e[1]), Instruction.HEX_STR))
 
-        return result
\ No newline at end of file
+        return CAPSInstruction.decode_many(encodings, addresses)
+
+class BinaryReader(DisassembleReader):
+    """
+    Reads the code of an ELF file or of a raw binary, without a text dump in between.
+
+    The file is memory mapped and the words of the code sections are NumPy views over the map, so no copy is made.
+    For ELF files the code sections are the ones listed in ElfioTextDisassembleReader.CODE_SECTIONS and the functions
+    come from the symbol table. Raw binaries are a single code section, placed at a base address, with no functions.
+    Only 32 bit little endian ELF files are supported.
+    """
+
+    ELF_MAGIC = b'\x7fELF'
+
+    # ELF constants
+    SHT_SYMTAB = 2
+    SHT_DYNSYM = 11
+    STT_FUNC = 2
+
+    ELF_HEADER = struct.Struct('<16sHHIIIIIHHHHHH')
+    SECTION_HEADER = struct.Struct('<IIIIIIIIII')
+    SYMBOL = struct.Struct('<IIIBBH')
+
+    def __init__(self, filename, instruction_set=DisassembleReader.ARM_SET, base_address=0):
+        """
+        :param base_address: Address of the first word of raw binaries. Ignored for ELF files.
+        """
+        super(BinaryReader, self).__init__(filename, instruction_set)
+        self.base_address = base_address
+        self._map = None
+        self._sections = None
+        self._functions = None
+
+    def _data(self):
+        if self._map is None:
+            with open(self._filename, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # Empty files can not be mapped
+                    self._map = b''
+                else:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def close(self):
+        """
+        Unmaps the file. The arrays returned keep the map alive until they are released.
+        """
+        data, self._map = self._map, None
+        self._sections = None
+        if isinstance(data, mmap.mmap):
+            try:
+                data.close()
+            except BufferError:
+                # Arrays over the map are still in use, it is closed when the last one is released
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def is_elf(self):
+        return self._data()[:4] == BinaryReader.ELF_MAGIC
+
+    def _elf_sections(self):
+        """
+        Section headers of the ELF file
+        :return: A list of (name, type, address, offset, size, link) tuples
+        """
+        data = self._data()
+        header = BinaryReader.ELF_HEADER.unpack_from(data, 0)
+        ident, shoff, shentsize, shnum, shstrndx = header[0], header[6], header[11], header[12], header[13]
+        if ident[4] != 1 or ident[5] != 1:
+            raise RuntimeError('Only 32 bit little endian ELF files are supported')
+        headers = [BinaryReader.SECTION_HEADER.unpack_from(data, shoff + i * shentsize) for i in range(0, shnum)]
+        names_offset = headers[shstrndx][4]
+        return [(BinaryReader._string(data, names_offset + h[0]), h[1], h[3], h[4], h[5], h[6]) for h in headers]
+
+    @staticmethod
+    def _string(data, offset):
+        return data[offset:data.find(b'\0', offset)].decode()
+
+    def sections(self):
+        """
+        The code sections of the file, sorted by address
+        :return: A list of (name, address, words) tuples, where words is a read only array of the encodings
+        """
+        if self._sections is not None:
+            return self._sections
+        data = self._data()
+        if not self.is_elf():
+            words = numpy.frombuffer(data, dtype='<u4', count=len(data) // 4)
+            self._sections = [('', self.base_address, words)]
+            return self._sections
+
+        self._sections = []
+        for name, _, address, offset, size, _ in self._elf_sections():
+            if name.lstrip('.') in ElfioTextDisassembleReader.CODE_SECTIONS:
+                words = numpy.frombuffer(data, dtype='<u4', count=size // 4, offset=offset)
+                self._sections.append((name, address, words))
+        self._sections.sort(key=lambda x: x[1])
+        return self._sections
+
+    def encodings(self):
+        """
+        All the words of the code sections
+        :return: A tuple (addresses, encodings) of arrays. For a single section the encodings are a view of the file.
+        """
+        sections = self.sections()
+        if not sections:
+            # An ELF file without code sections
+            return numpy.zeros(0, dtype=numpy.uint32), numpy.zeros(0, dtype=numpy.uint32)
+        if len(sections) == 1:
+            encodings = sections[0][2]
+        else:
+            encodings = numpy.concatenate([words for _, _, words in sections])
+        addresses = numpy.concatenate([numpy.arange(len(words), dtype=numpy.uint32) * 4 + address
+                                       for _, address, words in sections])
+        return addresses.astype(numpy.uint32), encodings
+
+    def function_starts(self):
+        """
+        The functions of the symbol table, dynamic symbols if the file was stripped
+        :return: A dictionary {address: name} sorted by address, empty for raw binaries
+        """
+        if self._functions is not None:
+            return self._functions
+        functions = {}
+        if self.is_elf():
+            data = self._data()
+            sections = self._elf_sections()
+            tables = [s for s in sections if s[1] == BinaryReader.SHT_SYMTAB] or \
+                     [s for s in sections if s[1] == BinaryReader.SHT_DYNSYM]
+            for _, _, _, offset, size, link in tables:
+                names = sections[link][3]
+                for i in range(0, size // BinaryReader.SYMBOL.size):
+                    name, value, _, info, _, shndx = BinaryReader.SYMBOL.unpack_from(data, offset +
+                                                                                     i * BinaryReader.SYMBOL.size)
+                    if info & 0xf == BinaryReader.STT_FUNC and shndx != 0:
+                        # The lowest bit marks Thumb functions
+                        functions.setdefault(value & ~1, BinaryReader._string(data, names + name))
+        self._functions = dict(sorted(functions.items()))
+        return self._functions
+
+    def read(self):
+        addresses, encodings = self.encodings()
+        instructions = CAPSInstruction.decode_many(encodings, addresses)
+        starts = self.function_starts()
+        functions = [ElfFunction(name) for name in starts.values()]
+        if functions:
+            # Each word belongs to the last function starting before it
+            starts = numpy.array(list(starts.keys()), dtype=numpy.int64)
+            owners = numpy.searchsorted(starts, addresses, side='right') - 1
+            for inst, fn in zip(instructions, owners.tolist()):
+                if fn >= 0:
+                    functions[fn].instructions.append(inst)
+        return functions, instructions
+
+    def read_functions(self):
+        return self.read()[0]
+
+    def read_instructions(self):
+        return self.read()[1]
+
+    def read_program(self):
+        """
+        Reads the program in the form {address: [instruction]}
+        """
+        addresses, encodings = self.encodings()
+        return {inst.address: [inst] for inst in CAPSInstruction.decode_many(encodings, addresses)}
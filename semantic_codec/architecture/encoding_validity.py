@@ -0,0 +1,146 @@
+"""
+Decision table telling whether an ARM word may be defined, without calling Capstone.
+
+Whether an ARM word decodes depends mostly on the conditional field, the opcode bits [27:20] and the bits [7:4].
+The table has one bit per value of those 16 bits (bits [31:20] and [7:4] of the word). A bit is off when no word
+with those bits decodes, so all the words of the key can be discarded with a single lookup.
+
+The remaining bits are register fields and immediates. Most keys have a word decoding among a few combinations of
+the special values of the register fields (SP, LR, PC, zero), so every key is probed with those first. The keys
+whose probes are all undefined are swept: all the 2^16 words of the key are decoded, as some instructions only
+decode with other values (SRS needs a mode in bits [4:0], RFE needs bits [11:8] to be 1010...). A key is discarded
+only when none of its words decodes. Keys left on still need Capstone to decide.
+"""
+import itertools
+import os
+
+import numpy
+from capstone import Cs, CS_ARCH_ARM, CS_MODE_ARM
+
+
+class EncodingValidity(object):
+    """
+    Prefilter of undefined ARM words
+    """
+
+    # Table shipped with the package, built running this module
+    TABLE_PATH = os.path.join(os.path.dirname(__file__), 'arm_validity.bin')
+
+    # Values probed for each of the register fields [19:16], [15:12], [11:8] and [3:0]
+    PROBED_FIELD_VALUES = (0, 1, 2, 13, 14, 15)
+
+    _table = None
+
+    @staticmethod
+    def key(encoding):
+        """
+        Key of a word in the table: its bits [31:20] followed by its bits [7:4]. Works on arrays too.
+        """
+        return (encoding >> 16 & 0xFFF0) | (encoding >> 4 & 0xF)
+
+    @staticmethod
+    def probes():
+        """
+        Combinations of the bits out of the key probed for each key
+        """
+        values = EncodingValidity.PROBED_FIELD_VALUES
+        return [(rn << 16) | (rd << 12) | (rs << 8) | rm for rn, rd, rs, rm in itertools.product(values, repeat=4)]
+
+    @staticmethod
+    def probe(key, md=None, probes=None):
+        """
+        Probes the words of a key
+        :return: True if any of the probed words decodes
+        """
+        md = md if md else Cs(CS_ARCH_ARM, CS_MODE_ARM)
+        probes = probes if probes else EncodingValidity.probes()
+        base = ((key & 0xFFF0) << 16) | ((key & 0xF) << 4)
+        for p in probes:
+            if next(md.disasm_lite((base | p).to_bytes(4, byteorder='little'), 0, 1), None) is not None:
+                return True
+        return False
+
+    @staticmethod
+    def words(key):
+        """
+        All the words of a key
+        :return: An array of 2^16 words
+        """
+        base = ((key & 0xFFF0) << 16) | ((key & 0xF) << 4)
+        free = numpy.arange(0, 1 << 16, dtype=numpy.uint32)
+        return ((free >> 4) << 8) | (free & 0xF) | numpy.uint32(base)
+
+    @staticmethod
+    def sweep(key, md=None):
+        """
+        Decodes all the words of a key
+        :return: True if any of the words decodes
+        """
+        if md is None:
+            md = Cs(CS_ARCH_ARM, CS_MODE_ARM)
+            md.skipdata = True
+        # The undefined words are skipped as data
+        for _, _, mnemonic, _ in md.disasm_lite(EncodingValidity.words(key).astype('<u4').tobytes(), 0):
+            if mnemonic != '.byte':
+                return True
+        return False
+
+    @staticmethod
+    def build():
+        """
+        Builds the table probing Capstone, then sweeping the keys whose probes are undefined.
+        Takes about twenty minutes.
+        :return: A boolean array with an item per key, False if no word of the key decodes
+        """
+        md = Cs(CS_ARCH_ARM, CS_MODE_ARM)
+        probes = EncodingValidity.probes()
+        table = numpy.array([EncodingValidity.probe(key, md, probes) for key in range(0, 1 << 16)], dtype=bool)
+        md.skipdata = True
+        for key in numpy.flatnonzero(~table).tolist():
+            table[key] = EncodingValidity.sweep(key, md)
+        return table
+
+    @staticmethod
+    def save(table, path=None):
+        """
+        Saves a table built with build, packed as bits
+        :param path: File to write, TABLE_PATH by default
+        """
+        numpy.packbits(table).tofile(path if path else EncodingValidity.TABLE_PATH)
+
+    @staticmethod
+    def table():
+        """
+        The table, loaded from TABLE_PATH on first use. If the file is missing no word is discarded, so every word
+        is decoded: the table is only built by running this module.
+        """
+        if EncodingValidity._table is None:
+            if os.path.exists(EncodingValidity.TABLE_PATH):
+                packed = numpy.fromfile(EncodingValidity.TABLE_PATH, dtype=numpy.uint8)
+                EncodingValidity._table = numpy.unpackbits(packed).astype(bool)
+            else:
+                print('[WARNING] {} is missing, all the words will be decoded. '
+                      'Run semantic_codec.architecture.encoding_validity to build it'.format(EncodingValidity.TABLE_PATH))
+                EncodingValidity._table = numpy.ones(1 << 16, dtype=bool)
+        return EncodingValidity._table
+
+    @staticmethod
+    def may_be_defined(encoding):
+        """
+        False if the word is undefined for sure, True if it must be decoded to know
+        """
+        return bool(EncodingValidity.table()[EncodingValidity.key(encoding)])
+
+    @staticmethod
+    def may_be_defined_many(encodings):
+        """
+        Same as may_be_defined, for an array of words
+        :return: A boolean array
+        """
+        encodings = numpy.asarray(encodings, dtype=numpy.uint32)
+        return EncodingValidity.table()[EncodingValidity.key(encodings)]
+
+
+if __name__ == "__main__":
+    # Builds the table shipped with the package
+    EncodingValidity.save(EncodingValidity.build())
@@ -182,6 +182,24 @@ class Instruction(object):
 
             return self._storages_read
 
+    def uses_storage(self, r):
+        """
+        Determine if the instruction uses a storage
+        """
+        return r in self.storages_used()
+
+    def writes_storage(self, r):
+        """
+        Determine if the instruction writes a storage
+        """
+        return r in self.storages_written()
+
+    def reads_storage(self, r):
+        """
+        Determine if the instruction reads a storage
+        """
+        return r in self.storages_read()
+
     @property
     def is_undefined(self):
         """
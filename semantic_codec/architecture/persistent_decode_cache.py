@@ -0,0 +1,193 @@
+"""
+Decoded features of ARM words kept on disk, shared between runs and processes.
+
+The cache is a directory with three files:
+ - records.npy: one fixed size record per encoding, sorted by encoding
+ - registers.npy: the registers used by all the records, each record points to a slice
+ - mnemonics.txt: the mnemonics, one per line, records keep the line number
+
+The files are memory mapped when first used, so opening the cache is cheap and the processes reading the same cache
+share its pages. Lookups are binary searches over the encodings column.
+
+Words decoded while the cache is in use are kept in memory until save() merges them into the files. The registers
+and mnemonics only grow, and they are replaced before the records, so readers never see records pointing past them.
+"""
+import fcntl
+import os
+
+import numpy
+
+from semantic_codec.architecture.capstone_decoder import DecodedFeatures
+
+
+class PersistentDecodeCache(object):
+    """
+    Memory mapped store of DecodedFeatures keyed by encoding
+    """
+
+    RECORD = numpy.dtype([('encoding', '<u4'), ('mnemonic', '<u2'), ('cc', 'u1'), ('flags', 'u1'),
+                          ('opcode', '<u2'), ('used_count', '<u2'), ('used_start', '<u4'), ('jump', '<i8')])
+
+    # Bits of the flags field
+    UPDATE_FLAGS = 1
+    PC_RELATIVE = 2
+    MEMORY_OPERAND = 4
+    HAS_JUMP = 8
+    UNDEFINED = 16
+
+    # Returned by the lookups when an encoding is not in the cache
+    MISSING = object()
+
+    def __init__(self, path):
+        """
+        :param path: Directory of the cache, created on save if it does not exist
+        """
+        self.path = path
+        self._records = None
+        self._registers = None
+        self._mnemonics = None
+        self._pending = {}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        """
+        Maps the files the first time they are needed. The records go first, see the module documentation.
+        """
+        if self._records is not None:
+            return
+        if os.path.exists(self._file('records.npy')):
+            self._records = numpy.load(self._file('records.npy'), mmap_mode='r')
+            self._registers = numpy.load(self._file('registers.npy'), mmap_mode='r')
+            with open(self._file('mnemonics.txt')) as f:
+                self._mnemonics = f.read().splitlines()
+        else:
+            self._records = numpy.zeros(0, dtype=PersistentDecodeCache.RECORD)
+            self._registers = numpy.zeros(0, dtype=numpy.uint16)
+            self._mnemonics = []
+
+    def __len__(self):
+        """
+        Amount of encodings saved on disk
+        """
+        self._load()
+        return len(self._records)
+
+    def _find(self, encodings):
+        """
+        Index of the records of some encodings, -1 for the encodings not saved
+        """
+        self._load()
+        encodings = numpy.asarray(encodings, dtype=numpy.uint32)
+        keys = self._records['encoding']
+        if len(keys) == 0:
+            return numpy.full(len(encodings), -1)
+        i = numpy.minimum(numpy.searchsorted(keys, encodings), len(keys) - 1)
+        return numpy.where(keys[i] == encodings, i, -1)
+
+    def _features(self, record):
+        """
+        Builds the features of a record, given as a tuple. None for undefined words.
+        """
+        _, mnemonic, cc, flags, opcode, used_count, used_start, jump = record
+        if flags & PersistentDecodeCache.UNDEFINED:
+            return None
+        return DecodedFeatures.from_fields(self._mnemonics[mnemonic], cc, opcode,
+                                           bool(flags & PersistentDecodeCache.UPDATE_FLAGS),
+                                           bool(flags & PersistentDecodeCache.PC_RELATIVE),
+                                           self._registers[used_start:used_start + used_count].tolist(),
+                                           bool(flags & PersistentDecodeCache.MEMORY_OPERAND),
+                                           jump if flags & PersistentDecodeCache.HAS_JUMP else None)
+
+    def lookup(self, encoding):
+        """
+        :return: The DecodedFeatures of an encoding, None if the word is undefined, MISSING if it is not cached
+        """
+        return self.lookup_many([encoding])[0]
+
+    def lookup_many(self, encodings):
+        """
+        Same as lookup, for many encodings at once
+        """
+        encodings = [int(e) for e in encodings]
+        found = self._find(encodings)
+        records = iter(self._records[found[found >= 0]].tolist())
+        result = []
+        for e, i in zip(encodings, found.tolist()):
+            record = next(records) if i >= 0 else None
+            if e in self._pending:
+                result.append(self._pending[e])
+            elif record is None:
+                result.append(PersistentDecodeCache.MISSING)
+            else:
+                result.append(self._features(record))
+        return result
+
+    def add(self, encoding, features):
+        """
+        Keeps the features of an encoding until the next save
+        :param features: The DecodedFeatures, None for undefined words
+        """
+        self._pending[int(encoding)] = features
+
+    def save(self):
+        """
+        Merges the encodings added into the files. A lock file keeps concurrent saves from mixing their files.
+        """
+        if not self._pending:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file('lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Reload, other processes may have saved since we mapped the files
+            self._records = None
+            self._load()
+            found = self._find(list(self._pending.keys()))
+            pending = [(e, f) for (e, f), i in zip(self._pending.items(), found.tolist()) if i < 0]
+
+            mnemonics = list(self._mnemonics)
+            ids = {m: i for i, m in enumerate(mnemonics)}
+            registers = [numpy.asarray(self._registers)]
+            used_start = len(self._registers)
+            added = numpy.zeros(len(pending), dtype=PersistentDecodeCache.RECORD)
+            for k, (e, f) in enumerate(pending):
+                added[k]['encoding'] = e
+                if f is None:
+                    added[k]['flags'] = PersistentDecodeCache.UNDEFINED
+                    continue
+                if f.mnemonic not in ids:
+                    ids[f.mnemonic] = len(mnemonics)
+                    mnemonics.append(f.mnemonic)
+                added[k]['mnemonic'] = ids[f.mnemonic]
+                added[k]['cc'] = f.cond + 1
+                added[k]['opcode'] = f.opcode
+                added[k]['flags'] = (PersistentDecodeCache.UPDATE_FLAGS if f.update_flags else 0) | \
+                                    (PersistentDecodeCache.PC_RELATIVE if f.pc_relative else 0) | \
+                                    (PersistentDecodeCache.MEMORY_OPERAND if f.has_memory_operand else 0) | \
+                                    (PersistentDecodeCache.HAS_JUMP if f.jump is not None else 0)
+                added[k]['jump'] = f.jump if f.jump is not None else 0
+                added[k]['used_start'] = used_start
+                added[k]['used_count'] = len(f.registers_used)
+                registers.append(numpy.asarray(f.registers_used, dtype=numpy.uint16))
+                used_start += len(f.registers_used)
+
+            records = numpy.concatenate((numpy.asarray(self._records), added))
+            records = records[numpy.argsort(records['encoding'], kind='stable')]
+
+            # Registers and mnemonics only grow, write them before the records that point to them
+            self._replace('registers.npy', lambda f: numpy.save(f, numpy.concatenate(registers)))
+            self._replace('mnemonics.txt', lambda f: f.write(''.join(m + '\n' for m in mnemonics).encode()))
+            self._replace('records.npy', lambda f: numpy.save(f, records))
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        self._pending.clear()
+        self._records = None
+
+    def _replace(self, name, write):
+        """
+        Writes a file of the cache to a temporary file and moves it in place
+        """
+        tmp = self._file(name + '.tmp')
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, self._file(name))
@@ -110,13 +110,18 @@ class InstructionPartFrequencyCounter(object):
         # Instructions containing the element being counted
         instructions_with = {}
 
+        # Instructions already listed for each element, so the lists are not scanned
+        listed = {}
+
         for p in program:
             c = collections.Counter(x(p))
             for k, r in c.items():
                 if k not in instructions_with:
                     instructions_with[k] = [p]
-                elif p not in instructions_with[k]:
+                    listed[k] = {id(p)}
+                elif id(p) not in listed[k]:
                     instructions_with[k].append(p)
+                    listed[k].add(id(p))
 
                 if k not in freq:
                     freq[k] = 0
@@ -3,8 +3,11 @@ import math
 import json
 import sys
 
+import numpy
+
 from semantic_codec.architecture.bits import Bits, BitQueue
 from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+from semantic_codec.architecture.encoding_validity import EncodingValidity
 from semantic_codec.architecture.instruction import Instruction
 
 
@@ -31,11 +34,11 @@ def load_corrupted_program_from_json(file_path):
     with open(file_path) as data_file:
         data = json.load(data_file)
     result = {}
+    addresses = [int(k) for k, v in data.items() for e in v]
+    encodings = [e for v in data.values() for e in v]
+    instructions = iter(CAPSInstruction.decode_many(encodings, addresses))
     for k, v in data.items():
-        addr = int(k)
-        result[addr] = v
-        for i in range(0, len(v)):
-            v[i] = CAPSInstruction(v[i], addr)
+        result[int(k)] = [next(instructions) for e in v]
     return result
 
 
@@ -211,21 +214,18 @@ def corrupt_instruction(program, original_instruction, address,
 
     #program[address] = []
     for i in range(1, len(corrupted)):
+        # Skip the words that are undefined for sure without building the instruction
+        if not EncodingValidity.may_be_defined(corrupted[i]):
+            continue
         inst = CAPSInstruction(corrupted[i], original_instruction.address)
         if not inst.ignore:
             program[address].append(inst)
 
     return program[address]
 
-def predict_corruption(packet_count, bits_per_interleave, data_size, interleave, packets_lost):
+def _lost_offsets(packet_count, bits_per_interleave, data_size, interleave, packets_lost):
     """
-    Determines which bits will be corrupted given a certain interleave schema and a list of packets lost
-    :param packet_count: Amount of packets that is going the be sent.
-    :param bits_per_interleave: Amount of bits per each interleave pass
-    :param data_size: Amount of data that is going to be sent, measured in bytes
-    :param interleave: Interleave schema for
-    :param packets_lost: list of packets lost during transmission
-    :return: All the tuples that will be corrupted given the packets lost
+    Offsets, in bits of the data, of the chunks carried by the packets lost. Sorted.
     """
 
     WORD_SIZE = BitQueue.WORD_SIZE
@@ -234,34 +234,78 @@ def predict_corruption(packet_count, bits_per_interleave, data_size, interleave,
     # 1. For each packet lost there must be a series of corresponding errors signaled
 
     # A packet losses a series of bits periodically with a given jump distance
-    jump = bits_per_interleave * packet_count
+    jump = int(bits_per_interleave * packet_count)
 
     # Compute the total amount of bits in the data
-    total_bits = data_size * BitQueue.WORD_SIZE
+    total_bits = int(data_size * WORD_SIZE)
 
     # Compute the starting index for each packet in the remove packet list
-    b = [bits_per_interleave * interleave.index(p) for p in packets_lost]
-
-    errors = []
-
-    # Check that all errors were properly reported
-    while b[0] < total_bits:
-        for i in range(0, len(b)):
-            if b[i] < total_bits:
-                bte = int(math.floor(b[i] / WORD_SIZE))
-                bit = int(math.fmod(b[i], WORD_SIZE))
-                last_bit = bit + bits_per_interleave
-                t2 = None
-                if last_bit >= WORD_SIZE:
-                    t1 = (bte, bit, WORD_SIZE - 1 - bit)
-                    t2 = (bte + 1, 0, bits_per_interleave - WORD_SIZE + 1 + bit)
-                else:
-                    t1 = (bte, bit)
-                if not t1 in errors:
-                    errors.append(t1)
-                if t2 and not t2 in errors:
-                    errors.append(t2)
-            # Jump to the next cyclic error
-            b[i] += jump
-
-    return errors
\ No newline at end of file
+    position = {}
+    for i, p in enumerate(interleave):
+        position.setdefault(p, i)
+    b = numpy.unique([bits_per_interleave * position[p] for p in packets_lost]).astype(numpy.int64)
+    if len(b) == 0 or b[0] >= total_bits:
+        return numpy.zeros(0, dtype=numpy.int64)
+
+    # Jump as many times as the first packet in the interleave needs to reach the end of the data.
+    # The starting indexes are lower than the jump, so the offsets of each jump come sorted after the previous ones
+    jumps = (total_bits - int(b[0]) + jump - 1) // jump
+    offsets = (jump * numpy.arange(jumps, dtype=numpy.int64)[:, None] + b[None, :]).ravel()
+    return offsets[offsets < total_bits]
+
+
+def predict_erasures(packet_count, bits_per_interleave, data_size, interleave, packets_lost):
+    """
+    Determines which bits will be erased given a certain interleave schema and a list of packets lost
+    :param packet_count: Amount of packets that is going the be sent.
+    :param bits_per_interleave: Amount of bits per each interleave pass
+    :param data_size: Amount of data that is going to be sent, measured in words
+    :param interleave: Interleave schema for
+    :param packets_lost: list of packets lost during transmission
+    :return: An array with the erasure mask of each word of the data, with the bits lost on
+    """
+    WORD_SIZE = BitQueue.WORD_SIZE
+    total_bits = int(data_size * WORD_SIZE)
+    offsets = _lost_offsets(packet_count, bits_per_interleave, data_size, interleave, packets_lost)
+
+    erased = numpy.zeros(-(-total_bits // WORD_SIZE) * WORD_SIZE, dtype=numpy.uint8)
+    bits = (offsets[:, None] + numpy.arange(bits_per_interleave)[None, :]).ravel()
+    erased[bits[bits < total_bits]] = 1
+    return numpy.packbits(erased, bitorder='little').view('<u4')
+
+
+def predict_corruption(packet_count, bits_per_interleave, data_size, interleave, packets_lost):
+    """
+    Determines which bits will be corrupted given a certain interleave schema and a list of packets lost
+    :param packet_count: Amount of packets that is going the be sent.
+    :param bits_per_interleave: Amount of bits per each interleave pass
+    :param data_size: Amount of data that is going to be sent, measured in bytes
+    :param interleave: Interleave schema for
+    :param packets_lost: list of packets lost during transmission
+    :return: All the tuples that will be corrupted given the packets lost, sorted by word and bit.
+             Errors reaching the end of a word are split in two (word, bit, length) tuples,
+             the others are (word, bit) tuples covering bits_per_interleave bits.
+    """
+
+    WORD_SIZE = BitQueue.WORD_SIZE
+
+    offsets = _lost_offsets(packet_count, bits_per_interleave, data_size, interleave, packets_lost)
+    if len(offsets) == 0:
+        return []
+
+    # =============================================================================================
+    # 2. Errors reaching the end of a word are split: the end of the word and the start of the next one
+    bte, bit = offsets // WORD_SIZE, offsets % WORD_SIZE
+    crossing = bit + bits_per_interleave >= WORD_SIZE
+    first = bit[crossing]
+
+    word = numpy.concatenate((bte, bte[crossing] + 1))
+    start = numpy.concatenate((bit, numpy.zeros(len(first), dtype=numpy.int64)))
+    length = numpy.full(len(word), -1, dtype=numpy.int64)
+    length[:len(bte)][crossing] = WORD_SIZE - 1 - first
+    length[len(bte):] = bits_per_interleave - WORD_SIZE + 1 + first
+
+    # Sort by word and bit, as the corruptor groups the errors of each word
+    order = numpy.argsort(word * WORD_SIZE + start, kind='stable')
+    return [(w, s) if l < 0 else (w, s, l)
+            for w, s, l in zip(word[order].tolist(), start[order].tolist(), length[order].tolist())]
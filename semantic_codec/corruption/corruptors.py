@@ -1,4 +1,7 @@
+import numpy
+
 from semantic_codec.corruption.corruption import *
+from semantic_codec.corruption.lazy_candidates import ErasedWord, LazyCorruptedProgram
 from semantic_codec.interleaver.interleaver2d import build_2d_interleave_sp
 from semantic_codec.report.print_progress import TextProgressBar
 
@@ -8,6 +11,8 @@ class Corruptor(object):
     def __init__(self):
         self.save_corrupted_program = False
         self.corrupted_program_path = None
+        # Erasure mask of each word of the last program corrupted, in address order. None if unknown
+        self.erasures = None
 
     def corrupt(self, program):
         pass
@@ -25,7 +30,7 @@ class JSONCorruptor(Corruptor):
     """
 
     def __init__(self, path=None):
-        super(JSONCorruptor).__init__()
+        super(JSONCorruptor, self).__init__()
         self.corrupted_program_path = path
 
     def corrupt(self, program):
@@ -41,9 +46,12 @@ class PacketCorruptor(Corruptor):
     The corruptor assumes that the program have been interleaved using the results by Zhang:
 
     "A new two-dimensional interleaving technique using successive packing"
+
+    In lazy mode the corrupted addresses keep only the known bits and the erased ones. Their candidates are
+    enumerated, and the undefined ones dropped, when the address is first read (see LazyCorruptedProgram).
     """
     def __init__(self, packet_count=None, data_size=None, interleave=None,
-                 packets_lost=None, bits_per_interleave=2, save_corrupted_path=None):
+                 packets_lost=None, bits_per_interleave=2, save_corrupted_path=None, lazy=False):
         super(PacketCorruptor, self).__init__()
         self.packet_count = math.ceil(packet_count) # Just in case
         self.data_size = data_size
@@ -52,73 +60,56 @@ class PacketCorruptor(Corruptor):
         self.bits_per_interleave = bits_per_interleave
         self.save_corrupted_program = save_corrupted_path is not None
         self.corrupted_program_path = save_corrupted_path
+        self.lazy = lazy
 
-    def _corrupt_address(self, tuples, address, program):
-        corrupted = []
+    def _corrupt_address(self, mask, address, program):
+        if self.lazy:
+            program.erase(address, mask)
+            return
+        encodings = {}
         for inst in program[address]:
-            for c_inst in corrupt_all_bits_tuples(tuples, inst.encoding):
-                arm_inst = CAPSInstruction(c_inst, program[address][0].address)
-                if not arm_inst in corrupted:
-                    corrupted.append(arm_inst)
-        program[address] = corrupted
+            for batch in ErasedWord(inst.encoding, mask).encodings():
+                encodings.update(dict.fromkeys(batch.tolist()))
+        # The candidates of a single word are enumerated in order
+        encodings = sorted(encodings) if len(program[address]) > 1 else list(encodings)
+        position = program[address][0].address
+        program[address] = CAPSInstruction.decode_many(encodings, [position] * len(encodings))
 
     def corrupt(self, program):
         """
         Simulates the effect of packet losses to corrupt a program.
         :param program: A dictionary of {address => DARMInstructions}
-        :return: The program corrupted in the form of {address => [DARMInstructions]}
+        :return: The program corrupted in the form of {address => [DARMInstructions]}.
+                 In lazy mode a LazyCorruptedProgram sharing the instructions of the program
         """
         if not self.packet_lost:
             raise RuntimeError('No packet lost information. Cannot corrupt')
 
+        if self.lazy:
+            program = LazyCorruptedProgram(program)
+
         if not self.interleave:
             self.interleave = build_2d_interleave_sp(self.packet_count, True)
 
-        # TODO: This is a bottleneck created by the badly choosen representation of data
-        addresses = [x for x in program.keys()]
-        addresses.sort()
-        # predict packet losses
-        errors = predict_corruption(self.packet_count, self.bits_per_interleave, self.data_size,
-                                    self.interleave, self.packet_lost)
-        # Make sure all errors of a same byte are grouped together
-        vv = len(errors) * 100
-        errors.sort(key=lambda x: x[0] * vv + x[1])
-
-        # Corrupt the program
-        k, tuples, e = 0, [], errors[0]
-        current = e[0]
+        addresses = sorted(program.keys())
+        # predict packet losses, as the erasure mask of each word
+        erasures = predict_erasures(self.packet_count, self.bits_per_interleave, self.data_size,
+                                    self.interleave, self.packet_lost)[:len(addresses)]
+        self.erasures = erasures
+        corrupted = numpy.flatnonzero(erasures)
 
         # Create a nice progress bar. TODO: Factor this out so other widgets can be used as well.
-        progress_bar = TextProgressBar(iteration=0, total=len(errors),
+        progress_bar = TextProgressBar(iteration=0, total=len(corrupted),
                                        prefix='Corrupting:',
                                        decimals=0, bar_length=50, print_dist=4)
 
-        while k <= len(errors):
-            if current != e[0] or k == len(errors):
-                if len(tuples) != 0 and current < len(addresses):
-                    address = addresses[current]
-                    self._corrupt_address(tuples, address, program)
-                    tuples = []
-                current = e[0]
-
-            # Some errors expand through different bytes and are represented by a three index tuple
-            if len(e) == 2:
-                tuples.append((e[1], e[1] + self.bits_per_interleave))
-            else:
-                tuples.append((e[1], e[1] + e[2]))
-
-            k += 1
-            if k < len(errors):
-                e = errors[k]
-
-            # Progress the bar. TODO: Factor this out so other widgets can be used as well.
+        # Corrupt the program
+        for k, mask in zip(corrupted.tolist(), erasures[corrupted].tolist()):
+            self._corrupt_address(mask, addresses[k], program)
             progress_bar.progress()
 
-        for v in program.values():
-            v.sort(key=lambda x : x.encoding)
-
         if self.save_corrupted_program:
-            self._save_corrupted_program(program)
+            self._save_corrupted_program(dict(program.items()) if self.lazy else program)
 
         return program
 
@@ -0,0 +1,151 @@
+"""
+Lazy candidates of a corrupted program.
+
+A word hit by lost packets has 2^k candidates, k being the amount of erased bits. Most of them are undefined
+and discarded by the recovery anyway. Instead of building an instruction for each candidate, an erased word keeps
+the bits known and a mask of the bits erased. Candidates are enumerated in batches, and only the defined ones
+become instructions, when the address is first read.
+"""
+from collections.abc import MutableMapping
+
+import numpy
+
+from semantic_codec.architecture.capstone_decoder import CapstoneDecoder
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+
+
+class ErasedWord(object):
+    """
+    A word with some of its bits erased
+    """
+
+    __slots__ = ('known', 'mask')
+
+    # Amount of candidates enumerated and decoded at once
+    BATCH_WORDS = 4096
+
+    def __init__(self, encoding, mask):
+        """
+        :param encoding: Encoding of the word. The erased bits are ignored
+        :param mask: Mask with the erased bits on
+        """
+        self.mask = mask & 0xFFFFFFFF
+        self.known = encoding & ~self.mask & 0xFFFFFFFF
+
+    @staticmethod
+    def mask_of(tuples):
+        """
+        Mask of a list of (lo, hi) ranges of erased bits, hi not included
+        """
+        mask = 0
+        for lo, hi in tuples:
+            mask |= ((1 << (hi - lo)) - 1) << lo
+        return mask
+
+    @property
+    def erased_bits(self):
+        return bin(self.mask).count('1')
+
+    def __len__(self):
+        return 1 << self.erased_bits
+
+    def encodings(self):
+        """
+        Enumerates the candidate encodings in ascending order
+        :return: A generator of arrays with up to BATCH_WORDS encodings each
+        """
+        positions = [b for b in range(0, 32) if self.mask >> b & 1]
+        for start in range(0, len(self), ErasedWord.BATCH_WORDS):
+            i = numpy.arange(start, min(len(self), start + ErasedWord.BATCH_WORDS), dtype=numpy.uint64)
+            batch = numpy.full(len(i), self.known, dtype=numpy.uint64)
+            # Deposit the bits of the counter in the erased positions
+            for j, b in enumerate(positions):
+                batch |= (i >> numpy.uint64(j) & numpy.uint64(1)) << numpy.uint64(b)
+            yield batch.astype(numpy.uint32)
+
+    def candidates(self, address):
+        """
+        Enumerates the defined candidates of the word
+        :param address: Address of the word
+        :return: A generator of CAPSInstruction in ascending order of encoding
+        """
+        for batch in self.encodings():
+            batch = batch.tolist()
+            defined = [e for e, d in zip(batch, CapstoneDecoder.defined_many(batch)) if d]
+            for inst in CAPSInstruction.decode_many(defined, [address] * len(defined)):
+                yield inst
+
+
+class LazyCorruptedProgram(MutableMapping):
+    """
+    A corrupted program in the form {address: [instructions]} whose corrupted addresses are kept as erased words
+    until they are read. Reading an address enumerates the candidates of its erased words, keeps the defined ones
+    and caches them as a regular list of instructions.
+
+    Unlike the eager corruption, undefined candidates are not kept, since the recovery ignores them.
+    """
+
+    def __init__(self, program):
+        """
+        :param program: The original program in the form {address: [instructions]}, shared, not copied
+        """
+        self._program = program
+        self._erased = {}
+
+    def erase(self, address, mask):
+        """
+        Erases bits of the instructions of an address
+        :param mask: Erasure mask, with the erased bits on
+        """
+        mask = int(mask)
+        words = self._erased.get(address)
+        if words is None:
+            words = [ErasedWord(inst.encoding, 0) for inst in self._program[address]]
+        self._erased[address] = [ErasedWord(w.known, w.mask | mask) for w in words]
+
+    def erased_words(self, address):
+        """
+        The erased words of an address, an empty list if it is not corrupted or was already read
+        """
+        return self._erased.get(address, [])
+
+    def candidates(self, address):
+        """
+        Enumerates the defined candidates of an address, without caching them
+        """
+        if address not in self._erased:
+            for inst in self._program[address]:
+                yield inst
+            return
+        seen = set()
+        for word in self._erased[address]:
+            for inst in word.candidates(address):
+                if inst.encoding not in seen:
+                    seen.add(inst.encoding)
+                    yield inst
+
+    def __getitem__(self, address):
+        if address in self._erased:
+            candidates = list(self.candidates(address))
+            if len(self._erased[address]) > 1:
+                candidates.sort(key=lambda x: x.encoding)
+            self._program[address] = candidates
+            del self._erased[address]
+        return self._program[address]
+
+    def __setitem__(self, address, instructions):
+        self._erased.pop(address, None)
+        self._program[address] = instructions
+
+    def __delitem__(self, address):
+        self._erased.pop(address, None)
+        del self._program[address]
+
+    def __contains__(self, address):
+        return address in self._program
+
+    def __iter__(self):
+        return iter(self._program)
+
+    def __len__(self):
+        return len(self._program)
@@ -0,0 +1,137 @@
+"""
+Interleaving of whole buffers with array operations.
+
+The data is seen as a bit array, word by word, from the lowest bit of each word to the highest. The bit array is
+cut in chunks of word_size bits, and chunk k goes to the packet interleave_order[k % packets], in the position
+k // packets of the packet. This is the same distribution of interleave() and deinterleave(), done with a single
+fancy indexing scatter (and gather, to deinterleave) instead of moving the chunks one by one.
+
+The packets are kept as bit planes: an array of shape (packets, rows, word_size) with the bits of every chunk.
+"""
+from math import ceil
+
+import numpy
+
+from semantic_codec.architecture.bits import BitQueue
+
+
+class BitPlaneInterleaver(object):
+    """
+    Interleaves and deinterleaves buffers of 32 bits words following an interleave order
+    """
+
+    def __init__(self, interleave_order, word_size=8):
+        """
+        :param interleave_order: Order of the packets, a permutation of range(packets)
+        :param word_size: Size of the chunks of data interleaved. Must divide the word size of 32 bits.
+        """
+        if BitQueue.WORD_SIZE % word_size != 0:
+            raise RuntimeError('The chunk size {} does not divide the word size'.format(word_size))
+        self.order = numpy.asarray(interleave_order).astype(numpy.intp)
+        if not numpy.array_equal(numpy.sort(self.order), numpy.arange(len(self.order))):
+            raise RuntimeError('The interleave order is not a permutation of the packets')
+        self.word_size = word_size
+
+    @property
+    def packet_count(self):
+        return len(self.order)
+
+    def chunk_count(self, word_count):
+        """
+        Amount of chunks of a buffer of word_count words
+        """
+        return word_count * BitQueue.WORD_SIZE // self.word_size
+
+    def packet_lengths(self, chunk_count):
+        """
+        Amount of chunks each packet receives out of chunk_count chunks
+        :return: An array with the amount of chunks of each packet, indexed by packet
+        """
+        lengths = numpy.empty(self.packet_count, dtype=numpy.int64)
+        lengths[self.order] = chunk_count // self.packet_count + \
+                              (numpy.arange(self.packet_count) < chunk_count % self.packet_count)
+        return lengths
+
+    @staticmethod
+    def to_bits(words):
+        """
+        Bits of a buffer of 32 bits words, lowest bit of each word first
+        """
+        words = numpy.ascontiguousarray(words, dtype='<u4')
+        return numpy.unpackbits(words.view(numpy.uint8), bitorder='little')
+
+    @staticmethod
+    def to_words(bits):
+        """
+        Inverse of to_bits. The amount of bits must be a multiple of 32.
+        """
+        return numpy.packbits(bits, bitorder='little').view('<u4')
+
+    def interleave(self, words):
+        """
+        Distributes the chunks of a buffer among the packets
+        :param words: Array of 32 bits words
+        :return: The bit planes of the packets, an array of shape (packets, rows, word_size) indexed by packet.
+                 The rows past the length of a packet are zero.
+        """
+        chunks = BitPlaneInterleaver.to_bits(words).reshape(-1, self.word_size)
+        rows = ceil(len(chunks) / self.packet_count)
+        padded = numpy.zeros((rows * self.packet_count, self.word_size), dtype=numpy.uint8)
+        padded[:len(chunks)] = chunks
+        planes = numpy.empty((self.packet_count, rows, self.word_size), dtype=numpy.uint8)
+        planes[self.order] = padded.reshape(rows, self.packet_count, self.word_size).transpose(1, 0, 2)
+        return planes
+
+    def gather(self, planes, received, chunk_count):
+        """
+        Puts back in order the chunks of the packets
+        :param planes: Bit planes of the packets, as returned by interleave. The planes of lost packets are ignored.
+        :param received: Boolean array, indexed by packet, False for the lost packets
+        :param chunk_count: Amount of chunks to gather
+        :return: The chunks, an array of shape (chunk_count, word_size), and a boolean array with the chunks lost
+        """
+        rows = ceil(chunk_count / self.packet_count)
+        planes = planes[:, :rows]
+        if planes.shape[1] < rows:
+            planes = numpy.concatenate((planes, numpy.zeros((self.packet_count, rows - planes.shape[1],
+                                                             self.word_size), dtype=numpy.uint8)), axis=1)
+        lost = ~numpy.asarray(received, dtype=bool)
+        chunks = planes[self.order].transpose(1, 0, 2).reshape(-1, self.word_size)[:chunk_count]
+        lost = numpy.broadcast_to(lost[self.order], (rows, self.packet_count)).reshape(-1)[:chunk_count]
+        chunks[lost] = 0
+        return chunks, lost
+
+    def deinterleave(self, planes, received, word_count):
+        """
+        Rebuilds a buffer out of the bit planes of its packets
+        :param planes: Bit planes of the packets, as returned by interleave
+        :param received: Boolean array, indexed by packet, False for the lost packets
+        :param word_count: Amount of words of the buffer
+        :return: The words of the buffer, and an erasure mask per word with the bits lost on
+        """
+        chunks, lost = self.gather(planes, received, self.chunk_count(word_count))
+        erased = numpy.repeat(lost, self.word_size).astype(numpy.uint8)
+        return BitPlaneInterleaver.to_words(chunks.reshape(-1)), BitPlaneInterleaver.to_words(erased)
+
+    def chunks_of_packet(self, packet, chunk_count):
+        """
+        Indexes of the chunks a packet carries, out of chunk_count chunks
+        """
+        position = int(numpy.flatnonzero(self.order == packet)[0])
+        return numpy.arange(position, chunk_count, self.packet_count)
+
+    def gather_words(self, planes, received, words):
+        """
+        Rebuilds some words of a buffer out of the bit planes of its packets
+        :param planes: Bit planes of the packets, as returned by interleave
+        :param received: Boolean array, indexed by packet, False for the lost packets
+        :param words: Indexes of the words to rebuild
+        :return: The words, and their erasure masks
+        """
+        per_word = BitQueue.WORD_SIZE // self.word_size
+        chunks = numpy.asarray(words, dtype=numpy.int64)[:, None] * per_word + numpy.arange(per_word)[None, :]
+        packets = self.order[chunks % self.packet_count]
+        bits = planes[packets, chunks // self.packet_count].reshape(-1)
+        lost = ~numpy.asarray(received, dtype=bool)[packets].reshape(-1)
+        erased = numpy.repeat(lost, self.word_size).astype(numpy.uint8)
+        return BitPlaneInterleaver.to_words(bits * (1 - erased)), BitPlaneInterleaver.to_words(erased)
@@ -1,7 +1,9 @@
+from functools import lru_cache
 from math import sqrt, fmod, floor, log
 import numpy
 
 from semantic_codec.architecture.bits import BitQueue
+from semantic_codec.interleaver.bit_plane import BitPlaneInterleaver
 
 
 def sucesive_packing(m):
@@ -14,54 +16,22 @@ def sucesive_packing(m):
     if m <= 0:
         return [[0]]
 
-    matrix = numpy.zeros(shape=(2 ** m, 2 ** m))
+    matrix = numpy.zeros(shape=(1, 1))
 
-    matrix[0, 0] = 0
-    matrix[0, 1] = 2
-    matrix[1, 0] = 3
-    matrix[1, 1] = 1
-
-    for n in range(1, m):
-        # Indexes
-        w = 2 ** n
-
-        # 4x + 2 quadrant (upper right)
-        for i in range(w, w + w):
-            for j in range(0, w):
-                matrix[j, i] = int(matrix[j, i - w] * 4 + 2)
-
-        # 4x + 3 (lower left)
-        for i in range(0, w):
-            for j in range(w, w + w):
-                matrix[j, i] = int(matrix[j - w, i] * 4 + 3)
-
-        # 4x + 1 (lower right)
-        for i in range(w, w + w):
-            for j in range(w, w + w):
-                matrix[j, i] = int(matrix[j - w, i - w] * 4 + 1)
-
-        # 4x quadrant (upper left)
-        for i in range(0, w):
-            for j in range(0, w):
-                matrix[j, i] = int(4 * matrix[j, i])
+    for n in range(0, m):
+        # Each level places four copies of the previous matrix in the quadrants:
+        # 4x (upper left), 4x + 2 (upper right), 4x + 3 (lower left) and 4x + 1 (lower right)
+        quarter = 4 * matrix
+        matrix = numpy.block([[quarter, quarter + 2], [quarter + 3, quarter + 1]])
 
     return matrix
 
 
-def build_2d_interleave_sp(packets, flat=False):
+@lru_cache(maxsize=64)
+def _interleave_sp_rows(packets):
     """
-    Builds a 4^nx4^n matrix set for interleaving a 2D data. It uses the successive packing algorithm
-    by Shi and Zhang described in "A new two-dimensional interleaving technique using successive packing"
-
-    The SP algorithm works only with 4^nx4^n matrices. In order to fit data of any size into that, we
-    build several matrices of size 4^n, 4^(n-1)... 4^0 and then we interleave them once more using a simple
-    algorithm that goes through all matrices taking the mth row each time.
-
-    :param packets: Number of packets to pack the data
-    :param flat: Indicates to return the interleave in a single list, as opposed to a matrix form
-    :return:
+    Rows of the interleave built by build_2d_interleave_sp, cached by packet count. The rows are read only.
     """
-
     matrices = []
     current_package_index = 0
 
@@ -70,9 +40,6 @@ def build_2d_interleave_sp(packets, flat=False):
 
         # Find a 4^m X 4^m such as 4^m is the closest power of 4 smaller than the packet size
         n = floor(log(packets, 4))
-        matrix_size = int(2 ** n)
-        #if matrix_size < 1:
-        #    break
 
         # Compute the number of packets that fits in this matrix
         packets_in_matrix = 4 ** n
@@ -81,27 +48,12 @@ def build_2d_interleave_sp(packets, flat=False):
         matrix_count = floor(packets / packets_in_matrix)
 
         if matrix_count > 0:
-            # Obtain the sucesive packing for a matrix of this size.
-            m1 = sucesive_packing(n)
-            for i in range(0, matrix_size):
-                for j in range(0, matrix_size):
-                    m1[i][j] += current_package_index
-
-            # Since a matrix only fits 4^n packets, count how many packets we have allotted so far
-            current_package_index += packets_in_matrix
-
-            # Append the matrix to the resulting set of matrices
-            matrices.append(m1)
-
-            # Then obtain other matrices of the same size.
-            # Don't compute the same sucesive packing twice, just add the index to the first matrix obtained
-            for k in range(0, matrix_count - 1):
-                mi = numpy.zeros(shape=(2 ** n, 2 ** n))
-                for i in range(0, matrix_size):
-                    for j in range(0, matrix_size):
-                        mi[i][j] = m1[i][j] + packets_in_matrix * (k + 1)
-                current_package_index += packets_in_matrix
-                matrices.append(mi)
+            # Obtain the sucesive packing for a matrix of this size once,
+            # the other matrices of the same size just add their index to it
+            m1 = numpy.asarray(sucesive_packing(n), dtype=float) + current_package_index
+            for k in range(0, matrix_count):
+                matrices.append(m1 + packets_in_matrix * k)
+            current_package_index += packets_in_matrix * matrix_count
         # Compute how many packets remain to be allotted
         packets = fmod(packets, packets_in_matrix * matrix_count)
 
@@ -111,15 +63,38 @@ def build_2d_interleave_sp(packets, flat=False):
         for i in range(0, len(matrices)):
             if len(matrices[i]) > n:
                 result.append(matrices[i][n])
+    for r in result:
+        r.flags.writeable = False
+    return tuple(result)
+
+
+@lru_cache(maxsize=64)
+def _interleave_sp_flat(packets):
+    flat = numpy.concatenate(_interleave_sp_rows(packets))
+    flat.flags.writeable = False
+    return flat
+
 
+def build_2d_interleave_sp(packets, flat=False):
+    """
+    Builds a 4^nx4^n matrix set for interleaving a 2D data. It uses the successive packing algorithm
+    by Shi and Zhang described in "A new two-dimensional interleaving technique using successive packing"
+
+    The SP algorithm works only with 4^nx4^n matrices. In order to fit data of any size into that, we
+    build several matrices of size 4^n, 4^(n-1)... 4^0 and then we interleave them once more using a simple
+    algorithm that goes through all matrices taking the mth row each time.
+
+    The interleave is cached by packet count, every call returns its own copy.
+
+    :param packets: Number of packets to pack the data
+    :param flat: Indicates to return the interleave in a single list, as opposed to a matrix form
+    :return:
+    """
     # Give the order as a flat list of numbers
     if flat:
-        flat_result = []
-        for r in result:
-            flat_result.extend(r)
-        return flat_result
+        return list(_interleave_sp_flat(packets))
 
-    return result
+    return [r.copy() for r in _interleave_sp_rows(packets)]
 
 
 def build_2d_interleave_matrix_blaum(message_size, packet_size, data_width=-1, data_height=-1):
@@ -168,32 +143,27 @@ def interleave(data, interleave_order, word_size=8):
     :param data: List of integers containing the raw data to interleave.
     :param matrix: List of inegers containing the interleaving order
     :param word_size: Number with the size of the chunk of data that is going to be interleaved. By default is 8 (a byte).
+    Must divide 32.
     :return: The data interleaved according to the interleave order
     """
-    packets = {int(index): BitQueue(word_size) for index in interleave_order}
-
-    bit_index = 0
-    arr_index = 0
-    k = 0
-    while arr_index < len(data):
-        pkt = packets[interleave_order[k]]
-        pkt.enqueue(data[arr_index], bit_index)
-        bit_index += word_size
-        k = 0 if k == len(interleave_order) - 1 else k + 1
-        if bit_index > 31 and arr_index < len(data):
-            bit_index -= 32
-            arr_index += 1
+    engine = BitPlaneInterleaver(interleave_order, word_size)
+    if isinstance(data, (bytes, bytearray)):
+        # Every item is a word
+        data = numpy.frombuffer(data, dtype=numpy.uint8)
+    planes = engine.interleave(numpy.asarray(data, dtype=numpy.uint32))
+    lengths = engine.packet_lengths(engine.chunk_count(len(data)))
 
-    return packets
+    return {p: BitQueue.from_bits(planes[p, :lengths[p]].reshape(-1), word_size) for p in range(len(planes))}
 
 
-def deinterleave(packets, interleave_order, word_size=8):
+def deinterleave(packets, interleave_order, word_size=8, erasure_masks=False):
     """
     Deinterleaves the data. If a packet is missing, it adds this information to the error list.
     :param packets: Packets receive
     :param interleave_order: Order in which the packets are interleaved
     :param word_size: Size of the arrays word size
-    :return: Data and the error list
+    :param erasure_masks: Give the errors as an array with the erasure mask of each word of the data
+    :return: Data and the error list, a list of (word, bit) tuples with the first bit of each chunk lost
     """
     k = len(interleave_order) - 1
     while k > -1 and packets[interleave_order[k]] is None:
@@ -205,19 +175,24 @@ def deinterleave(packets, interleave_order, word_size=8):
     else:
         last_queue = packets[interleave_order[k]]
 
-    errors = []
-
-    data = BitQueue(word_size)
-    while not last_queue.empty():
-        for p in interleave_order:
-            a = 0
-            if not p in packets or packets[p] is None:
-                errors.append((data._eq_word, data._eq_bit))
-            else:
-                a = packets[p].dequeue(a, 0)
-            data.enqueue(a, 0)
-
-    return (data.get_bytes(), errors)
-
-
-
+    # Gather as many rounds of the interleave order as chunks has the last packet received
+    engine = BitPlaneInterleaver(interleave_order, word_size)
+    rows = len(last_queue.bits()) // word_size
+    planes = numpy.zeros((engine.packet_count, rows, word_size), dtype=numpy.uint8)
+    received = numpy.zeros(engine.packet_count, dtype=bool)
+    for p, queue in packets.items():
+        if queue is not None:
+            bits = queue.bits()[:rows * word_size]
+            planes[int(p)].reshape(-1)[:len(bits)] = bits
+            received[int(p)] = True
+    chunks, lost = engine.gather(planes, received, rows * engine.packet_count)
+    data = BitQueue.from_bits(chunks.reshape(-1), word_size).get_bytes()
+
+    if erasure_masks:
+        erased = numpy.zeros(len(data) * BitQueue.WORD_SIZE, dtype=numpy.uint8)
+        erased[:len(lost) * word_size] = numpy.repeat(lost, word_size)
+        return data, BitPlaneInterleaver.to_words(erased)
+
+    bit_index = numpy.flatnonzero(lost) * word_size
+    errors = list(zip((bit_index // BitQueue.WORD_SIZE).tolist(), (bit_index % BitQueue.WORD_SIZE).tolist()))
+    return data, errors
@@ -0,0 +1,166 @@
+"""
+Inverted index from the fields of the candidates of a corrupted program to the addresses where they are found.
+
+Several stages ask which addresses still have a candidate with a given conditional, opcode or storage, and how
+many there are. Scanning the program for every question is quadratic, as candidates are removed one address at a
+time. The index is kept as the candidates are added and removed instead: each change only touches the fields of
+the candidate changed.
+"""
+
+
+class CandidateIndex(object):
+    """
+    Addresses having a candidate with each conditional, opcode and storage. Candidates with ignore on are not
+    indexed. The address_with_cond, address_with_op and address_with_reg dictionaries are the same as the ones of
+    CorruptedProgramMetadataCollector, and are kept current.
+    """
+
+    # Kinds of fields
+    COND = 0
+    OP = 1
+    REG = 2
+
+    def __init__(self):
+        # For each kind, {field: {address: amount of candidates using the field at the address}}
+        self._with = {}, {}, {}
+        # The same, by address: {address: ({cond: amount}, {opcode: amount}, {storage: amount})}
+        self._at = {}
+        # Number of addresses having at least one candidate with a given conditional, opcode and register
+        self.address_with_cond = {}
+        self.address_with_op = {}
+        self.address_with_reg = {}
+        self._counts = self.address_with_cond, self.address_with_op, self.address_with_reg
+
+    @staticmethod
+    def fields_of(inst):
+        """
+        Conditionals, opcodes and storages of a candidate, each one once
+        """
+        return (inst.conditional_field,), (inst.opcode_field,), set(inst.storages_used())
+
+    @staticmethod
+    def from_program(program):
+        index = CandidateIndex()
+        index.collect(program)
+        return index
+
+    def collect(self, program):
+        """
+        Indexes all the candidates of a program in the form {address: [candidates]}
+        """
+        self.__init__()
+        for addr, candidates in program.items():
+            for inst in candidates:
+                self.add(addr, inst)
+
+    def _change(self, addr, kind, field, amount, changed):
+        """
+        Changes the amount of candidates using a field at an address
+        """
+        at = self._at[addr][kind]
+        n = at.get(field, 0) + amount
+        if n < 0:
+            raise RuntimeError('Field {} is not indexed at {}'.format(field, addr))
+        with_field = self._with[kind].setdefault(field, {})
+        count = self._counts[kind]
+        if n == 0:
+            del at[field]
+            del with_field[addr]
+            if not with_field:
+                del self._with[kind][field]
+            count[field] -= 1
+            if count[field] == 0:
+                del count[field]
+            changed[kind].add(field)
+        else:
+            if field not in at:
+                count[field] = count.get(field, 0) + 1
+                changed[kind].add(field)
+            at[field] = n
+            with_field[addr] = n
+
+    def _move(self, addr, inst, amount):
+        changed = set(), set(), set()
+        if inst.ignore:
+            return changed
+        if addr not in self._at:
+            self._at[addr] = {}, {}, {}
+        for kind, fields in enumerate(CandidateIndex.fields_of(inst)):
+            for field in fields:
+                self._change(addr, kind, field, amount, changed)
+        return changed
+
+    def add(self, addr, inst):
+        """
+        Indexes a candidate
+        :return: The conditionals, opcodes and registers whose counts of addresses changed
+        """
+        return self._move(addr, inst, 1)
+
+    def remove(self, addr, inst):
+        """
+        Takes a candidate out of the index. The candidate must not have changed since it was added.
+        :return: The conditionals, opcodes and registers whose counts of addresses changed
+        """
+        return self._move(addr, inst, -1)
+
+    def remove_address(self, addr):
+        """
+        Takes all the candidates of an address out of the index
+        """
+        changed = set(), set(), set()
+        if addr in self._at:
+            for kind, at in enumerate(self._at[addr]):
+                for field, n in list(at.items()):
+                    self._change(addr, kind, field, -n, changed)
+            del self._at[addr]
+        return changed
+
+    def update(self, program, addresses):
+        """
+        Updates the index after the candidates of some addresses changed, when the candidates removed are not known
+        :param addresses: Addresses whose candidates changed
+        :return: The conditionals, opcodes and registers whose counts of addresses changed
+        """
+        changed = set(), set(), set()
+        for addr in addresses:
+            after = {}, {}, {}
+            for inst in program[addr]:
+                if not inst.ignore:
+                    for kind, fields in enumerate(CandidateIndex.fields_of(inst)):
+                        for field in fields:
+                            after[kind][field] = after[kind].get(field, 0) + 1
+            if addr not in self._at:
+                self._at[addr] = {}, {}, {}
+            for kind in range(0, 3):
+                before = self._at[addr][kind]
+                for field in set(before) | set(after[kind]):
+                    amount = after[kind].get(field, 0) - before.get(field, 0)
+                    if amount != 0:
+                        self._change(addr, kind, field, amount, changed)
+        return changed
+
+    def addresses(self, kind, field):
+        """
+        Addresses having a candidate with a field
+        :param kind: COND, OP or REG
+        """
+        return self._with[kind].get(field, {}).keys()
+
+    def addresses_with_cond(self, cond):
+        """
+        Number of addresses having a candidate with a conditional
+        """
+        return self.address_with_cond.get(cond, 0)
+
+    def addresses_with_op(self, op):
+        """
+        Number of addresses having a candidate with an opcode
+        """
+        return self.address_with_op.get(op, 0)
+
+    def addresses_with_reg(self, reg):
+        """
+        Number of addresses having a candidate with a storage
+        """
+        return self.address_with_reg.get(reg, 0)
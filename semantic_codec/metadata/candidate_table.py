@@ -0,0 +1,312 @@
+"""
+Columnar representation of a corrupted program.
+
+The recovery stages see a corrupted program as {address: [candidate instructions]}. That is convenient for the rules,
+but every candidate is a full Python object with its own dictionaries and lists. The CandidateTable keeps the same
+information in parallel NumPy arrays, one row per candidate, grouped by address in CSR style:
+the candidates of the i-th address are the rows offsets[i] to offsets[i + 1].
+
+Hot loops work directly on the arrays. The view layer (CandidateInstruction and CandidateProgram) exposes the rows
+as instructions so the existing rules keep working on top of the table. The selection of candidates under the
+counts of the metadata (CountTable, MapSelector and CountSolver) reads the fields from the columns.
+"""
+from collections.abc import Mapping, MutableMapping
+
+import numpy
+
+from semantic_codec.architecture.capstone_decoder import CapstoneDecoder
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+
+
+class CandidateTable(object):
+    """
+    Candidates of a corrupted program stored column wise.
+
+    Columns (one row per candidate):
+     - encoding: 32 bit encoding of the candidate
+     - cond: conditional field (-1 for undefined words)
+     - opcode: opcode id (0 for undefined words)
+     - registers: mask of the storages used (see DecodedFeatures)
+     - ignore: the candidate is undefined or was discarded
+     - scores: a column per rule, NaN where the rule has not scored the candidate
+    """
+
+    def __init__(self, addresses, offsets, encodings, ignore=None):
+        """
+        :param addresses: Sorted addresses of the program
+        :param offsets: Row where the candidates of each address start, plus the total amount of rows
+        :param encodings: Encoding of each candidate
+        :param ignore: Optional flags of the candidates to ignore. Undefined candidates are always ignored
+        """
+        self.addresses = numpy.asarray(addresses, dtype=numpy.uint32)
+        self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+        self.encoding = numpy.asarray(encodings, dtype=numpy.uint32)
+        if len(self.offsets) != len(self.addresses) + 1 or self.offsets[-1] != len(self.encoding):
+            raise RuntimeError('Offsets do not match the addresses and candidates')
+
+        # Decode each distinct encoding once and broadcast its fields to the rows
+        unique, inverse = numpy.unique(self.encoding, return_inverse=True)
+        cond = numpy.full(len(unique), -1, dtype=numpy.int8)
+        opcode = numpy.zeros(len(unique), dtype=numpy.uint16)
+        registers = numpy.zeros(len(unique), dtype=numpy.uint32)
+        undefined = numpy.zeros(len(unique), dtype=bool)
+        for i, features in enumerate(CapstoneDecoder.features_many(unique)):
+            if features is None:
+                undefined[i] = True
+            else:
+                cond[i] = features.cond
+                opcode[i] = features.opcode
+                registers[i] = features.used_mask
+
+        self.cond = cond[inverse]
+        self.opcode = opcode[inverse]
+        self.registers = registers[inverse]
+        self.ignore = undefined[inverse]
+        if ignore is not None:
+            self.ignore |= numpy.asarray(ignore, dtype=bool)
+        self.scores = {}
+
+        # Views over the rows, built on demand
+        self._views = {}
+
+    @staticmethod
+    def from_program(program):
+        """
+        Builds the table from a program in the form {address: [instructions]}
+        """
+        addresses = sorted(program.keys())
+        offsets = [0]
+        encodings, ignore, rows = [], [], []
+        for addr in addresses:
+            for inst in program[addr]:
+                encodings.append(inst.encoding)
+                ignore.append(inst.ignore)
+                rows.append(inst.scores_by_rule)
+            offsets.append(len(encodings))
+
+        table = CandidateTable(addresses, offsets, encodings, ignore)
+        for row, scores in enumerate(rows):
+            for rule, score in scores.items():
+                table.score_column(rule)[row] = score
+        return table
+
+    def to_program(self):
+        """
+        Returns a program in the form {address: [CAPSInstruction]} with its own copy of the scores
+        """
+        program = {}
+        instructions = CAPSInstruction.decode_many(self.encoding, self.row_addresses())
+        for i in range(0, len(self.addresses)):
+            program[int(self.addresses[i])] = instructions[self.offsets[i]:self.offsets[i + 1]]
+        for row, inst in enumerate(instructions):
+            inst.ignore = bool(self.ignore[row])
+            for rule, column in self.scores.items():
+                if not numpy.isnan(column[row]):
+                    inst.scores_by_rule[rule] = float(column[row])
+        return program
+
+    def __len__(self):
+        return len(self.encoding)
+
+    @property
+    def address_count(self):
+        return len(self.addresses)
+
+    def counts(self):
+        """
+        Amount of candidates of each address
+        """
+        return numpy.diff(self.offsets)
+
+    def row_address_index(self):
+        """
+        Index of the address of each row
+        """
+        return numpy.repeat(numpy.arange(len(self.addresses)), self.counts())
+
+    def row_addresses(self):
+        """
+        Address of each row
+        """
+        return numpy.repeat(self.addresses, self.counts())
+
+    def row_address(self, row):
+        """
+        Address of a single row
+        """
+        return int(self.addresses[numpy.searchsorted(self.offsets, row, side='right') - 1])
+
+    def live_counts(self):
+        """
+        Amount of candidates not ignored at each address
+        """
+        return numpy.bincount(self.row_address_index(), weights=~self.ignore,
+                              minlength=len(self.addresses)).astype(numpy.int64)
+
+    def address_index(self, address):
+        """
+        Index of an address in the table, or -1 if the address is not in the program
+        """
+        i = int(numpy.searchsorted(self.addresses, address))
+        if i < len(self.addresses) and self.addresses[i] == address:
+            return i
+        return -1
+
+    def rows(self, address):
+        """
+        Rows of the candidates of an address
+        """
+        i = self.address_index(address)
+        if i < 0:
+            raise KeyError(address)
+        return range(self.offsets[i], self.offsets[i + 1])
+
+    def score_column(self, rule):
+        """
+        Returns the column of scores given by a rule, creating it if needed
+        """
+        if rule not in self.scores:
+            self.scores[rule] = numpy.full(len(self.encoding), numpy.nan)
+        return self.scores[rule]
+
+    def select(self, keep):
+        """
+        Returns a new table keeping only some candidates. All addresses are kept, even if they loose all candidates.
+        :param keep: Boolean array indicating the rows to keep
+        """
+        keep = numpy.asarray(keep, dtype=bool)
+        kept_per_address = numpy.bincount(self.row_address_index(), weights=keep,
+                                          minlength=len(self.addresses)).astype(numpy.int64)
+        # Copy the columns, there is no need to decode again
+        table = CandidateTable.__new__(CandidateTable)
+        table.addresses = self.addresses
+        table.offsets = numpy.concatenate(([0], numpy.cumsum(kept_per_address)))
+        table.encoding = self.encoding[keep]
+        table.cond = self.cond[keep]
+        table.opcode = self.opcode[keep]
+        table.registers = self.registers[keep]
+        table.ignore = self.ignore[keep]
+        table.scores = {rule: column[keep] for rule, column in self.scores.items()}
+        table._views = {}
+        return table
+
+    def nbytes(self):
+        """
+        Memory used by the columns of the table
+        """
+        size = self.addresses.nbytes + self.offsets.nbytes + self.encoding.nbytes + self.cond.nbytes + \
+            self.opcode.nbytes + self.registers.nbytes + self.ignore.nbytes
+        for column in self.scores.values():
+            size += column.nbytes
+        return size
+
+    def instruction(self, row):
+        """
+        Returns the view of a row as an instruction
+        """
+        try:
+            return self._views[row]
+        except KeyError:
+            view = CandidateInstruction(self, row)
+            self._views[row] = view
+            return view
+
+    def candidates(self, address):
+        """
+        Returns the views of the candidates of an address
+        """
+        return [self.instruction(row) for row in self.rows(address)]
+
+    def program(self):
+        """
+        Returns a view of the table in the form {address: [instructions]}
+        """
+        return CandidateProgram(self)
+
+
+class CandidateScores(MutableMapping):
+    """
+    The scores_by_rule dictionary of a row, stored in the table's score columns
+    """
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, rule):
+        column = self._table.scores.get(rule)
+        if column is None or numpy.isnan(column[self._row]):
+            raise KeyError(rule)
+        return float(column[self._row])
+
+    def __setitem__(self, rule, score):
+        self._table.score_column(rule)[self._row] = score
+
+    def __delitem__(self, rule):
+        if rule not in self:
+            raise KeyError(rule)
+        self._table.scores[rule][self._row] = numpy.nan
+
+    def __iter__(self):
+        return iter([k for k, column in self._table.scores.items() if not numpy.isnan(column[self._row])])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class CandidateInstruction(CAPSInstruction):
+    """
+    A row of the candidate table seen as an instruction. The scores and the ignore flag live in the table.
+    """
+
+    def __init__(self, table, row):
+        super(CandidateInstruction, self).__init__(int(table.encoding[row]), table.row_address(row))
+        self._table = table
+        self._row = row
+        self.scores_by_rule = CandidateScores(table, row)
+
+    @property
+    def row(self):
+        return self._row
+
+    @property
+    def ignore(self):
+        return bool(self._table.ignore[self._row])
+
+    @ignore.setter
+    def ignore(self, v):
+        self._table.ignore[self._row] = v or self.is_undefined
+
+
+class CandidateProgram(Mapping):
+    """
+    Read only view of a table in the form {address: [instructions]}, so rules written for programs keep working.
+
+    The lists are views, removing items from them does not remove the candidates from the table.
+    Use CandidateTable.select to prune candidates.
+    """
+
+    def __init__(self, table):
+        self._table = table
+        self._lists = {}
+
+    @property
+    def table(self):
+        return self._table
+
+    def __getitem__(self, address):
+        try:
+            return self._lists[address]
+        except KeyError:
+            result = self._table.candidates(address)
+            self._lists[address] = result
+            return result
+
+    def __contains__(self, address):
+        return self._table.address_index(address) >= 0
+
+    def __iter__(self):
+        return (int(a) for a in self._table.addresses)
+
+    def __len__(self):
+        return len(self._table.addresses)
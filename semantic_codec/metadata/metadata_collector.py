@@ -121,27 +121,61 @@ class CorruptedProgramMetadataCollector(object):
         self.address_with_op = {}
         # Number of address having at least one candidate with a given register
         self.address_with_reg = {}
+        # Conditionals, opcodes and registers found at each address
+        self.address_keys = {}
+
+    @staticmethod
+    def keys_of(candidates):
+        """
+        Returns the conditionals, opcodes and registers of the candidates of an address not being ignored
+        """
+        cond, op, reg = {}, {}, {}
+        for inst in candidates:
+            if inst.ignore:
+                continue
+            cond[inst.conditional_field] = 1
+            op[inst.opcode_field] = 1
+            for s in inst.storages_used():
+                reg[s] = 1
+        return tuple(cond), tuple(op), tuple(reg)
 
     def collect(self, program):
 
         self.address_with_cond = {}
         self.address_with_op = {}
         self.address_with_reg = {}
+        self.address_keys = {}
 
         for addr in program:
-            cond, op, reg = {}, {}, {}
-            for inst in program[addr]:
-                if inst.ignore:
-                    continue
-                cond[inst.conditional_field] = 1
-                op[inst.opcode_field] = 1
-                for s in inst.storages_used():
-                    reg[s] = 1
-            for k in cond.keys():
+            cond, op, reg = CorruptedProgramMetadataCollector.keys_of(program[addr])
+            self.address_keys[addr] = (cond, op, reg)
+            for k in cond:
                 _inc_key(self.address_with_cond, k)
-            for k in op.keys():
+            for k in op:
                 _inc_key(self.address_with_op, k)
-            for k in reg.keys():
+            for k in reg:
                 _inc_key(self.address_with_reg, k)
 
-            pass
+    def update(self, program, addresses):
+        """
+        Updates the counts after the candidates of some addresses changed
+        :param addresses: Addresses whose candidates changed
+        :return: The conditionals, opcodes and registers whose counts changed
+        """
+        changed = set(), set(), set()
+        counts = self.address_with_cond, self.address_with_op, self.address_with_reg
+        for addr in addresses:
+            before = self.address_keys[addr]
+            after = CorruptedProgramMetadataCollector.keys_of(program[addr])
+            self.address_keys[addr] = after
+            for b, a, count, c in zip(before, after, counts, changed):
+                b, a = set(b), set(a)
+                for k in b - a:
+                    count[k] -= 1
+                    if count[k] == 0:
+                        del count[k]
+                    c.add(k)
+                for k in a - b:
+                    _inc_key(count, k)
+                    c.add(k)
+        return changed
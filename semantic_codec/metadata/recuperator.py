@@ -2,9 +2,10 @@ from semantic_codec.architecture.arm_constants import AReg
 from semantic_codec.metadata.probabilistic_rules.counting_rules import ConditionalCount, InstructionCount, RegisterCount
 from semantic_codec.metadata.probabilistic_rules.rules import ControlFlowBehavior
 
-from semantic_codec.metadata.metadata_collector import CorruptedProgramMetadataCollector
+from semantic_codec.metadata.candidate_index import CandidateIndex
 from semantic_codec.metadata.probabilistic_model import DefaultProbabilisticModel
 from semantic_codec.metadata.probabilistic_rules.distance_rule import RegisterReadDistance
+from semantic_codec.metadata.register_write_index import RegisterWriteIndex
 from semantic_codec.report.print_progress import TextProgressBar
 
 
@@ -146,7 +147,48 @@ def probabilistic_rules_remove_step(scores_dict, inst):
     return score
 
 
+def remove_bad_candidates_at_addr(v):
+    previous = len(v)
+    one_count = 0
+    less_than_one_count = 0
+    i = 0
+    while i < len(v):
+        score = v[i].score()
+        if score == 1:
+            one_count += 1
+            i += 1
+        elif score == 0:
+            v.pop(i)
+        else:
+            less_than_one_count += 1
+            if one_count > 0:
+                v.pop(i)
+            else:
+                i += 1
+
+    if less_than_one_count > 0:
+        i = 0
+        while i < len(v):
+            score = v[i].score()
+            if score < 1 and one_count > 0:
+                v.pop(i)
+            else:
+                i += 1
+
+    return previous - len(v)
+
+
 class ProbabilisticRecuperator(Recuperator):
+
+    def __init__(self, collector, program, model=None, functions=None):
+        super(ProbabilisticRecuperator, self).__init__(collector, program, model, functions)
+        # State of the last recovery, kept to rescore incrementally
+        self._cpmd = None
+        self._write_index = None
+        self._members = None
+        self._summaries = {}
+        self._reads = {}
+
     def _pmf_register_distance(self, instruction):
         """
         Computes the probability that all the registers of a given instructions are read_instructions at this precise address
@@ -328,6 +370,28 @@ class ProbabilisticRecuperator(Recuperator):
 
         inst.scores_by_rule['popu'] = max(p1, p2, p3)
 
+    def _cfg_summary(self, addr):
+        """
+        Counts of the candidates of an address not being ignored used by the control flow rule: candidates per
+        conditional, candidates modifying the flags per conditional, candidates modifying the flags and candidates.
+        The counts are kept until the candidates of the address change.
+        """
+        try:
+            return self._summaries[addr]
+        except KeyError:
+            pass
+        conds, flag_conds, flag_mod, ln = {}, {}, 0, 0
+        for i in self._program[addr]:
+            if not i.ignore:
+                ln += 1
+                c = i.conditional_field
+                conds[c] = conds.get(c, 0) + 1
+                if i.writes_storage(AReg.CPSR):
+                    flag_mod += 1
+                    flag_conds[c] = flag_conds.get(c, 0) + 1
+        self._summaries[addr] = conds, flag_conds, flag_mod, ln
+        return self._summaries[addr]
+
     def _compute_proper_cfg(self, inst, cpmd, addr):
         """
         Computes the probability of this instruction of being placed in a proper place in the control flow.
@@ -361,29 +425,18 @@ class ProbabilisticRecuperator(Recuperator):
         ln_prev = 0
         ln_post = 0
 
+        cond = inst.conditional_field
         if prev_inst:
-            for i in prev_inst:
-                if not i.ignore:
-                    ln_prev += 1
-                    a = i.conditional_field == inst.conditional_field
-                    b = AReg.CPSR in i.registers_written()
-                    if a:
-                        same_cond += 1
-                    if b:
-                        flag_mod += 1
-                    # COMPUTE THE UNION OF BOTH EVENTS
-                    if a and b:
-                       union_count += 1
+            conds, flag_conds, flag_mod, ln_prev = self._cfg_summary(addr - 4)
+            same_cond = conds.get(cond, 0)
+            # COMPUTE THE UNION OF BOTH EVENTS
+            union_count = flag_conds.get(cond, 0)
 
         # Compute the probability of the following instruction having equal conditinal
         after = 0
         if post_inst:
-            after_same_cond = 0
-            for i in post_inst:
-                if not i.ignore:
-                    ln_post += 1
-                    if i.conditional_field == inst.conditional_field:
-                        after_same_cond += 1
+            conds, _, _, ln_post = self._cfg_summary(addr + 4)
+            after_same_cond = conds.get(cond, 0)
 
         all_conditional = 14
         p1, p2, p3 = 0, 0, 0
@@ -448,36 +501,13 @@ class ProbabilisticRecuperator(Recuperator):
         if inst.is_branch or inst.is_push_pop:
             return
 
-        dist_min = self._collector.storage_min_dist
-        dist_max = self._collector.storage_max_dist
-
         prd = 1
         # Compute register distance
         for r in inst.storages_read():
-            try:
-                a, b = dist_min[r], dist_max[r] + 1
-            except KeyError:
-                a, b = 0, 1
-
-            max_dist = addr - 4 * b
-            min_dist = addr - 4 * a
-
-            p = 1
-            for a in range(max_dist, min_dist):
-                count = 0
-                t = 0
-                if not a in self._program:
-                    continue
+            a, b = self._read_window(r)
 
-                for x in self._program[a]:
-                    if not x.ignore:
-                        t += 1
-                        if r in x.storages_written():
-                            count += 1
-                if t > 0:
-                    p *= 1 - count / t
-                    if p == 1:
-                        break
+            # Probability of the storage not being written in the window [addr - 4 * b, addr - 4 * a)
+            p = float(self._write_index.product(r, addr - 4 * b, addr - 4 * a))
 
             prd = min(p, prd)
             if prd >= 1:
@@ -513,8 +543,9 @@ class ProbabilisticRecuperator(Recuperator):
             # It might be possible that the address is computed dynamically,
             # therefore the jmp_address will be unknown
             inst.scores_by_rule['pbd'] = self._model.just_any_jump_is_valid * 2
-        # Award high prob to addresses inside this method or to the begin of other methods
-        elif jmp_addr >= current_fn and jmp_addr <= self._functions[current_fn][1]:
+        # Award high prob to addresses inside this method or to the begin of other methods.
+        # Without functions the bounds of the method are unknown
+        elif current_fn in self._functions and jmp_addr >= current_fn and jmp_addr <= self._functions[current_fn][1]:
             inst.scores_by_rule['pbd'] = self._model.branch_to_this_method
         # Award medium-high prob to a branch to the start of other method
         elif jmp_addr in self._functions:
@@ -526,40 +557,169 @@ class ProbabilisticRecuperator(Recuperator):
         else:
             inst.scores_by_rule['pbd'] = self._model.just_any_jump_is_valid * 2
 
+    def _corrupted_metadata(self):
+        """
+        Counts of conditionals, opcodes and registers over the candidates of the whole program
+        """
+        return CandidateIndex.from_program(self._program)
+
+    def _program_bounds(self):
+        """
+        Lowest and highest addresses of the program
+        """
+        return self._addresses[0], self._addresses[-1]
+
+    def _score_address(self, addr):
+        """
+        Scores all the candidates of an address not being ignored
+        """
+        cpmd = self._cpmd
+        current_fn = self._current_fn[addr]
+        lowest_addr, highest_addr = self._bounds
+        for inst in self._program[addr]:
+            if inst.ignore:
+                continue
+
+            # Sets the probabilistic rures function as the score calculation of the intruction
+            inst.score_function = probabilistic_rules_remove_step
+
+            self._compute_conditional(inst, cpmd)
+            self._compute_opcode(inst, cpmd)
+            self._compute_registers(inst, cpmd)
+            self._compute_push_pop(inst, cpmd, addr, current_fn)
+            self._compute_branch_address(inst, current_fn, lowest_addr, highest_addr)
+            # These rules take into consideration previous instructions,
+            # therefore they cannot be applied to the first instruction
+            if addr > lowest_addr:
+                self._compute_register_distance(inst, cpmd, addr)
+                self._compute_proper_cfg(inst, cpmd, addr)
+
+    def _read_window(self, r):
+        """
+        Window of the register distance rule for a storage: it is written between a and b instructions before
+        being read
+        """
+        try:
+            return self._collector.storage_min_dist[r], self._collector.storage_max_dist[r] + 1
+        except KeyError:
+            return 0, 1
+
+    def _distance_reads(self, addr):
+        """
+        Storages read by the candidates of an address scored by the register distance rule
+        """
+        try:
+            return self._reads[addr]
+        except KeyError:
+            pass
+        reads = set()
+        for inst in self._program[addr]:
+            if not inst.ignore and not inst.is_branch and not inst.is_push_pop:
+                reads.update(inst.storages_read())
+        self._reads[addr] = reads
+        return reads
+
+    def _affected_addresses(self, changed, written):
+        """
+        Addresses whose scores read the candidates of the changed addresses:
+         - the changed address itself and its neighbours (push/pop and control flow rules)
+         - the addresses reading a storage whose writers changed inside their register distance windows
+         - the start of the functions containing it (push rule)
+         - the addresses of the function starting at it (pop rule)
+        :param written: Storages whose writers changed at each of the changed addresses
+        """
+        if self._members is None:
+            self._members = {}
+            for addr in self._addresses:
+                self._members.setdefault(self._current_fn[addr], []).append(addr)
+        reach = max([self._read_window(r)[1] for r in self._collector.storage_max_dist] + [1])
+
+        affected = set()
+        for x in changed:
+            affected.update((x - 4, x, x + 4))
+            for k in range(1, reach + 1):
+                addr = x + 4 * k
+                if addr not in self._position:
+                    continue
+                for r in self._distance_reads(addr) & written[x]:
+                    a, b = self._read_window(r)
+                    if addr - 4 * b <= x < addr - 4 * a:
+                        affected.add(addr)
+                        break
+            for start, (_, end) in self._functions.items():
+                if start < x <= end:
+                    affected.add(start)
+            affected.update(self._members.get(x, []))
+        return sorted([a for a in affected if a in self._position])
+
+    def rescore(self, changed):
+        """
+        Updates the scores after some candidates were removed from the program, without scoring it all again.
+        Only the candidates whose scores read the changed addresses are scored again, as well as the conditional,
+        opcode and register scores whose program wide counts changed.
+
+        Must be called after recover
+        :param changed: Addresses whose candidates changed
+        :return: The addresses scored again
+        """
+        changed = sorted(set(changed))
+        if not changed:
+            return []
+        cpmd = self._cpmd
+        changed_keys = cpmd.update(self._program, changed)
+        written = self._write_index.update(self._program, changed)
+        for addr in changed:
+            self._summaries.pop(addr, None)
+            self._reads.pop(addr, None)
+
+        affected = self._affected_addresses(changed, written)
+        for addr in affected:
+            self._score_address(addr)
+
+        # The conditional, opcode and register scores depend on counts over the whole program
+        done = set(affected)
+        cond, op, reg = changed_keys
+        counted = set()
+        for kind, keys in enumerate(changed_keys):
+            for key in keys:
+                counted.update(cpmd.addresses(kind, key))
+        for addr in sorted(a for a in counted - done if a in self._position):
+            for inst in self._program[addr]:
+                if inst.ignore:
+                    continue
+                if inst.conditional_field in cond:
+                    self._compute_conditional(inst, cpmd)
+                if inst.opcode_field in op:
+                    self._compute_opcode(inst, cpmd)
+                if reg.intersection(inst.storages_used()):
+                    self._compute_registers(inst, cpmd)
+        return affected
+
     def _recover(self, progress_bar):
         # first, recopilate all the data we need once
         # This data consist in the amount of conditionals, operands and registers in the program
 
-        cpmd = CorruptedProgramMetadataCollector()
-        cpmd.collect(self._program)
+        self._cpmd = self._corrupted_metadata()
+        self._write_index = RegisterWriteIndex.from_program(self._program)
+        self._summaries = {}
+        self._reads = {}
 
         # Order addresses so we are sure we go from lower addresses to higher addresses
-        addresses = [a for a in self._program.keys()]
-        addresses.sort()
+        self._addresses = [a for a in self._program.keys()]
+        self._addresses.sort()
+        self._bounds = self._program_bounds()
+        self._position = {}
+        self._current_fn = {}
 
-        lowest_addr = addresses[0]
-        highest_addr = addresses[len(addresses) - 1]
-        current_fn = addresses[0]
+        current_fn = self._addresses[0]
 
-        for i in range(0, len(addresses)):
-            addr = addresses[i]
+        for i in range(0, len(self._addresses)):
+            addr = self._addresses[i]
             if addr in self._functions:
                 current_fn = addr
-            for inst in self._program[addr]:
-                if inst.ignore:
-                    continue
-
-                # Sets the probabilistic rures function as the score calculation of the intruction
-                inst.score_function = probabilistic_rules_remove_step
-
-                self._compute_conditional(inst, cpmd)
-                self._compute_opcode(inst, cpmd)
-                self._compute_registers(inst, cpmd)
-                self._compute_push_pop(inst, cpmd, addr, current_fn)
-                self._compute_branch_address(inst, current_fn, lowest_addr, highest_addr)
-                if i > 0:
-                    self._compute_register_distance(inst, cpmd, addr)
-                    self._compute_proper_cfg(inst, cpmd, addr)
+            self._position[addr] = i
+            self._current_fn[addr] = current_fn
+            self._score_address(addr)
             progress_bar.progress()
 
             """
@@ -0,0 +1,144 @@
+"""
+Index of the candidates writing each storage, used by the register distance rule.
+
+For a storage r read by a candidate, the register distance rule needs the probability of no instruction in a window
+of previous addresses writing r: the product of (1 - writers / candidates) over the addresses of the window.
+The index keeps, per storage, the prefix sums of the logarithm of those factors over the sorted addresses,
+so the product over any window comes from two lookups.
+"""
+import numpy
+
+
+class RegisterWriteIndex(object):
+    """
+    Per storage prefix log-sums of the fraction of live candidates not writing the storage.
+
+    Factors equal to zero (all the candidates of an address write the storage) are counted apart, as their
+    logarithm is not finite.
+    """
+
+    def __init__(self, addresses, live, writers):
+        """
+        :param addresses: Sorted addresses of the program
+        :param live: Amount of candidates not ignored at each address
+        :param writers: Dictionary with the amount of live candidates writing a storage at each address
+        """
+        self.addresses = numpy.asarray(addresses, dtype=numpy.int64)
+        self._live = numpy.array(live, dtype=numpy.int64)
+        self._writers = {r: numpy.append(numpy.asarray(w, dtype=numpy.int64), 0) for r, w in writers.items()}
+        self._no_writers = numpy.zeros(len(self.addresses) + 1, dtype=numpy.int64)
+        self._next_live = RegisterWriteIndex._first_live_after(self._live)
+        self._prefix = {}
+
+    @staticmethod
+    def _first_live_after(live):
+        """
+        First address with live candidates at or after each address
+        """
+        n = len(live)
+        first_live = numpy.where(live > 0, numpy.arange(n), n)
+        return numpy.append(numpy.minimum.accumulate(first_live[::-1])[::-1], n)
+
+    @staticmethod
+    def from_program(program):
+        """
+        Builds the index of a program in the form {address: [instructions]}
+        """
+        addresses = sorted(program.keys())
+        live = numpy.zeros(len(addresses), dtype=numpy.int64)
+        writers = {}
+        for i, addr in enumerate(addresses):
+            for inst in program[addr]:
+                if inst.ignore:
+                    continue
+                live[i] += 1
+                for r in inst.storages_written():
+                    if r not in writers:
+                        writers[r] = numpy.zeros(len(addresses), dtype=numpy.int64)
+                    writers[r][i] += 1
+        return RegisterWriteIndex(addresses, live, writers)
+
+    def update(self, program, addresses):
+        """
+        Recounts the candidates of some addresses after they changed
+        :param program: Program in the form {address: [instructions]}
+        :param addresses: Addresses whose candidates changed
+        :return: A dictionary with the storages whose factor changed at each of the addresses
+        """
+        changed = {}
+        for addr in addresses:
+            i = int(numpy.searchsorted(self.addresses, addr))
+            before_live = int(self._live[i])
+            before = {r: int(w[i]) for r, w in self._writers.items() if w[i] > 0}
+            live, writers = 0, {}
+            for inst in program[addr]:
+                if inst.ignore:
+                    continue
+                live += 1
+                for r in inst.storages_written():
+                    writers[r] = writers.get(r, 0) + 1
+
+            if (live > 0) != (before_live > 0):
+                # The address starts or stops counting for all storages
+                storages = set(self._writers.keys()) | set(writers.keys())
+            else:
+                storages = set()
+                for r in set(before.keys()) | set(writers.keys()):
+                    if before.get(r, 0) * live != writers.get(r, 0) * before_live:
+                        storages.add(r)
+            changed[addr] = storages
+
+            self._live[i] = live
+            for r in before:
+                self._writers[r][i] = 0
+            for r, count in writers.items():
+                if r not in self._writers:
+                    self._writers[r] = numpy.zeros(len(self.addresses) + 1, dtype=numpy.int64)
+                self._writers[r][i] = count
+            for r in storages:
+                self._prefix.pop(r, None)
+        self._next_live = RegisterWriteIndex._first_live_after(self._live)
+        return changed
+
+    def _prefix_of(self, r):
+        """
+        Prefix log-sums and prefix count of zero factors of a storage, built on first use
+        """
+        try:
+            return self._prefix[r]
+        except KeyError:
+            pass
+        count = self._writers.get(r, self._no_writers)[:-1]
+        live = self._live > 0
+        factor = numpy.ones(len(self.addresses))
+        factor[live] = 1 - count[live] / self._live[live]
+        zero = factor == 0
+        logs = numpy.log(numpy.where(zero, 1, factor))
+        prefix = (numpy.concatenate(([0], numpy.cumsum(logs))), numpy.concatenate(([0], numpy.cumsum(zero))))
+        self._prefix[r] = prefix
+        return prefix
+
+    def window(self, low, high):
+        """
+        Indexes of the first address not lower than 'low' and of the first address not lower than 'high'.
+        Works on single addresses and on arrays.
+        """
+        return numpy.searchsorted(self.addresses, low), numpy.searchsorted(self.addresses, high)
+
+    def product(self, r, low, high):
+        """
+        Probability of no candidate writing a storage in the addresses of [low, high), assuming the candidates of
+        each address are equally likely.
+
+        As in the register distance rule, the product is 1 if the first address with live candidates has no
+        writers. Works on single addresses and on arrays.
+        :param r: Storage
+        :param low: Lowest address of the window
+        :param high: Address right after the window
+        """
+        logs, zeros = self._prefix_of(r)
+        first, last = self.window(low, high)
+        first_live = self._next_live[first]
+        free = (first_live < last) & (self._writers.get(r, self._no_writers)[first_live] == 0)
+        p = numpy.where(zeros[last] - zeros[first] > 0, 0.0, numpy.exp(logs[last] - logs[first]))
+        return numpy.where(free, 1.0, p)
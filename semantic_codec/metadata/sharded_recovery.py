@@ -0,0 +1,160 @@
+"""
+Recovery of a corrupted program split in shards of whole functions, recovered in parallel by a pool of processes.
+
+Besides the conditional, opcode and register scores, which use counts over the whole program, the rules of the
+ProbabilisticRecuperator only read the function of a candidate and its neighbouring addresses. The program wide
+counts are computed once and sent to every shard. Every shard carries a halo of the addresses before it (as far as
+the longest register distance window) and the address after it. The halo gives context to the rules, but its
+candidates are neither scored nor removed: they belong to the neighbouring shards.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+from semantic_codec.metadata.candidate_index import CandidateIndex
+from semantic_codec.metadata.recuperator import ProbabilisticRecuperator, probabilistic_rules_remove_step, \
+    remove_bad_candidates_at_addr
+
+
+class ShardRecuperator(ProbabilisticRecuperator):
+    """
+    ProbabilisticRecuperator working on a shard of a program, using the counts and bounds of the whole program
+    """
+
+    def __init__(self, collector, program, cpmd, bounds, frozen, model=None, functions=None):
+        """
+        :param cpmd: Counts of the candidates of the whole program
+        :param bounds: Lowest and highest addresses of the whole program
+        :param frozen: Addresses of the halo, which are not scored
+        """
+        super(ShardRecuperator, self).__init__(collector, program, model, functions)
+        self._global_cpmd = cpmd
+        self._global_bounds = bounds
+        self._frozen = frozen
+
+    def _corrupted_metadata(self):
+        return self._global_cpmd
+
+    def _program_bounds(self):
+        return self._global_bounds
+
+    def _score_address(self, addr):
+        if addr not in self._frozen:
+            super(ShardRecuperator, self)._score_address(addr)
+
+
+def _recover_shard(task):
+    """
+    Recovers a shard. Runs in the worker processes.
+    :param task: Tuple (shard, frozen, collector, cpmd, bounds, model, functions, prune), where the shard is a
+                 dictionary {address: [(encoding, ignore)]}
+    :return: A dictionary {address: [(index of the candidate, scores)]} with the candidates left at the
+             addresses of the shard, the halo excluded
+    """
+    shard, frozen, collector, cpmd, bounds, model, functions, prune = task
+    program = {}
+    for addr, candidates in shard.items():
+        program[addr] = CAPSInstruction.decode_many([e for e, _ in candidates], [addr] * len(candidates))
+        for inst, (_, ignore) in zip(program[addr], candidates):
+            inst.ignore = ignore
+    indexes = {id(inst): i for v in program.values() for i, inst in enumerate(v)}
+
+    r = ShardRecuperator(collector, program, cpmd, bounds, frozen, model, functions)
+    r.recover()
+    while prune:
+        changed = [addr for addr in program if addr not in frozen and remove_bad_candidates_at_addr(program[addr]) > 0]
+        if not changed:
+            break
+        r.rescore(changed)
+
+    return {addr: [(indexes[id(inst)], dict(inst.scores_by_rule)) for inst in v]
+            for addr, v in program.items() if addr not in frozen}
+
+
+class ShardedRecovery(object):
+    """
+    Recovers a program splitting it in shards of whole functions that are recovered in parallel
+    """
+
+    def __init__(self, collector, program, functions, model=None, workers=None, shards=None, prune=True):
+        """
+        :param collector: Metadata collector
+        :param program: Dictionary where the key is the memory address of an instruction
+                        and the value a list of possibles instructions.
+        :param functions: Functions of the program in the form {start: (start, end)}
+        :param workers: Amount of processes. All the cores by default
+        :param shards: Amount of shards. Four per process by default, so slow shards are balanced
+        :param prune: Remove the bad candidates of each shard until no more can be removed. Shards are pruned
+                      independently, using the counts of the whole program before the pruning.
+                      When False, the scores are the ones of a single ProbabilisticRecuperator pass.
+        """
+        self._collector = collector
+        self._program = program
+        self._functions = functions
+        self._model = model
+        self.workers = workers if workers else os.cpu_count()
+        self.shards = shards if shards else 4 * self.workers
+        self.prune = prune
+
+    def _halo(self):
+        """
+        Amount of addresses before a shard read by its rules: the longest register distance window
+        """
+        dist_max = self._collector.storage_max_dist
+        return max([d + 1 for d in dist_max.values()] + [1])
+
+    def split(self):
+        """
+        Splits the sorted addresses of the program in contiguous ranges starting at function starts
+        :return: A list of ranges (first, last) of indexes of the sorted addresses, last not included
+        """
+        addresses = sorted(self._program.keys())
+        size = max(1, len(addresses) // self.shards)
+        ranges = []
+        first = 0
+        for i in range(1, len(addresses)):
+            if i - first >= size and addresses[i] in self._functions:
+                ranges.append((first, i))
+                first = i
+        ranges.append((first, len(addresses)))
+        return ranges
+
+    def recover(self):
+        """
+        Recovers the program. Removes the bad candidates from it and stores the scores in the candidates left.
+        """
+        addresses = sorted(self._program.keys())
+        cpmd = CandidateIndex.from_program(self._program)
+        bounds = addresses[0], addresses[-1]
+        halo = self._halo()
+
+        tasks = []
+        for first, last in self.split():
+            shard_addresses = addresses[max(0, first - halo):min(len(addresses), last + 1)]
+            frozen = set(addresses[max(0, first - halo):first]) | set(addresses[last:last + 1])
+            shard = {addr: [(inst.encoding, inst.ignore) for inst in self._program[addr]]
+                     for addr in shard_addresses}
+            tasks.append((shard, frozen, self._collector, cpmd, bounds, self._model, self._functions, self.prune))
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for result in executor.map(_recover_shard, tasks):
+                for addr, kept in result.items():
+                    candidates = self._program[addr]
+                    candidates[:] = [candidates[i] for i, _ in kept]
+                    for inst, (_, scores) in zip(candidates, kept):
+                        inst.scores_by_rule.update(scores)
+                        if not inst.ignore:
+                            inst.score_function = probabilistic_rules_remove_step
+        return self._program
+
+    def rescore(self, changed):
+        """
+        Updates the scores after some candidates were removed from the program, as ProbabilisticRecuperator.rescore.
+        The shards are recovered again, as the counts of the whole program may have changed.
+        :param changed: Addresses whose candidates changed
+        :return: The addresses scored again
+        """
+        if not changed:
+            return []
+        self.recover()
+        return sorted(self._program.keys())
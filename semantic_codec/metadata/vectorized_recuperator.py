@@ -0,0 +1,390 @@
+"""
+Scoring engine of the ProbabilisticRecuperator working over a CandidateTable.
+
+The ProbabilisticRecuperator walks the program address by address, and every rule re-scans the candidate lists of
+the neighbouring addresses. The rules, however, only look at facts of the candidates (cond, opcode, storages) and at
+the ignore flags, which do not change while scoring. This engine computes those facts once per distinct encoding,
+aggregates them once per address and scores all candidates at once with NumPy.
+"""
+import numpy
+
+from semantic_codec.architecture.arm_constants import AReg
+from semantic_codec.architecture.capstone_decoder import CapstoneDecoder
+from semantic_codec.metadata.candidate_table import CandidateTable, CandidateProgram
+from semantic_codec.metadata.recuperator import ProbabilisticRecuperator, probabilistic_rules_remove_step
+from semantic_codec.metadata.register_write_index import RegisterWriteIndex
+
+# Conditional field of the instructions that always execute
+COND_ALWAYS = 14
+# The conditional field goes from -1 (invalid) to 15
+COND_RANGE = 17
+
+
+def _csr_gather(starts, lengths):
+    """
+    Returns the positions of the items of many slices of a flat array, one slice after the other
+    :param starts: Position where each slice starts
+    :param lengths: Length of each slice
+    """
+    total = int(lengths.sum())
+    first = numpy.cumsum(lengths) - lengths
+    return numpy.arange(total, dtype=numpy.int64) + numpy.repeat(starts - first, lengths)
+
+
+def _to_int32(values):
+    """
+    Vectorized version of capstone_decoder.to_int32
+    """
+    return ((values + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+class EncodingFeatures(object):
+    """
+    Features of the distinct encodings of a table as arrays, plus the storages of each encoding in CSR style
+    """
+
+    def __init__(self, table):
+        unique, self.inverse = numpy.unique(table.encoding, return_inverse=True)
+        self.features = CapstoneDecoder.features_many(unique)
+        n = len(unique)
+        self.is_branch = numpy.zeros(n, dtype=bool)
+        self.is_push_pop = numpy.zeros(n, dtype=bool)
+        self.writes_cpsr = numpy.zeros(n, dtype=bool)
+        self.has_jump = numpy.zeros(n, dtype=bool)
+        self.pc_relative = numpy.zeros(n, dtype=bool)
+        self.jump = numpy.zeros(n, dtype=numpy.int64)
+        read, written = [], []
+        for i, f in enumerate(self.features):
+            if f is None:
+                read.append(())
+                written.append(())
+                continue
+            self.is_branch[i] = f.is_branch
+            self.is_push_pop[i] = f.is_push or f.is_pop
+            self.writes_cpsr[i] = AReg.CPSR in f.registers_written
+            if f.jump is not None:
+                self.has_jump[i] = True
+                self.pc_relative[i] = f.pc_relative
+                self.jump[i] = f.jump
+            read.append(f.storages_read)
+            written.append(f.storages_written)
+        self.read_offsets, self.read = EncodingFeatures._flatten(read)
+        self.written_offsets, self.written = EncodingFeatures._flatten(written)
+
+    @staticmethod
+    def _flatten(storages):
+        lengths = numpy.array([len(s) for s in storages], dtype=numpy.int64)
+        offsets = numpy.concatenate(([0], numpy.cumsum(lengths)))
+        values = numpy.array([r for s in storages for r in s], dtype=numpy.int64)
+        return offsets, values
+
+    def row_storages(self, rows, offsets, values):
+        """
+        Expands the storages of the given rows
+        :return: The row and the storage of each (row, storage) pair, in the order of the storages of each row
+        """
+        u = self.inverse[rows]
+        lengths = offsets[u + 1] - offsets[u]
+        positions = _csr_gather(offsets[u], lengths)
+        return numpy.repeat(rows, lengths), values[positions]
+
+
+class VectorizedRecuperator(ProbabilisticRecuperator):
+    """
+    ProbabilisticRecuperator computing the 'pc', 'po', 'pr', 'pcfg', 'prd' and 'pbd' scores of all candidates at once.
+
+    The scores are exactly the ones of the ProbabilisticRecuperator. The push/pop score ('popu') is only given to
+    push and pop candidates and is still computed by the ProbabilisticRecuperator, candidate by candidate.
+
+    The program can be a dictionary {address: [instructions]}, in which case the scores are written back into the
+    instructions, or the view of a CandidateTable, in which case the scores are stored directly in the table.
+    """
+
+    def _recover(self, progress_bar):
+        if isinstance(self._program, CandidateProgram):
+            table = self._program.table
+            instructions = None
+        else:
+            table = CandidateTable.from_program(self._program)
+            instructions = [inst for addr in sorted(self._program.keys()) for inst in self._program[addr]]
+
+        features = EncodingFeatures(table)
+        scores = self._score_table(table, features)
+        for rule, values in scores.items():
+            scored = numpy.flatnonzero(~numpy.isnan(values))
+            if instructions is None:
+                table.score_column(rule)[scored] = values[scored]
+            else:
+                for row, score in zip(scored.tolist(), values[scored].tolist()):
+                    instructions[row].scores_by_rule[rule] = score
+
+        # Push and pops, plus the score function of all candidates
+        push_pop = features.is_push_pop[features.inverse]
+        current_fn = self._current_functions(table)
+        row_index = table.row_address_index()
+        for row in numpy.flatnonzero(~table.ignore).tolist():
+            inst = table.instruction(row) if instructions is None else instructions[row]
+            inst.score_function = probabilistic_rules_remove_step
+            if push_pop[row]:
+                i = row_index[row]
+                self._compute_push_pop(inst, None, int(table.addresses[i]), int(current_fn[i]))
+
+        for i in range(0, table.address_count):
+            progress_bar.progress()
+
+    def rescore(self, changed):
+        """
+        Scoring everything at once is already cheap, the whole program is scored again
+        """
+        self.recover()
+        return sorted(self._program.keys())
+
+    def _current_functions(self, table):
+        """
+        Function each address belongs to: the last function start found walking the addresses in order
+        """
+        starts = numpy.isin(table.addresses, numpy.array(list(self._functions.keys()), dtype=numpy.int64))
+        index = numpy.maximum.accumulate(numpy.where(starts, numpy.arange(table.address_count), 0))
+        return table.addresses.astype(numpy.int64)[index]
+
+    def score_table(self, table):
+        """
+        Scores all the candidates of a table not being ignored
+        :return: A dictionary with an array of scores per rule, NaN for the candidates the rule does not score
+        """
+        return self._score_table(table, EncodingFeatures(table))
+
+    def _score_table(self, table, features):
+        live = ~table.ignore
+        row_index = table.row_address_index()
+
+        scores = {}
+        scores['pc'], scores['po'], scores['pr'] = self._score_counts(table, features, live, row_index)
+        scores['pbd'] = self._score_branch_address(table, features, live, row_index)
+        # These rules take into consideration previous instructions, they are not applied to the first address
+        scores['prd'] = self._score_register_distance(table, features, live & (row_index > 0), row_index)
+        scores['pcfg'] = self._score_proper_cfg(table, features, live & (row_index > 0), row_index)
+        return scores
+
+    def _score_counts(self, table, features, live, row_index):
+        """
+        Conditional, opcode and register scores. They only depend on the encoding, so they are computed once
+        per distinct encoding.
+        """
+        live_rows = numpy.flatnonzero(live)
+        ai = row_index[live_rows]
+
+        # Amount of addresses having at least one candidate with a given cond/opcode/storage
+        cond = table.cond[live_rows].astype(numpy.int64) + 1
+        keys = numpy.unique(ai * COND_RANGE + cond)
+        with_cond = numpy.bincount(keys % COND_RANGE, minlength=COND_RANGE)
+        address_with_cond = {c - 1: int(with_cond[c]) for c in numpy.flatnonzero(with_cond)}
+
+        op = table.opcode[live_rows].astype(numpy.int64)
+        op_range = int(op.max()) + 1 if len(op) else 1
+        keys = numpy.unique(ai * op_range + op)
+        with_op = numpy.bincount(keys % op_range, minlength=op_range)
+        address_with_op = {o: int(with_op[o]) for o in numpy.flatnonzero(with_op)}
+
+        used_offsets, used = EncodingFeatures._flatten(
+            [f.storages_used if f is not None else () for f in features.features])
+        rows, storages = features.row_storages(live_rows, used_offsets, used)
+        storage_range = int(storages.max()) + 1 if len(storages) else 1
+        keys = numpy.unique(row_index[rows] * storage_range + storages)
+        with_reg = numpy.bincount(keys % storage_range, minlength=storage_range)
+        address_with_reg = {r: int(with_reg[r]) for r in numpy.flatnonzero(with_reg)}
+
+        condition_count = self._collector.condition_count
+        instruction_count = self._collector.instruction_count
+        storage_count = self._collector.storage_count
+        n = len(features.features)
+        pc = numpy.full(n, numpy.nan)
+        po = numpy.full(n, numpy.nan)
+        pr = numpy.full(n, numpy.nan)
+        for u in numpy.unique(features.inverse[live_rows]):
+            f = features.features[u]
+            try:
+                pc[u] = condition_count[f.cond] / address_with_cond[f.cond]
+            except KeyError:
+                pc[u] = 0
+            try:
+                po[u] = instruction_count[f.opcode] / address_with_op[f.opcode]
+            except KeyError:
+                po[u] = 0
+            if f.is_branch or f.is_push or f.is_pop:
+                continue
+            try:
+                av = 1
+                for rr in f.storages_used:
+                    av = min(av, storage_count[rr] / address_with_reg[rr])
+                pr[u] = av
+            except KeyError:
+                pr[u] = 0
+
+        result = []
+        for values in (pc, po, pr):
+            values = values[features.inverse]
+            values[~live] = numpy.nan
+            result.append(values)
+        return result
+
+    def _score_branch_address(self, table, features, live, row_index):
+        """
+        Branch distance score, see ProbabilisticRecuperator._compute_branch_address
+        """
+        result = numpy.full(len(table), numpy.nan)
+        rows = numpy.flatnonzero(live & features.is_branch[features.inverse])
+        if len(rows) == 0:
+            return result
+        model = self._model
+        u = features.inverse[rows]
+        addresses = table.addresses.astype(numpy.int64)
+        address = addresses[row_index[rows]]
+        jump = numpy.where(features.pc_relative[u], _to_int32(address + features.jump[u]), features.jump[u])
+        has_jump = features.has_jump[u]
+
+        current_fn = self._current_functions(table)[row_index[rows]]
+        fn_end = numpy.array([self._functions[f][1] if f in self._functions else -1 for f in current_fn.tolist()],
+                             dtype=numpy.int64)
+        checks_end = has_jump & (jump >= current_fn)
+        # Without the bounds of the function, the branch is scored as any other jump
+        this_method = checks_end & (fn_end >= 0) & (jump <= fn_end)
+        other_start = numpy.isin(jump, numpy.array(list(self._functions.keys()), dtype=numpy.int64))
+        outside = (jump > addresses[-1]) | (jump < addresses[0])
+
+        pbd = numpy.full(len(rows), model.just_any_jump_is_valid * 2)
+        pbd[outside] = model.just_any_jump_is_valid
+        pbd[other_start] = model.branch_to_other_method_start
+        pbd[this_method] = model.branch_to_this_method
+        pbd[~has_jump] = model.just_any_jump_is_valid * 2
+        result[rows] = pbd
+        return result
+
+    def _score_register_distance(self, table, features, scored, row_index):
+        """
+        Register distance score, see ProbabilisticRecuperator._compute_register_distance.
+
+        For each storage read by a candidate, the probability of none of the instructions in the read distance
+        window writing that storage comes from the RegisterWriteIndex, all (candidate, storage) pairs at once.
+        """
+        model = self._model
+        result = numpy.full(len(table), numpy.nan)
+        rows = numpy.flatnonzero(scored & ~features.is_branch[features.inverse] & ~features.is_push_pop[features.inverse])
+        if len(rows) == 0:
+            return result
+        # Candidates reading no storages are never rewarded
+        result[rows] = model.low_probability
+
+        pair_rows, storages = features.row_storages(rows, features.read_offsets, features.read)
+        if len(pair_rows) == 0:
+            return result
+
+        # Writers of each storage at each address
+        live_rows = numpy.flatnonzero(~table.ignore)
+        w_rows, w_storages = features.row_storages(live_rows, features.written_offsets, features.written)
+        storage_ids = numpy.unique(storages)
+        w_index = numpy.searchsorted(storage_ids, w_storages)
+        w_index[w_index == len(storage_ids)] = 0
+        keep = storage_ids[w_index] == w_storages
+        s_count = len(storage_ids)
+        writers = numpy.bincount(row_index[w_rows[keep]] * s_count + w_index[keep],
+                                 minlength=table.address_count * s_count).reshape(table.address_count, s_count)
+        index = RegisterWriteIndex(table.addresses, table.live_counts(),
+                                   {r: writers[:, k] for k, r in enumerate(storage_ids.tolist())})
+
+        # Probability of each storage not being written in its read distance window
+        dist_min, dist_max = self._collector.storage_min_dist, self._collector.storage_max_dist
+        address = table.addresses.astype(numpy.int64)[row_index[pair_rows]]
+        p = numpy.ones(len(pair_rows))
+        for r in storage_ids.tolist():
+            try:
+                a, b = dist_min[r], dist_max[r] + 1
+            except KeyError:
+                a, b = 0, 1
+            pairs = storages == r
+            p[pairs] = index.product(r, address[pairs] - 4 * b, address[pairs] - 4 * a)
+
+        # Pairs are grouped by row: take the first and the lowest probability of each row
+        starts = numpy.flatnonzero(numpy.concatenate(([True], pair_rows[1:] != pair_rows[:-1])))
+        with_storages = pair_rows[starts]
+        prd = 1 - numpy.minimum.reduceat(p, starts)
+        prd[p[starts] >= 1] = 1 - model.high_probability
+        prd[prd <= 0] = model.low_probability
+        result[with_storages] = prd
+        return result
+
+    def _score_proper_cfg(self, table, features, scored, row_index):
+        """
+        Proper control flow score, see ProbabilisticRecuperator._compute_proper_cfg
+        """
+        model = self._model
+        result = numpy.full(len(table), numpy.nan)
+        rows = numpy.flatnonzero(scored)
+        if len(rows) == 0:
+            return result
+        a_count = table.address_count
+
+        # Per address aggregates
+        live = ~table.ignore
+        live_rows = numpy.flatnonzero(live)
+        ai = row_index[live_rows]
+        cond = table.cond.astype(numpy.int64) + 1
+        cpsr = features.writes_cpsr[features.inverse[live_rows]]
+        same_cond = numpy.bincount(ai * COND_RANGE + cond[live_rows],
+                                   minlength=a_count * COND_RANGE).reshape(a_count, COND_RANGE)
+        union = numpy.bincount(ai[cpsr] * COND_RANGE + cond[live_rows][cpsr],
+                               minlength=a_count * COND_RANGE).reshape(a_count, COND_RANGE)
+        flag_mod = numpy.bincount(ai[cpsr], minlength=a_count)
+        ln = table.live_counts()
+        total = table.counts()
+
+        # Neighbour addresses
+        addresses = table.addresses.astype(numpy.int64)
+        address = addresses[row_index[rows]]
+        c = cond[rows]
+
+        def neighbour(a):
+            i = numpy.searchsorted(addresses, a)
+            i[i == a_count] = 0
+            return i, addresses[i] == a
+
+        prev, has_prev = neighbour(address - 4)
+        post, has_post = neighbour(address + 4)
+        sc = numpy.where(has_prev, same_cond[prev, c], 0)
+        fm = numpy.where(has_prev, flag_mod[prev], 0)
+        uc = numpy.where(has_prev, union[prev, c], 0)
+        ln_prev = numpy.where(has_prev, ln[prev], 0)
+        len_prev = numpy.where(has_prev, total[prev], 0)
+        after = numpy.where(has_post, same_cond[post, c], 0)
+        ln_post = numpy.where(has_post, ln[post], 0)
+
+        # Denominators are only used when not zero
+        both = numpy.maximum(ln_prev * ln_post, 1)
+        ln_prev = numpy.maximum(ln_prev, 1)
+        len_prev = numpy.maximum(len_prev, 1)
+        ln_post = numpy.maximum(ln_post, 1)
+        has_after = after > 0
+
+        def near(count, p_both, p_prev, prev_total):
+            p1 = numpy.where(has_after, count * after / both * p_both, 0)
+            p2 = count / prev_total * p_prev
+            return numpy.maximum(p1, p2)
+
+        cpsr_and_cond = near(sc + fm - uc, model.branch_after_cpsr_and_near_cond_are_equals,
+                             model.branch_after_cpsr_and_prev_cond_are_equals, ln_prev)
+        only_cond = near(sc, model.both_conditionals_are_equals, model.prev_conditionals_are_equals, len_prev)
+        only_cpsr = near(fm, model.branch_after_cpsr_and_after_cond_are_equals, model.branch_after_cpsr, ln_prev)
+        always_cpsr = fm / ln_prev * (1 - model.branch_after_cpsr)
+        always_after = after / ln_post * model.prev_conditionals_are_equals
+
+        always = c == COND_ALWAYS + 1
+        has_sc, has_fm = sc > 0, fm > 0
+        pcfg = numpy.select(
+            [~always & has_sc & has_fm, ~always & has_sc, ~always & has_fm,
+             always & has_fm, always & has_sc, always & has_after],
+            [cpsr_and_cond, only_cond, only_cpsr, always_cpsr, only_cond, always_after], 0)
+        if (pcfg > 1).any():
+            raise RuntimeError('Invalid probability')
+        pcfg[pcfg == 0] = model.low_probability
+        result[rows] = pcfg
+        return result
@@ -0,0 +1,195 @@
+"""
+Gateway recovering the programs of many devices at once.
+
+Every connection is a session sending a packet stream (see packet_stream). The packets are read in the event loop,
+which only validates and buffers them. When the stream ends, the recovery runs in a pool of processes, so the
+sessions do not wait for each other's recoveries. The gateway answers each session with one JSON object per line:
+ - {"event": "received", "packets": n} every progress_every packets
+ - {"event": "recovering"} when the recovery is waiting for a process or running
+ - {"event": "done", "image": hex of the little endian words, "ambiguity": {address: candidates left}}
+ - {"event": "error", "message": ...} if the session is rejected or its recovery fails
+
+Backpressure: the gateway stops reading a session while it waits for a session slot or its answer is not sent,
+so fast senders are held back by the socket. Each session is limited to max_session_bytes of buffered state.
+"""
+import asyncio
+import json
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+
+from semantic_codec.architecture.bits import BitQueue
+from semantic_codec.receiver.packet_stream import PacketStreamWriter, StreamHeader
+from semantic_codec.receiver.receiver import Receiver
+
+
+def _recover_session(task):
+    """
+    Recovers the program of a session. Runs in the worker processes.
+    :param task: Tuple (header, packets, collector, functions), the packets being a list of (index, payload)
+    :return: The recovered image as bytes, and the residual ambiguity
+    """
+    header, packets, collector, functions = task
+    image, ambiguity = Receiver(header, collector, functions, in_order=False).run(packets)
+    return image.astype('<u4').tobytes(), ambiguity
+
+
+class Gateway(object):
+    """
+    Asyncio service running recovery sessions over a local TCP or Unix socket
+    """
+
+    HEADER_SIZE = 8 + 4 * 4
+
+    def __init__(self, metadata, workers=None, max_sessions=64, max_session_bytes=64 * 1024 * 1024,
+                 progress_every=16):
+        """
+        :param metadata: Function giving the (collector, functions) to recover the program of a StreamHeader
+        :param workers: Amount of recovery processes. All the cores by default
+        :param max_sessions: Sessions served at once, the others wait before their stream is read
+        :param max_session_bytes: Memory a session may use to keep its packets and state
+        :param progress_every: Packets between progress events
+        """
+        self.metadata = metadata
+        self.workers = workers if workers else os.cpu_count()
+        self.max_sessions = max_sessions
+        self.max_session_bytes = max_session_bytes
+        self.progress_every = progress_every
+        self._executor = None
+        self._sessions = None
+        self._recoveries = None
+
+    def _start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._sessions = asyncio.Semaphore(self.max_sessions)
+            self._recoveries = asyncio.Semaphore(self.workers)
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Serves on a TCP socket
+        :return: The asyncio server
+        """
+        self._start()
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def start_unix(self, path):
+        """
+        Serves on a Unix socket
+        :return: The asyncio server
+        """
+        self._start()
+        return await asyncio.start_unix_server(self.handle, path)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def session_bytes(self, header):
+        """
+        Memory taken by the state of a session: the bit planes and erasures of the receiver
+        """
+        chunks = header.word_count * BitQueue.WORD_SIZE // header.bits_per_interleave
+        planes = header.packet_count * ceil(chunks / header.packet_count) * header.bits_per_interleave
+        return planes + 4 * header.word_count
+
+    @staticmethod
+    async def _send(writer, event):
+        writer.write((json.dumps(event) + '\n').encode())
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        """
+        Serves a session
+        """
+        self._start()
+        try:
+            async with self._sessions:
+                await self._session(reader, writer)
+        except RuntimeError as e:
+            await Gateway._send(writer, {'event': 'error', 'message': str(e)})
+        except asyncio.IncompleteReadError:
+            await Gateway._send(writer, {'event': 'error', 'message': 'The stream ended in the middle of a packet'})
+        finally:
+            writer.close()
+
+    async def _session(self, reader, writer):
+        magic, word_count, packet_count, bits_per_interleave, base_address = \
+            struct.unpack('<QLLLL', await reader.readexactly(Gateway.HEADER_SIZE))
+        if magic != PacketStreamWriter.MAGIC_WORD:
+            raise RuntimeError('The stream is not a packet stream')
+        header = StreamHeader(word_count, packet_count, bits_per_interleave, base_address)
+        if packet_count == 0 or bits_per_interleave == 0 or BitQueue.WORD_SIZE % bits_per_interleave != 0:
+            raise RuntimeError('Invalid stream header')
+        used = self.session_bytes(header)
+        if used > self.max_session_bytes:
+            raise RuntimeError('The session needs {} bytes, over the limit of {}'.format(used,
+                                                                                        self.max_session_bytes))
+
+        max_payload = ceil(ceil(word_count * BitQueue.WORD_SIZE / bits_per_interleave / packet_count) *
+                           bits_per_interleave / 8)
+        packets = []
+        while True:
+            try:
+                start = await reader.readexactly(8)
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    raise
+                break
+            index, size = struct.unpack('<LL', start)
+            if index >= packet_count or size > max_payload:
+                raise RuntimeError('Invalid packet {} of {} bytes'.format(index, size))
+            used += size
+            if used > self.max_session_bytes:
+                raise RuntimeError('The session is over the limit of {} bytes'.format(self.max_session_bytes))
+            packets.append((index, await reader.readexactly(size)))
+            if len(packets) % self.progress_every == 0:
+                await Gateway._send(writer, {'event': 'received', 'packets': len(packets)})
+
+        await Gateway._send(writer, {'event': 'recovering'})
+        try:
+            collector, functions = self.metadata(header)
+            async with self._recoveries:
+                image, ambiguity = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, _recover_session, (header, packets, collector, functions))
+        except Exception as e:
+            # Any failure of the recovery (a broken pool, an error in the worker...) is answered to the session
+            raise RuntimeError('The recovery failed: {}: {}'.format(type(e).__name__, e)) from e
+        await Gateway._send(writer, {'event': 'done', 'image': image.hex(),
+                                     'ambiguity': {str(k): v for k, v in ambiguity.items()}})
+
+
+async def request_recovery(reader, writer, header, packets):
+    """
+    Client side of a session: sends a packet stream while reading the events of the gateway
+    :param packets: Iterable of (index, payload)
+    :return: The list of events received, the last one being 'done' or 'error'
+    """
+    stream = PacketStreamWriter()
+
+    async def send():
+        try:
+            stream.write_header(writer, header)
+            for index, payload in packets:
+                stream.write_packet(writer, index, payload)
+                await writer.drain()
+            writer.write_eof()
+        except ConnectionError:
+            # The gateway rejected the session, its answer tells why
+            pass
+
+    async def receive():
+        events = []
+        while True:
+            line = await reader.readline()
+            if not line:
+                return events
+            events.append(json.loads(line))
+            if events[-1]['event'] in ('done', 'error'):
+                return events
+
+    events = (await asyncio.gather(send(), receive()))[1]
+    writer.close()
+    return events
@@ -0,0 +1,121 @@
+"""
+Stream of interleaved packets, as sent to a device.
+
+The stream starts with a header:
+ - magic word (8 bytes)
+ - amount of words of the program, of packets, bits per interleave and base address (4 bytes each)
+
+followed by the packets, in any order, each one being:
+ - index of the packet and size of its payload in bytes (4 bytes each)
+ - payload: the chunks of the packet, packed as bits, lowest bit first
+
+All the numbers are little endian.
+"""
+import struct
+
+import numpy
+
+from semantic_codec.interleaver.bit_plane import BitPlaneInterleaver
+from semantic_codec.interleaver.interleaver2d import build_2d_interleave_sp
+
+
+class StreamHeader(object):
+    """
+    What the receiver needs to know of a program before its packets arrive
+    """
+
+    def __init__(self, word_count, packet_count, bits_per_interleave=2, base_address=0):
+        self.word_count = word_count
+        self.packet_count = packet_count
+        self.bits_per_interleave = bits_per_interleave
+        self.base_address = base_address
+
+    def interleaver(self):
+        """
+        The interleaver of the stream, using the successive packing interleave of the packets
+        """
+        return BitPlaneInterleaver(build_2d_interleave_sp(self.packet_count, flat=True), self.bits_per_interleave)
+
+
+class PacketStreamWriter(object):
+
+    MAGIC_WORD = 0xA0C1E2F3A4C5E6F8
+
+    def write_long(self, fout, value):
+        fout.write(struct.pack('<Q', value))
+
+    def write_int(self, fout, value):
+        fout.write(struct.pack('<L', value))
+
+    def write_header(self, fout, header):
+        self.write_long(fout, PacketStreamWriter.MAGIC_WORD)
+        for value in (header.word_count, header.packet_count, header.bits_per_interleave, header.base_address):
+            self.write_int(fout, value)
+
+    def write_packet(self, fout, index, payload):
+        self.write_int(fout, index)
+        self.write_int(fout, len(payload))
+        fout.write(payload)
+
+    @staticmethod
+    def payloads(header, words):
+        """
+        Interleaves a program into the payloads of its packets
+        :param words: Encodings of the program
+        :return: A list with the payload of each packet
+        """
+        engine = header.interleaver()
+        planes = engine.interleave(words)
+        lengths = engine.packet_lengths(engine.chunk_count(header.word_count))
+        return [numpy.packbits(planes[p, :lengths[p]].reshape(-1), bitorder='little').tobytes()
+                for p in range(engine.packet_count)]
+
+    def write(self, fout, header, words, lost=()):
+        """
+        Writes the stream of a program, in the order of the packets
+        :param fout: Binary file to write to
+        :param words: Encodings of the program
+        :param lost: Packets left out of the stream
+        """
+        self.write_header(fout, header)
+        lost = set(lost)
+        for index, payload in enumerate(PacketStreamWriter.payloads(header, words)):
+            if index not in lost:
+                self.write_packet(fout, index, payload)
+
+
+class PacketStreamReader(object):
+
+    def read_long(self, fin):
+        return struct.unpack('<Q', self._read(fin, 8))[0]
+
+    def read_int(self, fin):
+        return struct.unpack('<L', self._read(fin, 4))[0]
+
+    @staticmethod
+    def _read(fin, size):
+        data = fin.read(size)
+        if len(data) != size:
+            raise RuntimeError('The packet stream ended in the middle of a packet')
+        return data
+
+    def read_header(self, fin):
+        if self.read_long(fin) != PacketStreamWriter.MAGIC_WORD:
+            raise RuntimeError('The file is not a packet stream')
+        return StreamHeader(*[self.read_int(fin) for i in range(0, 4)])
+
+    def packets(self, fin):
+        """
+        Reads the packets of a stream, as they arrive. The header must be read already.
+        :param fin: Binary file or file like object, such as a socket's makefile('rb')
+        :return: A generator of (index, payload)
+        """
+        while True:
+            start = fin.read(4)
+            if not start:
+                return
+            if len(start) != 4:
+                raise RuntimeError('The packet stream ended in the middle of a packet')
+            index = struct.unpack('<L', start)[0]
+            size = self.read_int(fin)
+            yield index, self._read(fin, size)
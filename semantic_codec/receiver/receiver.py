@@ -0,0 +1,178 @@
+"""
+Receiving end of the codec: packets in, recovered program out.
+
+The receiver deinterleaves the packets as they arrive. A word is complete once every packet carrying its chunks
+was either received or given up as lost. Complete words are decoded right away, and the candidates of the words
+with lost bits are enumerated, so most of the decoding overlaps with the reception. The recovery itself needs counts
+over the candidates of the whole program, so it starts when the stream ends.
+"""
+from math import ceil
+
+import numpy
+
+from semantic_codec.architecture.bits import BitQueue
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+from semantic_codec.corruption.lazy_candidates import ErasedWord
+from semantic_codec.metadata.recuperator import ProbabilisticRecuperator, remove_bad_candidates_at_addr
+from semantic_codec.receiver.packet_stream import PacketStreamReader
+
+
+class Receiver(object):
+    """
+    Rebuilds a program out of its packets, recovering the bits of the packets lost
+    """
+
+    def __init__(self, header, collector, functions=None, model=None, in_order=True, prune=True):
+        """
+        :param header: StreamHeader of the program
+        :param collector: Metadata collector of the program, sent along with it
+        :param functions: Functions of the program in the form {start: (start, end)}. Without them, the rules using
+                          the bounds of the functions score every candidate as if it was outside of them.
+        :param in_order: Packets arrive in the order of their indexes, so the packets skipped are lost.
+                         When False, the packets lost are only known when the stream ends (or calling lose).
+        :param prune: Remove the bad candidates until no more can be removed, as run_recovery does
+        """
+        self.header = header
+        self.in_order = in_order
+        self.prune = prune
+        self._collector = collector
+        self._functions = functions
+        self._model = model
+
+        self._engine = header.interleaver()
+        packet_count = self._engine.packet_count
+        self._chunk_count = self._engine.chunk_count(header.word_count)
+        self._lengths = self._engine.packet_lengths(self._chunk_count)
+        rows = ceil(self._chunk_count / packet_count)
+        self._planes = numpy.zeros((packet_count, rows, header.bits_per_interleave), dtype=numpy.uint8)
+        self._received = numpy.zeros(packet_count, dtype=bool)
+        self._accounted = numpy.zeros(packet_count, dtype=bool)
+        # Chunks of each word whose packet was neither received nor lost yet
+        self._pending = numpy.full(header.word_count, BitQueue.WORD_SIZE // header.bits_per_interleave)
+        self._next = 0
+
+        self.program = {}
+        self.erasures = numpy.zeros(header.word_count, dtype=numpy.uint32)
+
+    def address(self, word):
+        return self.header.base_address + 4 * word
+
+    def receive(self, index, payload):
+        """
+        Takes a packet arrived
+        :param index: Index of the packet
+        :param payload: Chunks of the packet, packed as bits
+        :return: Addresses of the words completed by the packet
+        """
+        if index >= self._engine.packet_count:
+            raise RuntimeError('Packet {} out of the {} packets of the stream'.format(index, self._engine.packet_count))
+        completed = []
+        if self.in_order:
+            for skipped in range(self._next, index):
+                completed.extend(self.lose(skipped))
+            self._next = max(self._next, index + 1)
+        if self._accounted[index]:
+            return completed
+
+        bit_count = self._lengths[index] * self.header.bits_per_interleave
+        bits = numpy.unpackbits(numpy.frombuffer(payload, dtype=numpy.uint8), bitorder='little')
+        if len(bits) < bit_count:
+            raise RuntimeError('Packet {} carries {} bits out of {}'.format(index, len(bits), bit_count))
+        self._planes[index].reshape(-1)[:bit_count] = bits[:bit_count]
+        self._received[index] = True
+        return completed + self._account(index)
+
+    def lose(self, index):
+        """
+        Gives up a packet as lost
+        :return: Addresses of the words completed
+        """
+        if self._accounted[index]:
+            return []
+        return self._account(index)
+
+    def _account(self, index):
+        """
+        Marks a packet as received or lost and completes the words it was the last chunk of
+        """
+        self._accounted[index] = True
+        per_word = BitQueue.WORD_SIZE // self.header.bits_per_interleave
+        words = self._engine.chunks_of_packet(index, self._chunk_count) // per_word
+        self._pending -= numpy.bincount(words, minlength=len(self._pending))
+        words = numpy.unique(words)
+        return self._complete(words[self._pending[words] == 0])
+
+    def _complete(self, words):
+        """
+        Decodes the words completed, enumerating the candidates of the ones with lost bits
+        """
+        if len(words) == 0:
+            return []
+        encodings, masks = self._engine.gather_words(self._planes, self._received, words)
+        self.erasures[words] = masks
+        addresses = [self.address(w) for w in words.tolist()]
+
+        intact = masks == 0
+        intact_addresses = [a for a, i in zip(addresses, intact.tolist()) if i]
+        for a, inst in zip(intact_addresses, CAPSInstruction.decode_many(encodings[intact].tolist(),
+                                                                         intact_addresses)):
+            self.program[a] = [inst]
+        for a, e, m in zip(addresses, encodings.tolist(), masks.tolist()):
+            if m != 0:
+                self.program[a] = list(ErasedWord(e, m).candidates(a))
+        return addresses
+
+    def finish(self):
+        """
+        Ends the stream: the packets not received are lost. Recovers the program.
+        :return: The recovered program, as an array of encodings, and the residual ambiguity: a dictionary with
+                 the amount of candidates left at the addresses where the recovery could not decide
+        """
+        for index in numpy.flatnonzero(~self._accounted).tolist():
+            self._account(index)
+        self.program = {a: self.program[a] for a in sorted(self.program.keys())}
+
+        if any(len(v) > 1 for v in self.program.values()):
+            r = ProbabilisticRecuperator(self._collector, self.program, self._model, self._functions)
+            r.recover()
+            while self.prune:
+                changed = [a for a, v in self.program.items() if remove_bad_candidates_at_addr(v) > 0]
+                if not changed:
+                    break
+                r.rescore(changed)
+
+        image = numpy.zeros(self.header.word_count, dtype=numpy.uint32)
+        ambiguity = {}
+        for w in range(0, self.header.word_count):
+            candidates = self.program[self.address(w)]
+            if len(candidates) > 1:
+                ambiguity[self.address(w)] = len(candidates)
+                image[w] = max(candidates, key=lambda x: x.score()).encoding
+            elif len(candidates) == 1:
+                image[w] = candidates[0].encoding
+            else:
+                # All the candidates were discarded, keep the bits known
+                image[w] = self._engine.gather_words(self._planes, self._received, [w])[0][0]
+        return image, ambiguity
+
+    def run(self, packets):
+        """
+        Receives packets until the stream ends
+        :param packets: Iterable of (index, payload)
+        :return: The same as finish
+        """
+        for index, payload in packets:
+            self.receive(index, payload)
+        return self.finish()
+
+    @staticmethod
+    def from_stream(fin, collector, functions=None, model=None, in_order=True):
+        """
+        Receives a program from a packet stream
+        :param fin: Binary file or file like object with the stream
+        :return: The receiver, and the same as finish
+        """
+        reader = PacketStreamReader()
+        receiver = Receiver(reader.read_header(fin), collector, functions, model, in_order)
+        image, ambiguity = receiver.run(reader.packets(fin))
+        return receiver, image, ambiguity
@@ -0,0 +1,330 @@
+"""
+Solver for the selection of one candidate per address under exact field counts.
+
+This is the problem ProblemBuilder states for python-constraint: each address takes exactly one of its candidates,
+and the amount of times each field (condition, opcode, storage...) is used by the candidates taken must be exactly
+the amount counted by the MetadataCollector. The generic backtracking of python-constraint does not know the shape
+of the problem and never ends on real programs. This solver does:
+
+ - The fields of every candidate are a row of a matrix, so the counts of all the fields are handled at once.
+ - Propagation: for every field, the smallest and largest count reachable are the sums of the smallest and largest
+   counts each address can contribute. A candidate is removed when taking it makes some count unreachable, until
+   no candidate is removed. This is bounds consistency on every count.
+ - Search: the address with fewest candidates left is decided first, trying its best scored candidates first.
+   A hint, such as the most likely program of MapSelector, gives candidates to try before the best scored.
+ - The solutions are enumerated lazily, by a generator.
+
+Propagation does not remove the exponential tail of the search: with heavy losses (or when there is no solution)
+it may backtrack for a very long time. The search takes a budget of nodes, and tells when it ran out of it.
+"""
+import numpy
+
+from semantic_codec.architecture.arm_constants import AReg
+from semantic_codec.metadata.candidate_table import CandidateTable
+
+
+class CountTable(object):
+    """
+    Fields used by the candidates of a program, as a matrix with a row per candidate and a column per field.
+    Candidates with ignore on use no fields.
+    """
+
+    def __init__(self, program, sums):
+        """
+        :param program: Candidates of each address, in the form {address: [candidates]}.
+                        Addresses without candidates are left out.
+        :param sums: List of (exactsum, field_fn) as given to ExactFieldSumConstraint: the amount of times each
+                     field must be used, and the function giving the fields used by a candidate
+        """
+        # Every field of every sum gets a column. Fields out of the sums get one too, to be used 0 times.
+        self.fields = []
+        ids = {}
+        limits = []
+        for s, (exactsum, field_fn) in enumerate(sums):
+            for k, v in exactsum.items():
+                ids[(s, k)] = len(self.fields)
+                self.fields.append((s, k))
+                limits.append(v)
+
+        def columns(candidate):
+            result = []
+            if not candidate.ignore:
+                for s, (exactsum, field_fn) in enumerate(sums):
+                    for f in field_fn(candidate):
+                        if (s, f) not in ids:
+                            ids[(s, f)] = len(self.fields)
+                            self.fields.append((s, f))
+                            limits.append(0)
+                        result.append(ids[(s, f)])
+            return result
+
+        # Addresses with a single candidate are decided already, their fields are a constant part of the counts
+        self.fixed = {}
+        fixed_columns = []
+        self.addresses = []
+        self.candidates = []
+        starts = []
+        rows, cols = [], []
+        for address, candidates in program.items():
+            if len(candidates) == 1:
+                self.fixed[address] = candidates[0]
+                fixed_columns.extend(columns(candidates[0]))
+            elif len(candidates) > 1:
+                self.addresses.append(address)
+                starts.append(len(self.candidates))
+                for c in candidates:
+                    used = columns(c)
+                    rows.extend([len(self.candidates)] * len(used))
+                    cols.extend(used)
+                    self.candidates.append(c)
+
+        self.limits = numpy.array(limits, dtype=numpy.int64)
+        self.base = numpy.bincount(numpy.asarray(fixed_columns, dtype=numpy.intp),
+                                   minlength=len(limits)).astype(numpy.int64)
+        self.starts = numpy.array(starts, dtype=numpy.intp)
+        self.ends = numpy.append(self.starts[1:], len(self.candidates)).astype(numpy.intp)
+        # Address of each candidate, as an index of addresses
+        self.owner = numpy.repeat(numpy.arange(len(starts)), self.ends - self.starts)
+        # The matrix in coordinate form, a (row, column) pair for each time a candidate uses a field
+        self.rows = numpy.asarray(rows, dtype=numpy.intp)
+        self.cols = numpy.asarray(cols, dtype=numpy.intp)
+
+    @staticmethod
+    def metadata_sums(metadata):
+        """
+        The sums of the counts of a MetadataCollector, the same constraints added by ProblemBuilder
+        """
+        return [(metadata.condition_count, lambda x: [x.conditional_field]),
+                (metadata.instruction_count, lambda x: [x.opcode_field]),
+                (metadata.storage_count, lambda x: x.storages_used())]
+
+    @staticmethod
+    def from_program(program, metadata):
+        """
+        Table of the counts of a MetadataCollector
+        :param program: Candidates of each address, in the form {address: [candidates]}, or a CandidateTable
+        """
+        if isinstance(program, CandidateTable):
+            return CountTable.from_candidate_table(program, metadata)
+        return CountTable(program, CountTable.metadata_sums(metadata))
+
+    @staticmethod
+    def from_candidate_table(table, metadata):
+        """
+        Table of the counts of a MetadataCollector (the sums of CountSolver.from_metadata) over the candidates of a
+        CandidateTable. The fields are read from its columns, without asking each candidate for them.
+        The candidates are the views of the rows.
+        """
+        result = CountTable.__new__(CountTable)
+        exactsums = (metadata.condition_count, metadata.instruction_count, metadata.storage_count)
+        result.fields = []
+        ids = {}
+        limits = []
+        for s, exactsum in enumerate(exactsums):
+            for k, v in exactsum.items():
+                ids[(s, k)] = len(result.fields)
+                result.fields.append((s, k))
+                limits.append(v)
+
+        # A (row, sum, field) triplet for each time a live candidate uses a field
+        live = numpy.flatnonzero(~table.ignore)
+        rows = [live, live]
+        sums = [numpy.zeros(len(live), dtype=numpy.int64), numpy.ones(len(live), dtype=numpy.int64)]
+        values = [table.cond[live].astype(numpy.int64), table.opcode[live].astype(numpy.int64)]
+        for bit in range(0, AReg.MASK_OTHER):
+            used = live[(table.registers[live] >> numpy.uint32(bit)) & 1 == 1]
+            rows.append(used)
+            sums.append(numpy.full(len(used), 2, dtype=numpy.int64))
+            values.append(numpy.full(len(used), bit, dtype=numpy.int64))
+        # The storages sharing the last bit of the mask are asked to the candidates
+        other = live[(table.registers[live] >> numpy.uint32(AReg.MASK_OTHER)) & 1 == 1]
+        for row in other.tolist():
+            used = [x for x in set(table.instruction(row).storages_used()) if x >= AReg.MASK_OTHER]
+            rows.append(numpy.full(len(used), row, dtype=numpy.int64))
+            sums.append(numpy.full(len(used), 2, dtype=numpy.int64))
+            values.append(numpy.asarray(used, dtype=numpy.int64))
+        rows, sums, values = numpy.concatenate(rows), numpy.concatenate(sums), numpy.concatenate(values)
+
+        # Column of each distinct (sum, field), fields out of the sums are used 0 times
+        pairs, inverse = numpy.unique(numpy.stack((sums, values), axis=1), axis=0, return_inverse=True)
+        columns = []
+        for s, k in pairs.tolist():
+            if (s, k) not in ids:
+                ids[(s, k)] = len(result.fields)
+                result.fields.append((s, k))
+                limits.append(0)
+            columns.append(ids[(s, k)])
+        cols = numpy.asarray(columns, dtype=numpy.intp)[inverse.reshape(-1)]
+
+        # Addresses with a single candidate are decided already
+        counts = table.counts()
+        per_row = numpy.repeat(counts, counts)
+        fixed = per_row == 1
+        result.fixed = {int(table.addresses[i]): table.instruction(int(table.offsets[i]))
+                        for i in numpy.flatnonzero(counts == 1).tolist()}
+        result.limits = numpy.array(limits, dtype=numpy.int64)
+        result.base = numpy.bincount(cols[fixed[rows]], minlength=len(limits)).astype(numpy.int64)
+
+        undecided = numpy.flatnonzero(counts > 1)
+        result.addresses = [int(a) for a in table.addresses[undecided]]
+        candidate_rows = numpy.flatnonzero(per_row > 1)
+        result.candidates = [table.instruction(r) for r in candidate_rows.tolist()]
+        result.starts = numpy.concatenate(([0], numpy.cumsum(counts[undecided])[:-1])).astype(numpy.intp) \
+            if len(undecided) > 0 else numpy.zeros(0, dtype=numpy.intp)
+        result.ends = numpy.append(result.starts[1:], len(result.candidates)).astype(numpy.intp)
+        result.owner = numpy.repeat(numpy.arange(len(undecided)), counts[undecided])
+        # Rows of the table renumbered as rows of the candidates
+        number = numpy.full(len(table), -1, dtype=numpy.intp)
+        number[candidate_rows] = numpy.arange(len(candidate_rows))
+        taken = number[rows] >= 0
+        result.rows = number[rows][taken]
+        result.cols = cols[taken]
+        return result
+
+    def matrix(self, dtype=numpy.int32):
+        """
+        :return: The dense matrix with the times each candidate uses each field
+        """
+        m = numpy.zeros((len(self.candidates), len(self.fields)), dtype=dtype)
+        numpy.add.at(m, (self.rows, self.cols), 1)
+        return m
+
+
+class CountSolver(object):
+    """
+    Enumerates the choices of one candidate per address using each field an exact amount of times.
+    Candidates with ignore on do not count.
+    """
+
+    def __init__(self, program, sums, score_fn=None, hint=None, max_nodes=None):
+        """
+        :param program: Candidates of each address, in the form {address: [candidates]}, or their CountTable.
+                        Addresses without candidates are left out of the solutions.
+        :param sums: List of (exactsum, field_fn) as given to ExactFieldSumConstraint
+        :param score_fn: Function giving the score of a candidate. The best scored candidates are tried first.
+        :param hint: Candidate to try first at each address, in the form {address: candidate}
+        :param max_nodes: Candidates tried by the search before giving up. No limit by default.
+        """
+        self._score_fn = score_fn if score_fn else lambda x: x.score()
+        self.max_nodes = max_nodes
+        # Candidates tried by the last search, and whether it ended because of max_nodes
+        self.nodes = 0
+        self.exhausted = False
+        table = program if isinstance(program, CountTable) else CountTable(program, sums)
+        self._limits = table.limits
+        self._base = table.base
+        self._fixed = table.fixed
+        self._addresses = table.addresses
+        self._candidates = table.candidates
+        self._starts = table.starts
+        self._ends = table.ends
+        self._owner = table.owner
+        self._matrix = table.matrix()
+        self._scores = numpy.array([self._score_fn(c) for c in self._candidates], dtype=numpy.float64)
+        self._hinted = numpy.zeros(len(self._candidates), dtype=bool)
+        if hint:
+            for r, c in enumerate(self._candidates):
+                self._hinted[r] = hint.get(self._addresses[self._owner[r]]) is c
+
+    @staticmethod
+    def from_metadata(program, metadata, score_fn=None, hint=None, max_nodes=None):
+        """
+        Solver of the counts of a MetadataCollector, the same constraints added by ProblemBuilder
+        :param program: Candidates of each address, in the form {address: [candidates]}, or a CandidateTable
+        """
+        return CountSolver(CountTable.from_program(program, metadata), CountTable.metadata_sums(metadata), score_fn,
+                           hint, max_nodes)
+
+    def _propagate(self, alive):
+        """
+        Removes the candidates that can not be part of a solution given the counts
+        :param alive: Boolean array with the candidates left. It is modified.
+        :return: The candidates left, or None if there are no solutions
+        """
+        if len(self._starts) == 0:
+            return alive if numpy.array_equal(self._base, self._limits) else None
+        big = numpy.iinfo(numpy.int32).max
+        while True:
+            if not numpy.add.reduceat(alive, self._starts).all():
+                return None
+            low = numpy.minimum.reduceat(numpy.where(alive[:, None], self._matrix, big), self._starts)
+            high = numpy.maximum.reduceat(numpy.where(alive[:, None], self._matrix, -1), self._starts)
+            low_sum = self._base + low.sum(axis=0)
+            high_sum = self._base + high.sum(axis=0)
+            if (low_sum > self._limits).any() or (high_sum < self._limits).any():
+                return None
+            # Counts reachable taking each candidate instead of the smallest or largest of its address
+            supported = ((low_sum - low[self._owner] + self._matrix <= self._limits).all(axis=1) &
+                         (high_sum - high[self._owner] + self._matrix >= self._limits).all(axis=1))
+            removed = alive & ~supported
+            if not removed.any():
+                return alive
+            alive &= supported
+
+    def _branch(self, alive):
+        """
+        Chooses the address to decide next: the one with fewest candidates left
+        :return: The candidates of the address to try, the hinted and best scored last, or None if all addresses
+                 are decided
+        """
+        left = numpy.add.reduceat(alive, self._starts) if len(self._starts) > 0 else numpy.zeros(0, dtype=int)
+        undecided = numpy.flatnonzero(left > 1)
+        if len(undecided) == 0:
+            return None
+        a = undecided[numpy.argmin(left[undecided])]
+        rows = self._starts[a] + numpy.flatnonzero(alive[self._starts[a]:self._ends[a]])
+        return rows[numpy.lexsort((self._scores[rows], self._hinted[rows]))].tolist()
+
+    def _solution(self, alive):
+        solution = dict(self._fixed)
+        for r in numpy.flatnonzero(alive).tolist():
+            solution[self._addresses[self._owner[r]]] = self._candidates[r]
+        return solution
+
+    def getSolutionIter(self):
+        """
+        Enumerates the solutions. The search is depth first, keeping the candidates left at each level.
+        When max_nodes candidates were tried the enumeration ends, with exhausted on.
+        :return: A generator of dictionaries {address: candidate}
+        """
+        self.nodes = 0
+        self.exhausted = False
+        alive = self._propagate(numpy.ones(len(self._candidates), dtype=bool))
+        if alive is None:
+            return
+        rows = self._branch(alive)
+        if rows is None:
+            yield self._solution(alive)
+            return
+        stack = [(alive, rows)]
+        while stack:
+            alive, rows = stack[-1]
+            if not rows:
+                stack.pop()
+                continue
+            if self.max_nodes is not None and self.nodes >= self.max_nodes:
+                self.exhausted = True
+                return
+            self.nodes += 1
+            r = rows.pop()
+            a = self._owner[r]
+            child = alive.copy()
+            child[self._starts[a]:self._ends[a]] = False
+            child[r] = True
+            child = self._propagate(child)
+            if child is None:
+                continue
+            child_rows = self._branch(child)
+            if child_rows is None:
+                yield self._solution(child)
+            else:
+                stack.append((child, child_rows))
+
+    def getSolution(self):
+        """
+        :return: The first solution found, None if there are none or the search is exhausted
+        """
+        return next(self.getSolutionIter(), None)
+
+    def getSolutions(self):
+        return list(self.getSolutionIter())
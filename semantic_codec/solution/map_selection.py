@@ -0,0 +1,116 @@
+"""
+Most likely program under the counts of the metadata, as an integer linear program.
+
+There is a variable x per candidate, 1 if the candidate is taken. Each address takes one candidate, and each field is
+used as many times as the MetadataCollector counted:
+
+    minimize    sum(cost * x) + slack_cost * sum(over + under)
+    subject to  sum(x of the candidates of an address) = 1                           for every address
+                sum(times a candidate uses a field * x) - over + under = count left    for every field
+
+The cost of a candidate is -log(score), its score being the probability given by probabilistic_rules, so the
+solution is the maximum a posteriori program. The slack variables over and under keep the problem feasible when the
+counts can not be met, for instance if the recovery discarded a good candidate. Their cost is larger than any
+difference of scores, so the counts are only broken when there is no other way.
+
+The program is solved with the HiGHS solver of SciPy. The matrix is sparse, a candidate only uses a few fields.
+"""
+from math import log
+
+import numpy
+from scipy.optimize import Bounds, LinearConstraint, milp
+from scipy.sparse import csr_matrix, identity, hstack, vstack
+
+from semantic_codec.solution.count_solver import CountTable
+
+
+class MapSelector(object):
+    """
+    Chooses the most likely candidate of each address among those using each field an exact amount of times
+    """
+
+    # Probability given to candidates scored 0, so their cost is finite
+    MIN_SCORE = 1e-12
+
+    def __init__(self, program, sums, score_fn=None, slack_cost=None):
+        """
+        :param program: Candidates of each address, in the form {address: [candidates]}, or their CountTable.
+                        Addresses without candidates are left out of the solution.
+        :param sums: List of (exactsum, field_fn) as given to ExactFieldSumConstraint
+        :param score_fn: Function giving the probability of a candidate
+        :param slack_cost: Cost of each time a count is broken. By default, more than any choice of candidates.
+                           If 0, the counts can not be broken.
+        """
+        self._score_fn = score_fn if score_fn else lambda x: x.score()
+        self._sums = sums
+        self._table = program if isinstance(program, CountTable) else CountTable(program, sums)
+        self._costs = numpy.array([-log(max(self._score_fn(c), MapSelector.MIN_SCORE))
+                                   for c in self._table.candidates], dtype=numpy.float64)
+        if slack_cost is None:
+            t = self._table
+            spread = 0.0
+            if len(t.starts) > 0:
+                spread = (numpy.maximum.reduceat(self._costs, t.starts) -
+                          numpy.minimum.reduceat(self._costs, t.starts)).sum()
+            slack_cost = spread + 1
+        self._slack_cost = slack_cost
+
+    @staticmethod
+    def from_metadata(program, metadata, score_fn=None, slack_cost=None):
+        """
+        Selector under the counts of a MetadataCollector, the same constraints added by ProblemBuilder
+        :param program: Candidates of each address, in the form {address: [candidates]}, or a CandidateTable.
+                        The fields of the candidates of a table are read from its columns.
+        """
+        return MapSelector(CountTable.from_program(program, metadata), CountTable.metadata_sums(metadata),
+                           score_fn, slack_cost)
+
+    def select(self):
+        """
+        Solves the program
+        :return: The solution, in the form {address: candidate}, and the slack: a list with a dictionary per sum
+                 with the fields whose count was broken, and by how much ({field: count taken - count expected}).
+                 The solution is None if the counts can not be met and the slack cost is 0.
+        """
+        t = self._table
+        n, f = len(t.candidates), len(t.fields)
+        counts = csr_matrix((numpy.ones(len(t.rows)), (t.cols, t.rows)), shape=(f, n))
+        choose = csr_matrix((numpy.ones(n), (t.owner, numpy.arange(n))), shape=(len(t.addresses), n))
+        left = (t.limits - t.base).astype(numpy.float64)
+        a = vstack([choose, counts])
+        c = self._costs
+        integrality = numpy.ones(n)
+        if self._slack_cost > 0:
+            # Over and under variables of every field
+            slack = hstack([-identity(f), identity(f)])
+            a = hstack([a, vstack([csr_matrix((len(t.addresses), 2 * f)), slack])])
+            c = numpy.concatenate((c, numpy.full(2 * f, float(self._slack_cost))))
+            integrality = numpy.concatenate((integrality, numpy.zeros(2 * f)))
+        upper = numpy.ones(len(c))
+        upper[n:] = numpy.inf
+        b = numpy.concatenate((numpy.ones(len(t.addresses)), left))
+
+        if n == 0:
+            # All the addresses are decided
+            taken = numpy.zeros(0, dtype=bool)
+            if self._slack_cost <= 0 and (left != 0).any():
+                return None, []
+        else:
+            result = milp(c, integrality=integrality, bounds=Bounds(numpy.zeros(len(c)), upper),
+                          constraints=LinearConstraint(a.tocsr(), b, b))
+            if result.status == 2:
+                # Infeasible, only possible without slack
+                return None, []
+            if not result.success:
+                raise RuntimeError('The selection could not be solved: {}'.format(result.message))
+            taken = result.x[:n] > 0.5
+        over = t.base + counts @ taken.astype(numpy.int64) - t.limits
+
+        solution = dict(t.fixed)
+        for r in numpy.flatnonzero(taken).tolist():
+            solution[t.addresses[t.owner[r]]] = t.candidates[r]
+        slack = [{} for s in self._sums]
+        for k in numpy.flatnonzero(over).tolist():
+            s, field = t.fields[k]
+            slack[s][field] = int(over[k])
+        return solution, slack
@@ -0,0 +1,158 @@
+"""
+Ranking of the candidates of a recovered program, and which of them are the original instruction.
+
+The evaluation of a recovery asks two questions at every address: in which order are the candidates, and which of
+them is the original instruction. A candidate counts as the original when it prints the same (an alias of it), so
+the answer used to be a comparison of the assembly texts, formatting the candidates again and again.
+
+SemanticEquivalence answers it with ids instead: the candidates of an address are split once into classes of
+candidates printing the same, and each class is identified by the encoding of its first member. Only candidates
+sharing their mnemonic with another one are ever formatted, as different mnemonics never print the same. Which
+candidates are the original is also kept by encoding, and only needs the candidates with the original mnemonic.
+
+CandidateRanking sorts the candidates of every address once, so SolutionQuality, print_report and SolutionWriter
+all read the same order.
+"""
+from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict
+
+
+class SemanticEquivalence(object):
+    """
+    Classes of the candidates printing the same at each address, including the original instruction
+    """
+
+    def __init__(self, program, original_program):
+        """
+        :param program: Candidates of each address, in the form {address: [candidates]}
+        :param original_program: Original instructions, as a list or in the form {address: [instruction]}
+        """
+        if original_program.__class__ is list:
+            original_program = from_instruction_list_to_dict(original_program)
+        self._program = program
+        self._original = original_program
+        self._classes = {}
+        # Candidates printing the same as the original, by encoding. Found without building all the classes.
+        self._is_original = {}
+
+    @staticmethod
+    def _mnemonic(inst):
+        features = getattr(inst, 'features', None)
+        return features.mnemonic if features is not None else None
+
+    def original(self, addr):
+        return self._original[addr][0]
+
+    def classes(self, addr):
+        """
+        Class of each encoding found at an address
+        :return: A dictionary {encoding: id of the class}, the id being the encoding of the first member
+        """
+        try:
+            return self._classes[addr]
+        except KeyError:
+            pass
+        members = {}
+        for inst in [self.original(addr)] + self._program.get(addr, []):
+            members.setdefault(inst.encoding, inst)
+
+        by_mnemonic = {}
+        for inst in members.values():
+            by_mnemonic.setdefault(SemanticEquivalence._mnemonic(inst), []).append(inst)
+        classes = {}
+        for group in by_mnemonic.values():
+            if len(group) == 1:
+                classes[group[0].encoding] = group[0].encoding
+                continue
+            texts = {}
+            for inst in group:
+                classes[inst.encoding] = texts.setdefault(str(inst), inst.encoding)
+        self._classes[addr] = classes
+        return classes
+
+    def class_of(self, addr, inst):
+        classes = self.classes(addr)
+        if inst.encoding not in classes:
+            # A candidate added after the classes were built
+            del self._classes[addr]
+            classes = self.classes(addr)
+        return classes[inst.encoding]
+
+    def same(self, addr, inst, other):
+        """
+        Indicates if two candidates of an address print the same
+        """
+        return inst.encoding == other.encoding or self.class_of(addr, inst) == self.class_of(addr, other)
+
+    def is_original(self, addr, inst):
+        """
+        Indicates if a candidate prints the same as the original instruction of its address
+        """
+        try:
+            return self._is_original[addr][inst.encoding]
+        except KeyError:
+            pass
+        ori = self.original(addr)
+        result = inst.encoding == ori.encoding or \
+            (SemanticEquivalence._mnemonic(inst) == SemanticEquivalence._mnemonic(ori) and str(inst) == str(ori))
+        self._is_original.setdefault(addr, {})[inst.encoding] = result
+        return result
+
+    def original_index(self, addr, candidates=None):
+        """
+        Position of the first candidate printing the same as the original instruction
+        :param candidates: Candidates to search, those of the address in the program by default
+        :return: The position, or None if the original instruction is not among them
+        """
+        candidates = self._program[addr] if candidates is None else candidates
+        for i, inst in enumerate(candidates):
+            if self.is_original(addr, inst):
+                return i
+        return None
+
+
+class CandidateRanking(object):
+    """
+    The candidates of every address sorted from the best scored to the worst, ties by encoding
+    """
+
+    def __init__(self, program, original_program, equivalence=None):
+        """
+        Ranks the candidates, sorting the lists of the program in place. Must be built again if the scores change.
+        :param program: Candidates of each address, in the form {address: [candidates]}
+        :param original_program: Original instructions, as a list or in the form {address: [instruction]}
+        """
+        self._program = program
+        self.equivalence = equivalence if equivalence else SemanticEquivalence(program, original_program)
+        for v in program.values():
+            if len(v) > 1:
+                v.sort(key=CandidateRanking.key)
+        self._positions = {}
+
+    @staticmethod
+    def key(inst):
+        return -inst.score(), inst.encoding
+
+    def ranked(self, addr):
+        """
+        The candidates of an address, best first
+        """
+        return self._program[addr]
+
+    def position(self, addr, encoding):
+        """
+        Rank of the first candidate of an address with a given encoding, None if there are none
+        """
+        try:
+            positions = self._positions[addr]
+        except KeyError:
+            positions = {}
+            for i, inst in enumerate(self._program[addr]):
+                positions.setdefault(inst.encoding, i)
+            self._positions[addr] = positions
+        return positions.get(encoding)
+
+    def original_rank(self, addr):
+        """
+        Rank of the first candidate printing the same as the original instruction, None if there are none
+        """
+        return self.equivalence.original_index(addr)
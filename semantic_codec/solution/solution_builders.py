@@ -1,22 +1,26 @@
 from math import log
 
+import numpy
 from constraint import *
 
 from semantic_codec.architecture.bits import BitQueue
+from semantic_codec.metadata.candidate_index import CandidateIndex
 from semantic_codec.metadata.metadata_collector import MetadataCollector
 from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict
+from semantic_codec.solution.count_solver import CountSolver
+from semantic_codec.solution.map_selection import MapSelector
+from semantic_codec.solution.ranking import SemanticEquivalence
 
 
 class ExactFieldSumConstraint(Constraint):
     """
-    Constraint enforcing that values of given variables sum exactly
-    to a given amount
-    Example:
-    >>> problem = Problem()
-    >>> problem.addVariables(["a", "b"], [1, 2])
-    >>> problem.addConstraint(ExactFieldSumConstraint(3))
-    >>> sorted(sorted(x.items()) for x in problem.getSolutions())
-    [[('a', 1), ('b', 2)], [('a', 2), ('b', 1)]]
+    Constraint enforcing that the amount of times each field is used by the values of given variables is
+    exactly a given amount. Values with ignore on do not count.
+
+    The counts are kept from one call to the next. The backtracking solvers handle the assignments as a stack:
+    between two calls the variables on top are unassigned and a new one is assigned, so only those are recounted.
+    The fields of every value are computed once, when the solver starts, as arrays of field ids. Forward checking
+    compares the fields of all the values against the counts left in a single array operation.
     """
 
     def __init__(self, exactsum, field_fn, report=False):
@@ -24,54 +28,102 @@ class ExactFieldSumConstraint(Constraint):
         self._field_fn = field_fn
         self._report = report
 
-    def __call__(self, variables, domains, assignments, forwardcheck=False):
+        # Fields not in the sum get the last id, which can be used 0 times
+        self._ids = {k: i for i, k in enumerate(exactsum)}
+        self._limits = numpy.array([exactsum[k] for k in exactsum] + [0], dtype=numpy.int64)
+        self._counts = numpy.zeros(len(self._limits), dtype=numpy.int64)
+        self._assignments = None
+        self._stack = []
 
-        exactsum = self._exactsum
-
-        sum = {}
-        for k in exactsum:
-            sum[k] = 0
-
-        missing = False
-        for variable in variables:
-            if variable in assignments:
-                inst = assignments[variable]
-                if inst.ignore:
-                    continue
-                vv = self._field_fn(inst)
-                for v in vv:
-                    if not v in sum:
-                        sum[v] = 1
-                    else:
-                        sum[v] += 1
-            else:
-                missing = True
+    def _value_fields(self, value):
+        """
+        Field ids of a value and the times each one is used
+        """
+        if value.ignore:
+            return numpy.zeros(0, dtype=numpy.intp), numpy.zeros(0, dtype=numpy.int64)
+        ids = [self._ids.get(v, len(self._limits) - 1) for v in self._field_fn(value)]
+        return numpy.unique(numpy.asarray(ids, dtype=numpy.intp), return_counts=True)
+
+    def preProcess(self, variables, domains, constraints, vconstraints):
+        self._variable_index = {v: i for i, v in enumerate(variables)}
+        self._values = {}
+        owners, occurrences, fields, times = [], [], [], []
+        for i, variable in enumerate(variables):
+            for value in domains[variable]:
+                ids, count = self._value_fields(value)
+                self._values[id(value)] = (len(owners), ids, count)
+                owners.append(i)
+                occurrences.append(numpy.full(len(ids), len(owners) - 1, dtype=numpy.intp))
+                fields.append(ids)
+                times.append(count)
+        # Every value, and every field of every value, flattened
+        self._owner = numpy.asarray(owners, dtype=numpy.intp)
+        self._value_list = [value for variable in variables for value in domains[variable]]
+        self._occurrence = numpy.concatenate(occurrences) if occurrences else numpy.zeros(0, dtype=numpy.intp)
+        self._field = numpy.concatenate(fields) if fields else numpy.zeros(0, dtype=numpy.intp)
+        self._times = numpy.concatenate(times) if times else numpy.zeros(0, dtype=numpy.int64)
+        self._assigned = numpy.zeros(len(variables), dtype=bool)
+        self._assignments = None
+        self._stack = []
+        self._counts[:] = 0
+        # The assignments only follow a stack if all the variables are in the constraint
+        self._covers_all = len(variables) == len(domains)
+        # With a single variable the base class checks every value, the counting must be ready
+        super(ExactFieldSumConstraint, self).preProcess(variables, domains, constraints, vconstraints)
+
+    def _push(self, variable, value):
+        _, ids, count = self._values[id(value)]
+        self._counts[ids] += count
+        self._assigned[self._variable_index[variable]] = True
+        self._stack.append((variable, value))
+
+    def _pop(self):
+        variable, value = self._stack.pop()
+        _, ids, count = self._values[id(value)]
+        self._counts[ids] -= count
+        self._assigned[self._variable_index[variable]] = False
+
+    def _follow(self, assignments):
+        """
+        Updates the counts to the assignments
+        """
+        if assignments is not self._assignments:
+            self._assignments = assignments
+            while self._stack:
+                self._pop()
+        # The variables assigned last are counted again
+        while len(self._stack) >= len(assignments):
+            self._pop()
+        if not self._covers_all or len(self._stack) < len(assignments) - 1 or \
+                self._stack and assignments.get(self._stack[-1][0]) is not self._stack[-1][1]:
+            # Not a stack of assignments, count them all again
+            while self._stack:
+                self._pop()
+            for variable, value in assignments.items():
+                self._push(variable, value)
+        elif assignments:
+            self._push(*next(reversed(assignments.items())))
 
-        for k in sum:
-            if not k in exactsum or sum[k] > exactsum[k]:
-                return False
+    def __call__(self, variables, domains, assignments, forwardcheck=False):
+        self._follow(assignments)
 
+        left = self._limits - self._counts
+        if (left < 0).any():
+            return False
+
+        missing = len(self._stack) < len(variables)
         if forwardcheck and missing:
-            for variable in variables:
-                if variable not in assignments:
-                    domain = domains[variable]
-                    for value in domain[:]:
-                        if value and not value.ignore:
-                            vv = self._field_fn(value)
-                            for v in vv:
-                                if not v in exactsum or sum[v] + 1 > exactsum[v]:
-                                    domain.hideValue(value)
+            # Values using a field more times than left
+            bad = numpy.unique(self._occurrence[left[self._field] < self._times])
+            bad = bad[~self._assigned[self._owner[bad]]]
+            for j in bad.tolist():
+                value = self._value_list[j]
+                domain = domains[variables[self._owner[j]]]
+                if any(x is value for x in domain):
+                    domain.hideValue(value)
                     if not domain:
                         return False
-        if missing:
-            for k in sum:
-                if sum[k] > exactsum[k]:
-                    return False
-        else:
-            for k in sum:
-                if sum[k] != exactsum[k]:
-                    return False
-        return True
+        return missing or not left[:-1].any()
 
 
 class ProblemBuilder(object):
@@ -88,6 +140,15 @@ class ProblemBuilder(object):
         # problem.addConstraint(ExactOpcodeSumConstraint(metadata.conditional_count))
         return problem
 
+    def build_solver(self, program, metadata, score_fn=None, max_nodes=None):
+        """
+        Same problem as build, solved by a CountSolver instead of python-constraint.
+        The search starts from the most likely program under the counts, given by a MapSelector.
+        :param max_nodes: Budget of the search, see CountSolver
+        """
+        hint, _ = MapSelector.from_metadata(program, metadata, score_fn).select()
+        return CountSolver.from_metadata(program, metadata, score_fn, hint, max_nodes)
+
 
 class ForwardConstraintRecuperator(object):
     """
@@ -96,6 +157,99 @@ class ForwardConstraintRecuperator(object):
     pass
 
 
+class AddressQueue(object):
+    """
+    Indexed binary heap of addresses keyed by their amount of candidates, from min to max or from max to min.
+
+    The addresses are popped in the same order of sorting them with a stable sort after every change: equal amounts
+    keep the order of the addresses, and an address whose amount changed goes after the addresses already having
+    its new amount (before them, from max to min).
+    """
+
+    def __init__(self, program, addresses, reverse=False):
+        """
+        :param program: Program in the form {address: [candidates]}
+        :param addresses: Addresses in the queue, ties are broken by this order
+        :param reverse: Pop the address with more candidates first
+        """
+        self._program = program
+        self._reverse = reverse
+        self._key = {a: (self._length(a), i) for i, a in enumerate(addresses)}
+        # A sorted list is a heap already
+        self._heap = sorted(self._key.keys(), key=self._key.get)
+        self._position = {a: i for i, a in enumerate(self._heap)}
+        # Ties of the addresses updated: above all the others from min to max, below them from max to min
+        self._next_tie = len(self._heap)
+        self._previous_tie = -1
+
+    def _length(self, address):
+        return -len(self._program[address]) if self._reverse else len(self._program[address])
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __contains__(self, address):
+        return address in self._position
+
+    def __iter__(self):
+        return iter(list(self._heap))
+
+    def pop(self):
+        """
+        Removes the address first in the order and returns it
+        """
+        top = self._heap[0]
+        last = self._heap.pop()
+        del self._position[top]
+        del self._key[top]
+        if self._heap:
+            self._heap[0] = last
+            self._position[last] = 0
+            self._sift_down(0)
+        return top
+
+    def update(self, addresses):
+        """
+        Moves addresses whose amount of candidates changed to their new place
+        """
+        changed = sorted((a for a in addresses if a in self._position and self._key[a][0] != self._length(a)),
+                         key=self._key.get, reverse=self._reverse)
+        for a in changed:
+            if self._reverse:
+                tie, self._previous_tie = self._previous_tie, self._previous_tie - 1
+            else:
+                tie, self._next_tie = self._next_tie, self._next_tie + 1
+            self._key[a] = (self._length(a), tie)
+            self._sift_up(self._position[a])
+            self._sift_down(self._position[a])
+
+    def _swap(self, i, j):
+        h = self._heap
+        h[i], h[j] = h[j], h[i]
+        self._position[h[i]] = i
+        self._position[h[j]] = j
+
+    def _sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self._key[self._heap[i]] >= self._key[self._heap[parent]]:
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i):
+        n = len(self._heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self._key[self._heap[child]] < self._key[self._heap[smallest]]:
+                    smallest = child
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+
 class AbstractForwardConstraintSolutionBuilder(object):
 
     def __init__(self, program, original_program):
@@ -105,10 +259,14 @@ class AbstractForwardConstraintSolutionBuilder(object):
         self._metadata.collect(original_program)
         self._solution_size = 0
         self._original = from_instruction_list_to_dict(original_program)
+        # Candidates printing the same as the original instructions
+        self._equivalence = SemanticEquivalence(program, self._original)
         self._solution = BitQueue()
         self._forward_update = False
         # Indicates min number of candidates an address is reduced to
         self._candidates_reduced = None
+        # Inverted index of the fields of the candidates left, kept while building
+        self._index = None
 
     @property
     def solution(self):
@@ -142,51 +300,80 @@ class AbstractForwardConstraintSolutionBuilder(object):
 
     def _remove_invalid_instructions(self, addresses):
         """
-        Remove all instructions not complaining with current constraints
-        :return: True if some instructions were removed
+        Remove all instructions not complaining with current constraints. The last candidate of an address is kept.
+        :param addresses: Addresses to check
+        :return: The addresses whose candidates were removed
         """
-        for k in range(1, len(addresses)):
-            a = addresses[k]
+        changed = []
+        for a in addresses:
             i = 1
             pa = self._program[a]
+            ln = len(pa)
             while i < len(pa):
                 if not self._comply_constraints(pa[i - 1]):
-                    pa.pop(i - 1)
+                    inst = pa.pop(i - 1)
+                    if self._index is not None:
+                        self._index.remove(a, inst)
                 else:
                     i += 1
+            if len(pa) != ln:
+                changed.append(a)
+        return changed
 
     def _update_constraints(self, inst):
+        """
+        Takes the fields of an instruction chosen as solution out of the counts
+        :return: The fields whose count reached 0, as (kind, field) pairs with the kinds of CandidateIndex
+        """
         if inst.ignore:
-            return
+            return []
 
-        if inst.opcode_field in self._metadata.instruction_count:
-            self._metadata.instruction_count[inst.opcode_field] -= 1
+        m = self._metadata
+        if inst.opcode_field in m.instruction_count:
+            m.instruction_count[inst.opcode_field] -= 1
 
-        if inst.conditional_field in self._metadata.condition_count:
-            self._metadata.condition_count[inst.conditional_field] -= 1
+        if inst.conditional_field in m.condition_count:
+            m.condition_count[inst.conditional_field] -= 1
 
         for r in inst.storages_used():
-            if r in self._metadata.storage_count:
-                self._metadata.storage_count[r] -= 1
+            if r in m.storage_count:
+                m.storage_count[r] -= 1
+
+        exhausted = []
+        if m.instruction_count.get(inst.opcode_field) == 0:
+            exhausted.append((CandidateIndex.OP, inst.opcode_field))
+        if m.condition_count.get(inst.conditional_field) == 0:
+            exhausted.append((CandidateIndex.COND, inst.conditional_field))
+        for r in set(inst.storages_used()):
+            if m.storage_count.get(r) == 0:
+                exhausted.append((CandidateIndex.REG, r))
+        return exhausted
 
     def _find_address_correct_index(self, pa, ori, ln):
-        index = 0
-        while index < ln and str(pa[index]) != str(ori):
-            index += 1
-        if index == ln:
+        index = self._equivalence.original_index(ori.address, pa)
+        if index is None:
             raise RuntimeError('Impossible')
         return index
 
     def build(self):
-        addresses = [x for x in self._program.keys()]
-        addresses.sort(key=lambda x: len(self._program[x]), reverse=self._from_max_to_min)
+        """
+        Solves the addresses from the one with fewer candidates to the one with more (or the other way around).
+        With forward update, the candidates not complying with the counts left are removed after each address.
+
+        Only the candidates using a field whose count just reached 0 can stop complying, so after a first full
+        check the addresses to check are found in an inverted index of the fields.
+        """
+        addresses = AddressQueue(self._program, self._program.keys(), self._from_max_to_min)
+        self._index = None
 
         while len(addresses) > 0:
-            pa = self._program[addresses[0]]
+            address = addresses.pop()
+            if self._index is not None:
+                self._index.remove_address(address)
+            pa = self._program[address]
             ln = len(pa)
-            ori = self._original[addresses[0]][0]
+            ori = self._original[address][0]
             if ln <= 0 or ori.ignore:
-                addresses.pop(0)
                 continue
 
             index = 0
@@ -196,15 +383,17 @@ class AbstractForwardConstraintSolutionBuilder(object):
 
             if self._forward_update:
                 # Update the constrains now that we have updated the solution
-                self._update_constraints(pa[index])
+                exhausted = self._update_constraints(pa[index])
                 # With the constrains updated, remove all instructions which are invalid
-                self._remove_invalid_instructions(addresses)
-
-            addresses.pop(0)
-            # if self._candidates_reduced:
-            addresses.sort(key=lambda x: len(self._program[x]), reverse=self._from_max_to_min)
-
-
+                if self._index is None:
+                    changed = self._remove_invalid_instructions(addresses)
+                    self._index = CandidateIndex.from_program({a: self._program[a] for a in addresses})
+                else:
+                    affected = set()
+                    for kind, field in exhausted:
+                        affected.update(self._index.addresses(kind, field))
+                    changed = self._remove_invalid_instructions(affected)
+                addresses.update(changed)
 
     def _on_index_found(self, size, pa, ori, ln):
         pass
@@ -1,5 +1,7 @@
 import struct
 
+import numpy
+
 from semantic_codec.architecture.capstone_instruction import CAPSInstruction
 from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict
 
@@ -30,11 +32,18 @@ class SolutionReader(object):
                 addr = self.read_int(fin)
                 count = self.read_int(fin)
                 if count > 0:
-                    program[addr] = [CAPSInstruction(self.read_int(fin), addr) for j in range(0, count)]
-                    original[addr] = [CAPSInstruction(program[addr][count - 1].encoding, addr)]
+                    program[addr] = [self.read_int(fin) for j in range(0, count)]
         finally:
             fin.close()
 
+        # Decode all the words of the solution at once
+        addresses = [addr for addr, v in program.items() for e in v]
+        encodings = [e for v in program.values() for e in v]
+        instructions = iter(CAPSInstruction.decode_many(encodings, addresses))
+        for addr, v in program.items():
+            program[addr] = [next(instructions) for e in v]
+            original[addr] = [CAPSInstruction(v[len(v) - 1], addr)]
+
         return original, program
 
 
@@ -48,36 +57,48 @@ class SolutionWriter(object):
     def write_int(self, fout, value):
         fout.write(struct.pack('<L', value))
 
-    def write_binary(self, file_name, original_program, program):
+    def write_binary(self, file_name, original_program, program, erasures=None, ranking=None):
+        """
+        Writes the candidates of each address up to the original one
+        :param erasures: Erasure mask of each word of the program, in address order. The addresses without erased
+                         bits are written straight from the original program, without reading their candidates.
+        :param ranking: CandidateRanking of the program, shared with the reports, to find the original candidates
+        """
 
         if original_program.__class__ is list:
             original_program = from_instruction_list_to_dict(original_program)
 
+        intact = set()
+        if erasures is not None:
+            addresses = sorted(program.keys())
+            intact = {addresses[i] for i in numpy.flatnonzero(numpy.asarray(erasures) == 0).tolist()}
+
         fout = open(file_name, 'wb')
 
         self.write_long(fout, SolutionWriter.MAGIC_WORD)
 
         try:
             self.write_int(fout, len(program))
-            for k, v in program.items():
+            for k in program.keys():
                 self.write_int(fout, k)
-                ori = -1
-                index = 0
-
-                # Search for all the instructions in the address which one is the original
-                for vv in v:
-                    if vv.encoding == original_program[k][0].encoding:
-                        ori = index
-                        # What's the point of storing bad solutions?
-                        break
-                    index += 1
+                if k in intact:
+                    self.write_int(fout, 1)
+                    self.write_int(fout, original_program[k][0].encoding)
+                    continue
+
+                v = program[k]
+                if ranking is not None:
+                    ori = ranking.position(k, original_program[k][0].encoding)
+                else:
+                    # Search for all the instructions in the address which one is the original
+                    ori = next((i for i, vv in enumerate(v) if vv.encoding == original_program[k][0].encoding), None)
 
                 # If we reach the end without finding the original, something weird happen
-                if index == len(v):
+                if ori is None:
                     raise RuntimeError("This address does not contains the original instruction.")
 
                 self.write_int(fout, ori + 1)
                 for i in range(0, ori + 1):
                     self.write_int(fout, v[i].encoding)
         finally:
-            fout.close()
\ No newline at end of file
+            fout.close()
@@ -1,7 +1,7 @@
-import sys
 from math import log
 
 from semantic_codec.metadata.recuperator import probabilistic_rules
+from semantic_codec.solution.ranking import CandidateRanking
 
 
 class SolutionQuality(object):
@@ -10,7 +10,11 @@ class SolutionQuality(object):
     however it has other parameters as the highest depth.
     """
 
-    def __init__(self, program, original_program):
+    def __init__(self, program, original_program, ranking=None):
+        """
+        :param ranking: CandidateRanking of the program, shared with the reports. If not given, the program is
+                        ranked again on every evaluate, as its scores may have changed in between.
+        """
 
         self._highest_depth_bin = {}
 
@@ -27,6 +31,11 @@ class SolutionQuality(object):
 
         self._original_program = original_program
 
+        self._ranking = ranking
+
+        # Candidates printing the same as the original, which does not change with the scores
+        self._equivalence = ranking.equivalence if ranking else None
+
         # Number of bits required to represent the solution
         self._solution_size = None
 
@@ -89,24 +98,21 @@ class SolutionQuality(object):
         self._highest_depth_bin = {}
         max_addr_bin = {}
         max_addr = 0
+        ranking = self._ranking
+        if ranking is None:
+            ranking = CandidateRanking(self._program, self._original_program, self._equivalence)
+            self._equivalence = ranking.equivalence
         for k in range(0, len(self._original_program)):
             if self._original_program[k].ignore:
                 continue
             addr = self._original_program[k].address
-            v = self._program[addr]
-            min_encoding = sys.maxsize
-            for inst in v:
-                if inst.encoding < min_encoding:
-                    min_encoding = inst.encoding
-            v.sort(key=lambda x: 0 if min_encoding == 0 else (x.score() * 1000000000 + min_encoding/ x.encoding), reverse=True)
-            #v.sort(key=lambda x: x.score(), reverse=True)# * 1000000000 + x.encoding / max_encoding, reverse=True)
+            v = ranking.ranked(addr)
 
             # Count the depth bin
-
-            i = 0
             ln = len(v)
-            while i < ln and str(v[i]) != str(self._original_program[k]):
-                i += 1
+            i = ranking.original_rank(addr)
+            if i is None:
+                i = ln
 
             if not ln in self._highest_depth_bin:
                 self._highest_depth_bin[ln] = 0
@@ -16,8 +16,8 @@ class TestCAPSInstruction(TestCase):
         caps = CAPSInstruction(0xe52de004, 0x10550)
         self.assertEqual(0x10550, caps.address)
         self.assertEqual(str(caps), 'str\tlr, [sp, #-4]!')
-        # This is optional, but I need to check
-        self.assertEqual(0x10550, caps._cap.address)
+        # The decoded facts are shared by all the instructions with the same encoding
+        self.assertIs(caps._cap, CAPSInstruction(0xe52de004, 0x20000)._cap)
 
     def test_conditional_field(self):
         caps = CAPSInstruction(0xe52de004, 0x10550)  # str;lr, [sp, #-4]!
@@ -102,13 +102,28 @@ class TestCAPSInstruction(TestCase):
         self.assertTrue(CAPSInstruction(0x106f4, 0x10550).is_a('str'))  # strdeq r0, r1, [r1], -r4
         self.assertTrue(CAPSInstruction(0xe28cca10, 0x10550).is_a('add')) # add ip, ip, #0x10000
 
-    #def test_jumping_address(self):
-        #CAPSInstruction(0xebffffeb, 0x10550)
-    #   self.fail()
+    def test_storage_membership(self):
+        caps = CAPSInstruction(0x18bd8010, 0x10550)  # popne {r4, pc}
+        for r in range(0, 64):
+            self.assertEqual(r in caps.storages_written(), caps.writes_storage(r))
+            self.assertEqual(r in caps.storages_read(), caps.reads_storage(r))
+            self.assertEqual(r in caps.storages_used(), caps.uses_storage(r))
+
+    def test_jumping_address(self):
+        # bl #0x10504
+        self.assertEqual(0x10504, CAPSInstruction(0xebffffeb, 0x10550).jumping_address)
+        self.assertEqual('bl\t#0x10504', str(CAPSInstruction(0xebffffeb, 0x10550)))
+        # The same encoding at another address jumps to another address
+        self.assertEqual(0x1ffb4, CAPSInstruction(0xebffffeb, 0x20000).jumping_address)
 
     def test_modifies_flags(self):
         self.assertTrue(CAPSInstruction(0xe3530000, 0x10550).modifies_flags()) # cmp r3, #0
         self.assertFalse(CAPSInstruction(0xe28cca10, 0x10550).modifies_flags()) # add ip, ip, #0x10000
 
-#    def test_encodings_to_inst(self):
-#        self.fail()
+    def test_encodings_to_inst(self):
+        # push {fp, lr}; undefined; bl #0x10504
+        instructions = CAPSInstruction.encodings_to_inst([0xe92d4800, 0xe6000010, 0xebffffeb],
+                                                         addresses=[0x1054c, 0x10550, 0x10550])
+        self.assertEqual(2, len(instructions))
+        self.assertEqual(0x10504, instructions[1].jumping_address)
+        self.assertEqual(3, len(CAPSInstruction.encodings_to_inst([0xe92d4800, 0xe6000010, 0xebffffeb], True)))
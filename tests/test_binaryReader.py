@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+
+from semantic_codec.architecture.disassembler_readers import BinaryReader
+
+
+class TestBinaryReader(TestCase):
+
+    HELLOWORLD_PATH = os.path.join(os.path.dirname(__file__), 'data/programs/helloworld.bin')
+
+    @staticmethod
+    def build_elf(path, text, address, symbols, section='.text'):
+        """
+        Writes a minimal 32 bit little endian ARM ELF with a .text section and a symbol table
+        :param symbols: List of (name, address, type)
+        :param section: Name of the section holding the text
+        """
+        shstrtab = b'\0' + section.encode() + b'\0.symtab\0.strtab\0.shstrtab\0'
+        names = [1] + [shstrtab.index(n) for n in (b'.symtab', b'.strtab', b'.shstrtab')]
+        strtab = b'\0' + b''.join(name.encode() + b'\0' for name, _, _ in symbols)
+        symtab = BinaryReader.SYMBOL.pack(0, 0, 0, 0, 0, 0)
+        name_offset = 1
+        for name, value, kind in symbols:
+            symtab += BinaryReader.SYMBOL.pack(name_offset, value, 0, 0x10 | kind, 0, 1)
+            name_offset += len(name) + 1
+
+        offset = BinaryReader.ELF_HEADER.size
+        body = b''
+        layout = []
+        for content in (text, symtab, strtab, shstrtab):
+            layout.append((offset + len(body), len(content)))
+            body += content + b'\0' * (-len(content) % 4)
+        shoff = offset + len(body)
+        sh = BinaryReader.SECTION_HEADER
+        headers = sh.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        headers += sh.pack(names[0], 1, 6, address, layout[0][0], layout[0][1], 0, 0, 4, 0)
+        headers += sh.pack(names[1], BinaryReader.SHT_SYMTAB, 0, 0, layout[1][0], layout[1][1], 3, 1, 4,
+                           BinaryReader.SYMBOL.size)
+        headers += sh.pack(names[2], 3, 0, 0, layout[2][0], layout[2][1], 0, 0, 1, 0)
+        headers += sh.pack(names[3], 3, 0, 0, layout[3][0], layout[3][1], 0, 0, 1, 0)
+        ident = BinaryReader.ELF_MAGIC + bytes([1, 1, 1]) + b'\0' * 9
+        header = BinaryReader.ELF_HEADER.pack(ident, 2, 40, 1, address, 0, shoff, 0x5000000,
+                                              BinaryReader.ELF_HEADER.size, 0, 0, sh.size, 5, 4)
+        with open(path, 'wb') as f:
+            f.write(header + body + headers)
+
+    def test_raw_binary(self):
+        reader = BinaryReader(self.HELLOWORLD_PATH, base_address=0x10000)
+        self.assertFalse(reader.is_elf())
+        addresses, encodings = reader.encodings()
+        self.assertEqual(185, len(encodings))
+        self.assertFalse(encodings.flags.owndata)
+        self.assertEqual(0x10000, addresses[0])
+        self.assertEqual(0x10000 + 4 * 184, addresses[-1])
+        instructions = reader.read_instructions()
+        self.assertEqual(0xe92d4008, instructions[0].encoding)  # push {r3, lr}
+        self.assertEqual(0x10004, instructions[1].address)
+        self.assertEqual([], reader.read_functions())
+
+    def test_elf(self):
+        with open(self.HELLOWORLD_PATH, 'rb') as f:
+            text = f.read()
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'hello.elf')
+        self.build_elf(path, text, 0x10300, [('_init', 0x10300, 2), ('$a', 0x10300, 0), ('main', 0x10320, 2),
+                                             ('thumb_fn', 0x10341, 2)])
+        try:
+            reader = BinaryReader(path)
+            self.assertTrue(reader.is_elf())
+            self.assertEqual({0x10300: '_init', 0x10320: 'main', 0x10340: 'thumb_fn'}, reader.function_starts())
+            (name, address, words), = reader.sections()
+            self.assertEqual('.text', name)
+            self.assertEqual(0x10300, address)
+            self.assertEqual(numpy.frombuffer(text, dtype='<u4').tolist(), words.tolist())
+
+            fns, instructions = reader.read()
+            self.assertEqual(185, len(instructions))
+            self.assertEqual(['_init', 'main', 'thumb_fn'], [f.name for f in fns])
+            self.assertEqual(8, len(fns[0].instructions))
+            self.assertEqual(0x10320, fns[1].instructions[0].address)
+            self.assertEqual(185 - 16, len(fns[2].instructions))
+            self.assertEqual(185, len(reader.read_program()))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_close(self):
+        with BinaryReader(self.HELLOWORLD_PATH) as reader:
+            data = reader._data()
+            self.assertEqual(185, len(reader.read_instructions()))
+        self.assertTrue(data.closed)
+
+        # Arrays still in use keep the map open until they are released
+        reader = BinaryReader(self.HELLOWORLD_PATH)
+        addresses, encodings = reader.encodings()
+        reader.close()
+        self.assertEqual(0xe92d4008, encodings[0])
+
+    def test_empty_file(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'empty.bin')
+        open(path, 'wb').close()
+        try:
+            with BinaryReader(path) as reader:
+                self.assertFalse(reader.is_elf())
+                addresses, encodings = reader.encodings()
+                self.assertEqual(0, len(encodings))
+                self.assertEqual(([], []), reader.read())
+                self.assertEqual({}, reader.read_program())
+        finally:
+            shutil.rmtree(directory)
+
+    def test_elf_without_code(self):
+        with open(self.HELLOWORLD_PATH, 'rb') as f:
+            text = f.read()
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'data.elf')
+        self.build_elf(path, text, 0x10300, [('main', 0x10300, 2)], section='.data')
+        try:
+            with BinaryReader(path) as reader:
+                self.assertTrue(reader.is_elf())
+                self.assertEqual([], reader.sections())
+                addresses, encodings = reader.encodings()
+                self.assertEqual((0, 0), (len(addresses), len(encodings)))
+                self.assertEqual([], reader.read_instructions())
+                self.assertEqual([], reader.read_functions()[0].instructions)
+                self.assertEqual({}, reader.read_program())
+        finally:
+            shutil.rmtree(directory)
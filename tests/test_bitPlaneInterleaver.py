@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+import numpy
+
+from semantic_codec.interleaver.bit_plane import BitPlaneInterleaver
+from semantic_codec.interleaver.interleaver2d import build_2d_interleave_sp, interleave
+
+
+class TestBitPlaneInterleaver(TestCase):
+
+    DATA = [3, 4, 8, 3, 5, 1, 1, 4, 9, 0, 4, 6, 2, 0, 1, 4]
+
+    def test_interleave_as_bit_queues(self):
+        """
+        The bit planes hold the same chunks than the bit queues of interleave()
+        """
+        for packets in [16, 7]:
+            order = build_2d_interleave_sp(packets, flat=True)
+            engine = BitPlaneInterleaver(order, 2)
+            planes = engine.interleave(TestBitPlaneInterleaver.DATA)
+            lengths = engine.packet_lengths(engine.chunk_count(len(TestBitPlaneInterleaver.DATA)))
+            self.assertEqual(len(TestBitPlaneInterleaver.DATA) * 16, lengths.sum())
+            queues = interleave(TestBitPlaneInterleaver.DATA, order, 2)
+            for p in range(packets):
+                self.assertTrue(numpy.array_equal(queues[p].bits(), planes[p, :lengths[p]].reshape(-1)))
+
+    def test_deinterleave(self):
+        order = build_2d_interleave_sp(7, flat=True)
+        engine = BitPlaneInterleaver(order, 8)
+        data = numpy.arange(1000, 1029, dtype=numpy.uint32)
+        words, erased = engine.deinterleave(engine.interleave(data), numpy.ones(7, dtype=bool), len(data))
+        self.assertTrue(numpy.array_equal(data, words))
+        self.assertFalse(erased.any())
+
+    def test_deinterleave_lost_packets(self):
+        order = build_2d_interleave_sp(16, flat=True)
+        engine = BitPlaneInterleaver(order, 2)
+        planes = engine.interleave(TestBitPlaneInterleaver.DATA)
+        received = numpy.ones(16, dtype=bool)
+        received[[2, 3, 4]] = False
+        planes[2:5] = 1
+        words, erased = engine.deinterleave(planes, received, len(TestBitPlaneInterleaver.DATA))
+        data = numpy.asarray(TestBitPlaneInterleaver.DATA, dtype=numpy.uint32)
+        # Three packets of two bits lost out of sixteen, in every word
+        for w in range(0, len(data)):
+            self.assertEqual(6, bin(int(erased[w])).count('1'))
+        self.assertTrue(numpy.array_equal(data & ~erased, words))
+        # The bit (0, 4) is the first bit of a chunk of the packet 2
+        self.assertEqual(2, order[2])
+        self.assertEqual(0b11 << 4, erased[0] & (0b11 << 4))
+
+    def test_invalid_chunk_size(self):
+        with self.assertRaises(RuntimeError):
+            BitPlaneInterleaver(range(4), 3)
@@ -0,0 +1,58 @@
+import random
+from unittest import TestCase
+
+from semantic_codec.metadata.candidate_index import CandidateIndex
+from semantic_codec.metadata.metadata_collector import CorruptedProgramMetadataCollector
+from tests import test_incrementalRescoring
+
+
+class TestCandidateIndex(TestCase):
+
+    def assert_current(self, index, program):
+        expected = CorruptedProgramMetadataCollector()
+        expected.collect(program)
+        self.assertEqual(expected.address_with_cond, index.address_with_cond)
+        self.assertEqual(expected.address_with_op, index.address_with_op)
+        self.assertEqual(expected.address_with_reg, index.address_with_reg)
+        for kind, counts in enumerate((expected.address_with_cond, expected.address_with_op,
+                                       expected.address_with_reg)):
+            for field, n in counts.items():
+                addresses = {a for a, v in program.items()
+                             if any(field in CandidateIndex.fields_of(i)[kind] for i in v if not i.ignore)}
+                self.assertEqual(addresses, set(index.addresses(kind, field)))
+                self.assertEqual(n, len(addresses))
+
+    def test_remove(self):
+        program, _, _ = test_incrementalRescoring.TestIncrementalRescoring.corrupted_program()
+        index = CandidateIndex.from_program(program)
+        self.assert_current(index, program)
+
+        rnd = random.Random(11)
+        for addr, v in program.items():
+            for inst in [i for i in v if rnd.random() < 0.5]:
+                v.remove(inst)
+                index.remove(addr, inst)
+        self.assert_current(index, program)
+        some = next(a for a, v in program.items() if v)
+        cond = program[some][0].conditional_field
+        self.assertEqual(index.address_with_cond[cond], index.addresses_with_cond(cond))
+        self.assertEqual(0, index.addresses_with_op('not an opcode'))
+
+    def test_update(self):
+        program, _, _ = test_incrementalRescoring.TestIncrementalRescoring.corrupted_program()
+        index = CandidateIndex.from_program(program)
+        changed = [addr for addr, v in program.items() if len(v) > 1]
+        for addr in changed:
+            del program[addr][1:]
+        cond, op, reg = index.update(program, changed)
+        self.assert_current(index, program)
+        self.assertGreater(len(op), 0)
+
+    def test_remove_address(self):
+        program, _, _ = test_incrementalRescoring.TestIncrementalRescoring.corrupted_program()
+        index = CandidateIndex.from_program(program)
+        removed = [addr for addr in program if addr % 8 == 0]
+        for addr in removed:
+            index.remove_address(addr)
+            del program[addr]
+        self.assert_current(index, program)
@@ -0,0 +1,88 @@
+import os
+from unittest import TestCase
+
+import numpy
+
+from semantic_codec.architecture.arm_constants import AReg
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+from semantic_codec.architecture.disassembler_readers import ElfioTextDisassembleReader
+from semantic_codec.corruption.corruptors import PacketCorruptor
+from semantic_codec.metadata.candidate_table import CandidateTable
+from semantic_codec.metadata.metadata_collector import MetadataCollector
+from semantic_codec.metadata.probabilistic_rules.rules import from_functions_to_list_and_addr, \
+    from_instruction_list_to_dict
+from semantic_codec.metadata.recuperator import ProbabilisticRecuperator
+
+
+class TestCandidateTable(TestCase):
+
+    ASM_LONG_PATH = os.path.join(os.path.dirname(__file__), 'data/helloworld_elfiodissasembly.disam')
+
+    @staticmethod
+    def corrupted_program(size=None):
+        """
+        Corrupts the hello world program, optionally keeping only its first addresses
+        """
+        functions = ElfioTextDisassembleReader(TestCandidateTable.ASM_LONG_PATH).read_functions()
+        instructions, fns = from_functions_to_list_and_addr(functions)
+        collector = MetadataCollector()
+        collector.collect(instructions)
+        program = [CAPSInstruction(x.encoding, x.address) for x in instructions]
+        program = PacketCorruptor(len(program) / 32, len(program), packets_lost=[3]).corrupt(
+            from_instruction_list_to_dict(program))
+        if size:
+            addresses = sorted(program.keys())[:size]
+            program = {a: program[a] for a in addresses}
+            fns = {k: v for k, v in fns.items() if k <= addresses[-1]}
+        return program, collector, fns
+
+    def test_columns(self):
+        program, collector, fns = self.corrupted_program()
+        table = CandidateTable.from_program(program)
+
+        self.assertEqual(len(program), table.address_count)
+        self.assertEqual(sum(len(v) for v in program.values()), len(table))
+        for addr, v in program.items():
+            rows = table.rows(addr)
+            self.assertEqual(len(v), len(rows))
+            for inst, row in zip(v, rows):
+                self.assertEqual(inst.encoding, table.encoding[row])
+                self.assertEqual(inst.ignore, table.ignore[row])
+                if not inst.ignore:
+                    self.assertEqual(inst.conditional_field, table.cond[row])
+                    self.assertEqual(inst.opcode_field, table.opcode[row])
+                    self.assertEqual(AReg.storage_mask(inst.storages_used()), table.registers[row])
+            self.assertEqual(len([x for x in v if not x.ignore]), table.live_counts()[table.address_index(addr)])
+
+        # A few dozen bytes per candidate
+        self.assertLess(table.nbytes() / len(table), 32)
+
+    def test_round_trip_and_select(self):
+        program, collector, fns = self.corrupted_program()
+        first = [x for v in program.values() for x in v if not x.ignore][0]
+        first.scores_by_rule['pc'] = 0.5
+        table = CandidateTable.from_program(program)
+
+        copy = table.to_program()
+        for addr, v in program.items():
+            self.assertEqual([x.encoding for x in v], [x.encoding for x in copy[addr]])
+            self.assertEqual([x.scores_by_rule for x in v], [x.scores_by_rule for x in copy[addr]])
+
+        selected = table.select(~table.ignore)
+        self.assertEqual(table.address_count, selected.address_count)
+        self.assertEqual(int(numpy.sum(~table.ignore)), len(selected))
+        self.assertTrue(numpy.array_equal(table.live_counts(), selected.counts()))
+        self.assertEqual(0.5, selected.scores['pc'][0])
+
+    def test_rules_run_on_views(self):
+        program, collector, fns = self.corrupted_program(48)
+        table = CandidateTable.from_program(program)
+
+        ProbabilisticRecuperator(collector, program, functions=fns).recover()
+        ProbabilisticRecuperator(collector, table.program(), functions=fns).recover()
+
+        for addr, v in program.items():
+            views = table.candidates(addr)
+            for inst, view in zip(v, views):
+                self.assertEqual(inst.scores_by_rule, dict(view.scores_by_rule))
+        self.assertIn('pc', table.scores)
@@ -0,0 +1,82 @@
+import threading
+from unittest import TestCase
+
+from capstone.arm_const import ARM_INS_STR, ARM_INS_BL
+
+from semantic_codec.architecture.arm_constants import AReg
+from semantic_codec.architecture.capstone_decoder import CapstoneDecoder
+
+
+class TestCapstoneDecoder(TestCase):
+
+    def test_decode(self):
+        d = CapstoneDecoder.decode(0xe52de004)  # str lr, [sp, #-4]!
+        self.assertEqual(ARM_INS_STR, d.id)
+        self.assertEqual('str\tlr, [sp, #-4]!', d.text(0xe52de004, 0x10550))
+
+    def test_decode_is_cached(self):
+        self.assertIs(CapstoneDecoder.decode(0xe92d4800), CapstoneDecoder.decode(0xe92d4800))
+
+    def test_undefined(self):
+        self.assertIsNone(CapstoneDecoder.decode(0xe6000010))
+        self.assertIsNone(CapstoneDecoder.decode(0xe6000010))
+
+    def test_branch_is_address_independent(self):
+        d = CapstoneDecoder.decode(0xebffffeb)  # bl #-0x4c
+        self.assertEqual(ARM_INS_BL, d.id)
+        self.assertTrue(d.pc_relative)
+        self.assertEqual(-76, d.operands[0].imm)
+        self.assertEqual('bl\t#0x10504', d.text(0xebffffeb, 0x10550))
+
+    def test_handle_per_thread(self):
+        handles = []
+        t = threading.Thread(target=lambda: handles.append(CapstoneDecoder.handle()))
+        t.start()
+        t.join()
+        self.assertIsNot(handles[0], CapstoneDecoder.handle())
+        self.assertIs(CapstoneDecoder.handle(), CapstoneDecoder.handle())
+
+    def test_decode_many(self):
+        CapstoneDecoder.clear_cache()
+        batch_words = CapstoneDecoder.BATCH_WORDS
+        CapstoneDecoder.BATCH_WORDS = 3
+        try:
+            # push, undefined, bl, undefined, undefined, str, push
+            encodings = [0xe92d4800, 0xe6000010, 0xebffffeb, 0xffffffff, 0xf0000000, 0xe52de004, 0xe92d4800]
+            decoded = CapstoneDecoder.decode_many(encodings)
+        finally:
+            CapstoneDecoder.BATCH_WORDS = batch_words
+        self.assertEqual(len(encodings), len(decoded))
+        self.assertEqual([False, True, False, True, True, False, False], [d is None for d in decoded])
+        self.assertIs(decoded[0], decoded[6])
+        # Words decoded in the middle of a buffer are still address independent
+        self.assertEqual(-76, decoded[2].operands[0].imm)
+        self.assertEqual('str', decoded[5].mnemonic)
+        self.assertEqual([CapstoneDecoder.decode(e) for e in encodings], decoded)
+
+    def test_defined_many(self):
+        CapstoneDecoder.clear_cache()
+        encodings = [0xe92d4800, 0xe6000010, 0xebffffeb, 0xffffffff]
+        self.assertEqual([True, False, True, False], CapstoneDecoder.defined_many(encodings))
+        # Only the defined words are cached
+        self.assertEqual(2, CapstoneDecoder.cache_size())
+        self.assertEqual([True, False, True, False], CapstoneDecoder.defined_many(encodings))
+
+    def test_features(self):
+        f = CapstoneDecoder.features(0xe92d4010)  # push {r4, lr}
+        self.assertIs(f, CapstoneDecoder.features(0xe92d4010))
+        self.assertTrue(f.is_push)
+        self.assertFalse(f.is_branch)
+        self.assertEqual((AReg.SP, AReg.R4, AReg.LR), f.registers_used)
+        self.assertEqual((), f.registers_written)
+        self.assertEqual((AReg.R4, AReg.LR, AReg.SP), f.registers_read)
+        self.assertEqual(AReg.storage_mask(f.storages_read), f.read_mask)
+        self.assertIsNone(CapstoneDecoder.features(0xe6000010))
+
+    def test_features_jump(self):
+        f = CapstoneDecoder.features(0xebffffeb)  # bl #-0x4c
+        self.assertTrue(f.is_branch)
+        self.assertIn(AReg.PC, f.storages_written)
+        self.assertTrue(f.written_mask >> AReg.PC & 1)
+        self.assertEqual(0x10504, f.jumping_address(0x10550))
+        self.assertIsNone(CapstoneDecoder.features(0xe52de004).jumping_address(0x10550))
@@ -1,3 +1,4 @@
+import random
 from unittest import TestCase
 
 from semantic_codec.architecture.disassembler_readers import TextDisassembleReader, ElfioTextDisassembleReader
@@ -5,7 +6,7 @@ from semantic_codec.corruption.corruptors import RandomCorruptor, CAPSInstructio
 from semantic_codec.metadata.metadata_collector import MetadataCollector
 from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict
 from semantic_codec.solution.solution_builders import ForwardConstraintSolutionBuilder, \
-    ForwardConstraintSolutionEnumerator
+    ForwardConstraintSolutionEnumerator, AddressQueue
 from semantic_codec.solution.solution_quality import SolutionQuality
 from tests.test_disassembler_readers import TestTextDisassembleReader
 
@@ -48,3 +49,21 @@ class TestForwardConstraintSolutionBuilder(TestCase):
         b.build()
         print('After Constrainst Size {} - Original Size {}'.format(b.solution_size, a.solution_size))
         self.assertGreaterEqual(a.solution_size, b.solution_size)
+
+    def test_address_queue(self):
+        # Pops the addresses in the order of sorting them with a stable sort after every change
+        rnd = random.Random(7)
+        for reverse in (False, True):
+            program = {a: list(range(0, rnd.randint(0, 6))) for a in rnd.sample(range(0, 1000), 60)}
+            expected_program = {k: list(v) for k, v in program.items()}
+            queue = AddressQueue(program, program.keys(), reverse)
+            addresses = sorted(expected_program.keys(), key=lambda x: len(expected_program[x]), reverse=reverse)
+            while addresses:
+                self.assertEqual(addresses.pop(0), queue.pop())
+                changed = [a for a in addresses if rnd.random() < 0.2 and len(program[a]) > 0]
+                for a in changed:
+                    del program[a][0]
+                    del expected_program[a][0]
+                queue.update(changed)
+                addresses.sort(key=lambda x: len(expected_program[x]), reverse=reverse)
+            self.assertEqual(0, len(queue))
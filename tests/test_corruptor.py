@@ -5,7 +5,7 @@ from semantic_codec.architecture.arm_instruction import AOpType
 from semantic_codec.architecture.bits import Bits
 from semantic_codec.architecture.disassembler_readers import TextDisassembleReader
 from semantic_codec.corruption.corruption import corrupt_instruction, corrupt_bits, corrupt_conditional, corrupt_program, \
-    corrupt_all_bits, corrupt_all_bits_tuples, predict_corruption
+    corrupt_all_bits, corrupt_all_bits_tuples, predict_corruption, predict_erasures
 from semantic_codec.corruption.corruptors import PacketCorruptor, CAPSInstruction, Instruction
 from semantic_codec.interleaver.interleaver2d import build_2d_interleave_sp
 from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict
@@ -94,6 +94,31 @@ class TestCorruptor(TestCase):
         for e in expected_errors:
             self.assertTrue(e in errors)
 
+    def test_predict_errors_sorted(self):
+        errors = predict_corruption(16, 2, 64, build_2d_interleave_sp(16, flat=True), [5, 2, 3, 4, 3])
+        self.assertEqual(len(set(errors)), len(errors))
+        self.assertEqual(sorted(errors, key=lambda x: (x[0], x[1])), errors)
+        # Packet 5 is a multi word error
+        self.assertTrue((6, 30, 1) in errors)
+        self.assertTrue((7, 0, 1) in errors)
+        self.assertEqual(3 * 64, len([e for e in errors if len(e) == 2]))
+        self.assertEqual(2 * 64, len([e for e in errors if len(e) == 3]))
+
+    def test_predict_errors_no_data(self):
+        self.assertEqual([], predict_corruption(16, 2, 0, build_2d_interleave_sp(16, flat=True), [5]))
+
+    def test_predict_erasures(self):
+        erasures = predict_erasures(16, 2, 16, build_2d_interleave_sp(16, flat=True), [2, 3, 4])
+        self.assertEqual(16, len(erasures))
+        for w in range(0, 16):
+            self.assertEqual(0b11 << 4 | 0b11 << 10 | 0b11 << 16, erasures[w])
+
+    def test_predict_erasures_end_of_word(self):
+        # Packet 5 carries the two last bits of every word
+        erasures = predict_erasures(16, 2, 64, build_2d_interleave_sp(16, flat=True), [5])
+        self.assertEqual([0xC0000000] * 64, erasures.tolist())
+        self.assertEqual(0, len(predict_erasures(16, 2, 0, build_2d_interleave_sp(16, flat=True), [5])))
+
     def test_packet_corrupt(self):
         """
         Test the Packet Corruptor
@@ -106,6 +131,7 @@ class TestCorruptor(TestCase):
 
         # We use a known configuration from previous test that allows to know where errors will occur
         p = PacketCorruptor(16, len(program), build_2d_interleave_sp(16, flat=True), [2, 3, 4])
+        original = program[0x1000][0].encoding
 
         # Corrupt the program
         program = p.corrupt(program)
@@ -115,5 +141,7 @@ class TestCorruptor(TestCase):
         # there will be 8 potential candidates
         self.assertEqual(64, len(program[0x1000]))
         self.assertEqual(64, len(program[0x1004]))
+        self.assertEqual([0b11 << 4 | 0b11 << 10 | 0b11 << 16] * 4, p.erasures.tolist())
+        self.assertIn(original, [inst.encoding for inst in program[0x1000]])
 
         # TODO: check that the instructions were in fact properly corrupted
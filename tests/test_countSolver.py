@@ -0,0 +1,111 @@
+import os
+import random
+from unittest import TestCase
+
+from semantic_codec.architecture.disassembler_readers import TextDisassembleReader, ElfioTextDisassembleReader
+from semantic_codec.corruption.corruptors import RandomCorruptor
+from semantic_codec.metadata.metadata_collector import MetadataCollector
+from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict, \
+    from_functions_to_list_and_addr
+from semantic_codec.solution.count_solver import CountSolver
+from semantic_codec.solution.solution_builders import ProblemBuilder
+from tests import test_problemBuilder
+from tests import test_disassembler_readers
+
+
+class TestCountSolver(TestCase):
+
+    BASICMATH_PATH = os.path.join(os.path.dirname(__file__), 'data/basicmath_small.disam')
+
+    @staticmethod
+    def names(solutions):
+        return sorted(sorted((k, v.name) for k, v in s.items()) for s in solutions)
+
+    def test_solutions_match_constraint(self):
+        # Same solutions than python-constraint with ExactFieldSumConstraint, on random problems
+        rnd = random.Random(3)
+        for case in range(0, 30):
+            domains = {}
+            for a in range(0, rnd.randint(1, 5)):
+                domains[a] = [test_problemBuilder.FieldValue('{}_{}'.format(a, i),
+                                                             [rnd.randint(1, 4) for f in range(0, rnd.randint(0, 3))],
+                                                             rnd.random() < 0.1)
+                              for i in range(0, rnd.randint(0, 4))]
+            if not any(domains.values()):
+                continue
+            fields = [f for v in domains.values() for x in v if not x.ignore for f in x.fields]
+            exactsum = {k: fields.count(k) // 2 for k in range(1, 4)}
+
+            solver = CountSolver(domains, [(exactsum, lambda x: x.fields)], lambda x: 0)
+            expected = test_problemBuilder.TestProblemBuilder.solve({k: v for k, v in domains.items() if v}, exactsum)
+            self.assertEqual(expected, self.names(solver.getSolutionIter()))
+
+    def test_best_scored_first(self):
+        values = [test_problemBuilder.FieldValue(i, [i]) for i in range(1, 4)]
+        scores = {1: 0.1, 2: 0.9, 3: 0.5}
+        solver = CountSolver({'a': values, 'b': values}, [({1: 1, 2: 1}, lambda x: x.fields)],
+                             lambda x: scores[x.name])
+        self.assertEqual([[('a', 2), ('b', 1)], [('a', 1), ('b', 2)]],
+                         [sorted((k, v.name) for k, v in s.items()) for s in solver.getSolutionIter()])
+        self.assertEqual(2, solver.getSolution()['a'].name)
+
+    def test_no_solutions(self):
+        values = [test_problemBuilder.FieldValue(i, [i]) for i in range(1, 3)]
+        solver = CountSolver({'a': values, 'b': [values[0]]}, [({1: 2, 2: 1}, lambda x: x.fields)], lambda x: 0)
+        self.assertIsNone(solver.getSolution())
+        self.assertEqual([], solver.getSolutions())
+
+    def test_program(self):
+        # Same solutions than python-constraint on a corrupted program, the original program among them
+        asm_path = test_disassembler_readers.TestTextDisassembleReader.ASM_PATH
+        instructions = TextDisassembleReader(asm_path).read_instructions()
+        collector = MetadataCollector()
+        collector.collect(instructions)
+        original = {i.address: i.encoding for i in instructions}
+
+        corruptor = RandomCorruptor(10.0, 2, True)
+        corruptor.save_corrupted_program = False
+        program = corruptor.corrupt(from_instruction_list_to_dict(instructions))
+
+        expected = ProblemBuilder().build(program, collector).getSolutions()
+        solutions = list(ProblemBuilder().build_solver(program, collector).getSolutionIter())
+        as_encodings = lambda s: sorted((k, v.encoding) for k, v in s.items())
+        self.assertEqual(sorted(as_encodings(s) for s in expected), sorted(as_encodings(s) for s in solutions))
+        self.assertIn(sorted(original.items()), [as_encodings(s) for s in solutions])
+
+    @staticmethod
+    def heavy_loss():
+        """
+        Basic math with a fifth of its words corrupted, up to 3 bits each
+        """
+        instructions, fns = from_functions_to_list_and_addr(
+            ElfioTextDisassembleReader(TestCountSolver.BASICMATH_PATH).read_functions())
+        collector = MetadataCollector()
+        collector.collect(instructions)
+        random.seed(0)
+        corruptor = RandomCorruptor(20.0, 3, False)
+        return corruptor.corrupt(from_instruction_list_to_dict(instructions)), collector
+
+    def test_heavy_loss(self):
+        program, collector = self.heavy_loss()
+        self.assertGreater(len([v for v in program.values() if len(v) > 1]), 100)
+
+        # Starting from the most likely program, the search barely backtracks
+        solver = ProblemBuilder().build_solver(program, collector, max_nodes=1000)
+        solution = solver.getSolution()
+        self.assertFalse(solver.exhausted)
+        self.assertIsNotNone(solution)
+        self.assertEqual(set(program.keys()), set(solution.keys()))
+        taken = MetadataCollector()
+        taken.collect(list(solution.values()))
+        self.assertEqual(collector.condition_count, taken.condition_count)
+        self.assertEqual(collector.instruction_count, taken.instruction_count)
+        self.assertEqual(collector.storage_count, taken.storage_count)
+
+    def test_budget(self):
+        program, collector = self.heavy_loss()
+        # Without the hint this search backtracks far more than the budget
+        solver = CountSolver.from_metadata(program, collector, max_nodes=150)
+        self.assertIsNone(solver.getSolution())
+        self.assertTrue(solver.exhausted)
+        self.assertEqual(150, solver.nodes)
@@ -17,3 +17,31 @@ class TestElfioTextDisassembleReader(TestCase):
         self.assertGreater(len(fns), 10)
         self.assertEqual(len(instructions), 143)
 
+
+    def test_parse_once(self):
+        reader = ElfioTextDisassembleReader("data/helloworld_elfiodissasembly.disam")
+        parsed = reader.parse()
+        fns = reader.read_functions()
+        instructions = reader.read_instructions()
+        self.assertIs(parsed, reader.parse())
+        functions, addresses, encodings, owners = parsed
+        self.assertEqual(len(fns), len(functions))
+        self.assertEqual([i.address for i in instructions], addresses.tolist())
+        self.assertEqual([i.encoding for i in instructions], encodings.tolist())
+        self.assertEqual(sum(len(f.instructions) for f in fns), len([o for o in owners if o >= 0]))
+
+    def test_stream(self):
+        reader = ElfioTextDisassembleReader("data/helloworld_elfiodissasembly.disam")
+        owner = {inst.address: f.name for f in reader.read_functions() for inst in f.instructions}
+        streamed = list(reader.stream())
+        self.assertEqual(143, len(streamed))
+        self.assertEqual(0xe92d4008, streamed[0][1])
+        for address, encoding, fn in streamed:
+            self.assertEqual(owner.get(address), fn)
+
+    def test_read_program(self):
+        program = ElfioTextDisassembleReader("data/helloworld_elfiodissasembly.disam").read_program()
+        self.assertEqual(143, len(program))
+        for address, instructions in program.items():
+            self.assertEqual(1, len(instructions))
+            self.assertEqual(address, instructions[0].address)
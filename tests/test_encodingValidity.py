@@ -0,0 +1,70 @@
+import os
+import random
+import shutil
+import tempfile
+from unittest import TestCase
+
+from semantic_codec.architecture.capstone_decoder import CapstoneDecoder
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+from semantic_codec.architecture.encoding_validity import EncodingValidity
+
+
+class TestEncodingValidity(TestCase):
+
+    def test_key(self):
+        # Bits [31:20] followed by bits [7:4]
+        self.assertEqual(0xe601, EncodingValidity.key(0xe6000010))
+        self.assertEqual(0xe921, EncodingValidity.key(0xe92d4810))
+
+    def test_may_be_defined(self):
+        self.assertTrue(EncodingValidity.may_be_defined(0xe92d4800))  # push {fp, lr}
+        self.assertTrue(EncodingValidity.may_be_defined(0xebffffeb))  # bl #-0x4c
+        self.assertFalse(EncodingValidity.may_be_defined(0xe6000010))
+        self.assertEqual([True, False], list(EncodingValidity.may_be_defined_many([0xe92d4800, 0xe6000010])))
+
+    def test_table_matches_probes(self):
+        table = EncodingValidity.table()
+        self.assertEqual(1 << 16, len(table))
+        for key in random.sample(range(0, 1 << 16), 64):
+            self.assertEqual(EncodingValidity.probe(key) or EncodingValidity.sweep(key), table[key], hex(key))
+
+    def test_words_out_of_the_probes_are_kept(self):
+        # Words decoding only with register field values that are not probed
+        words = [0xf86d0515,  # srsda sp!, #0x15
+                 0xf81b0a00,  # rfeda fp
+                 0xf99f0a00]  # rfeib pc
+        for e in words:
+            self.assertIsNotNone(CapstoneDecoder.decode(e), hex(e))
+            self.assertTrue(EncodingValidity.may_be_defined(e), hex(e))
+            self.assertIn(e, EncodingValidity.words(EncodingValidity.key(e)).tolist())
+        self.assertEqual([True] * len(words), CapstoneDecoder.defined_many(words))
+        self.assertEqual(words, [x.encoding for x in CAPSInstruction.encodings_to_inst(words)])
+        for key in (0xf810, 0xf840, 0xf860, 0xf861, 0xf890, 0xf8c0, 0xf8e0, 0xf8e1, 0xf941, 0xf990, 0xf9c0, 0xf9e0):
+            self.assertTrue(EncodingValidity.table()[key], hex(key))
+
+    def test_defined_words_are_never_discarded(self):
+        encodings = [random.getrandbits(32) for _ in range(0, 20000)]
+        discarded = [e for e, v in zip(encodings, EncodingValidity.may_be_defined_many(encodings)) if not v]
+        self.assertTrue(len(discarded) > 0)
+        self.assertFalse(any(CapstoneDecoder.defined_many(discarded)))
+        for e in discarded:
+            self.assertIsNone(CapstoneDecoder.decode(e), hex(e))
+
+    def test_missing_table(self):
+        directory = tempfile.mkdtemp()
+        path, table = EncodingValidity.TABLE_PATH, EncodingValidity.table()
+        try:
+            # Without the file nothing is discarded, and nothing is built
+            EncodingValidity.TABLE_PATH = os.path.join(directory, 'arm_validity.bin')
+            EncodingValidity._table = None
+            self.assertTrue(EncodingValidity.table().all())
+            self.assertTrue(EncodingValidity.may_be_defined(0xe6000010))
+            self.assertFalse(os.path.exists(EncodingValidity.TABLE_PATH))
+
+            EncodingValidity.save(table)
+            EncodingValidity._table = None
+            self.assertTrue((table == EncodingValidity.table()).all())
+        finally:
+            EncodingValidity.TABLE_PATH = path
+            EncodingValidity._table = None
+            shutil.rmtree(directory)
@@ -0,0 +1,85 @@
+import asyncio
+from unittest import TestCase
+
+import numpy
+
+from semantic_codec.receiver.gateway import Gateway, request_recovery
+from semantic_codec.receiver.packet_stream import PacketStreamWriter, StreamHeader
+from tests import test_receiver
+
+
+class TestGateway(TestCase):
+
+    @staticmethod
+    async def recover(gateway, lost_sets):
+        header, words, collector, fns = test_receiver.TestReceiver.program()
+        payloads = PacketStreamWriter.payloads(header, words)
+        server = await gateway.start()
+        port = server.sockets[0].getsockname()[1]
+
+        async def session(lost):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            packets = [(i, p) for i, p in enumerate(payloads) if i not in lost]
+            return await request_recovery(reader, writer, header, packets)
+
+        try:
+            return words, await asyncio.gather(*[session(lost) for lost in lost_sets])
+        finally:
+            server.close()
+            await server.wait_closed()
+            gateway.close()
+
+    @staticmethod
+    def metadata(header):
+        _, _, collector, fns = test_receiver.TestReceiver.program()
+        return collector, fns
+
+    def test_concurrent_sessions(self):
+        gateway = Gateway(TestGateway.metadata, workers=2, progress_every=20)
+        words, results = asyncio.run(TestGateway.recover(gateway, [[], [3], [5, 40]]))
+        for events, lost in zip(results, [[], [3], [5, 40]]):
+            self.assertEqual('done', events[-1]['event'])
+            self.assertEqual('recovering', events[-2]['event'])
+            received = [e['packets'] for e in events if e['event'] == 'received']
+            self.assertEqual(list(range(20, 80 - len(lost) + 1, 20)), received)
+            image = numpy.frombuffer(bytes.fromhex(events[-1]['image']), dtype='<u4')
+            self.assertEqual(len(words), len(image))
+            if not lost:
+                self.assertTrue(numpy.array_equal(words, image))
+                self.assertEqual({}, events[-1]['ambiguity'])
+            else:
+                self.assertGreater((words == image).mean(), 0.7)
+
+    def test_session_memory_limit(self):
+        gateway = Gateway(TestGateway.metadata, workers=1, max_session_bytes=1024)
+        words, results = asyncio.run(TestGateway.recover(gateway, [[]]))
+        self.assertEqual('error', results[0][-1]['event'])
+        self.assertIn('limit', results[0][-1]['message'])
+
+    def test_recovery_error(self):
+        # Without a collector the recovery of the words lost raises in the worker
+        gateway = Gateway(lambda header: (None, None), workers=1)
+        words, results = asyncio.run(TestGateway.recover(gateway, [[3]]))
+        self.assertEqual('error', results[0][-1]['event'])
+        self.assertIn('The recovery failed', results[0][-1]['message'])
+
+    def test_invalid_headers(self):
+        async def send(headers):
+            gateway = Gateway(TestGateway.metadata, workers=1)
+            server = await gateway.start()
+            port = server.sockets[0].getsockname()[1]
+
+            async def session(header):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                return await request_recovery(reader, writer, header, [])
+
+            try:
+                return await asyncio.gather(*[session(header) for header in headers])
+            finally:
+                server.close()
+                await server.wait_closed()
+                gateway.close()
+
+        headers = [StreamHeader(100, 80, 0), StreamHeader(100, 80, 3), StreamHeader(100, 0, 2)]
+        for events in asyncio.run(send(headers)):
+            self.assertEqual([{'event': 'error', 'message': 'Invalid stream header'}], events)
@@ -0,0 +1,70 @@
+import os
+from unittest import TestCase
+
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+from semantic_codec.architecture.disassembler_readers import ElfioTextDisassembleReader
+from semantic_codec.corruption.corruptors import PacketCorruptor
+from semantic_codec.metadata.candidate_table import CandidateTable
+from semantic_codec.metadata.metadata_collector import MetadataCollector, CorruptedProgramMetadataCollector
+from semantic_codec.metadata.probabilistic_rules.rules import from_functions_to_list_and_addr, \
+    from_instruction_list_to_dict
+from semantic_codec.metadata.recuperator import ProbabilisticRecuperator, remove_bad_candidates_at_addr
+
+
+class TestIncrementalRescoring(TestCase):
+
+    ASM_PATH = os.path.join(os.path.dirname(__file__), 'data/basicmath_small.disam')
+
+    @staticmethod
+    def corrupted_program():
+        """
+        Corrupts basic math losing one packet out of 80, so only some of the addresses are corrupted
+        """
+        instructions, fns = from_functions_to_list_and_addr(
+            ElfioTextDisassembleReader(TestIncrementalRescoring.ASM_PATH).read_functions())
+        collector = MetadataCollector()
+        collector.collect(instructions)
+        program = [CAPSInstruction(x.encoding, x.address) for x in instructions]
+        program = PacketCorruptor(80, len(program), packets_lost=[3]).corrupt(from_instruction_list_to_dict(program))
+        return program, collector, fns
+
+    def test_same_scores_than_full_rescoring(self):
+        program, collector, fns = self.corrupted_program()
+        table = CandidateTable.from_program(program)
+        full, incremental = table.to_program(), table.to_program()
+
+        ProbabilisticRecuperator(collector, full, functions=fns).recover()
+        r = ProbabilisticRecuperator(collector, incremental, functions=fns)
+        r.recover()
+        passes = 0
+        while True:
+            changed = []
+            for addr in full:
+                self.assertEqual([x.scores_by_rule for x in full[addr]],
+                                 [x.scores_by_rule for x in incremental[addr]])
+                removed = remove_bad_candidates_at_addr(full[addr])
+                self.assertEqual(removed, remove_bad_candidates_at_addr(incremental[addr]))
+                if removed > 0:
+                    changed.append(addr)
+            if not changed:
+                break
+            passes += 1
+            ProbabilisticRecuperator(collector, full, functions=fns).recover()
+            rescored = r.rescore(changed)
+            self.assertLess(len(rescored), len(incremental))
+        self.assertGreater(passes, 0)
+
+    def test_update_metadata(self):
+        program, collector, fns = self.corrupted_program()
+        cpmd = CorruptedProgramMetadataCollector()
+        cpmd.collect(program)
+        changed = [addr for addr, v in program.items() if len(v) > 1]
+        for addr in changed:
+            del program[addr][1:]
+        cpmd.update(program, changed)
+
+        expected = CorruptedProgramMetadataCollector()
+        expected.collect(program)
+        self.assertEqual(expected.address_with_cond, cpmd.address_with_cond)
+        self.assertEqual(expected.address_with_op, cpmd.address_with_op)
+        self.assertEqual(expected.address_with_reg, cpmd.address_with_reg)
@@ -43,6 +43,19 @@ class TestInterleave2D(TestCase):
             self.assertGreater(241, i)  # There is no
             self.assertTrue(i in r, '{} not in r'.format(i))
 
+    def test_build_interleave_map_2d_cached(self):
+        """
+        The interleave is cached by packet count, changing a returned interleave must not change the next ones
+        """
+        r = build_2d_interleave_sp(241, flat=True)
+        r[0] = 1000
+        m = build_2d_interleave_sp(241)
+        m[0][0] = 1000
+        self.assertEqual(0.0, build_2d_interleave_sp(241, flat=True)[0])
+        self.assertEqual(0.0, build_2d_interleave_sp(241)[0][0])
+        self.assertEqual([x for row in build_2d_interleave_sp(241) for x in row],
+                         build_2d_interleave_sp(241, flat=True))
+
     def test_interleave(self):
         """
         Test the interleaving
@@ -121,3 +134,14 @@ class TestInterleave2D(TestCase):
         self.do_interleave_deinterleave([3, 4, 8, 3, 5, 1, 1, 4, 9, 0, 4, 6, 2, 0, 1, 4],
                                         16, [2, 3, 4], self.expected_errors)
 
+    def test_deinterleave_erasure_masks(self):
+        data = [3, 4, 8, 3, 5, 1, 1, 4, 9, 0, 4, 6, 2, 0, 1, 4]
+        m = build_2d_interleave_sp(16, flat=True)
+        d = interleave(data, m, 2)
+        for r in [2, 3, 4]:
+            d[r] = None
+        deintdata, erasures = deinterleave(d, m, 2, erasure_masks=True)
+        self.assertEqual(len(deintdata), len(erasures))
+        for k in range(0, len(data)):
+            self.assertEqual(0b11 << 4 | 0b11 << 10 | 0b11 << 16, erasures[k])
+            self.assertEqual(data[k] & ~int(erasures[k]), deintdata[k])
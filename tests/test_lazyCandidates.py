@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+from semantic_codec.architecture.instruction import Instruction
+from semantic_codec.corruption.corruptors import PacketCorruptor
+from semantic_codec.corruption.lazy_candidates import ErasedWord, LazyCorruptedProgram
+from semantic_codec.interleaver.interleaver2d import build_2d_interleave_sp
+
+
+class TestLazyCandidates(TestCase):
+
+    @staticmethod
+    def program():
+        return {0x1000: [CAPSInstruction("06 00 54 e1", Instruction.HEX_STR)],
+                0x1004: [CAPSInstruction("f7 ff ff 1a", Instruction.HEX_STR)],
+                0x1008: [CAPSInstruction("0c 00 9f e5", Instruction.HEX_STR)],
+                0x1028: [CAPSInstruction("46 61 b0 e1", Instruction.HEX_STR)]}
+
+    def test_erased_word(self):
+        w = ErasedWord(0xe15400ff, ErasedWord.mask_of([(0, 3), (8, 11)]))
+        self.assertEqual(0xe15400f8, w.known)
+        self.assertEqual(6, w.erased_bits)
+        self.assertEqual(64, len(w))
+        encodings = [e for batch in w.encodings() for e in batch.tolist()]
+        self.assertEqual(64, len(set(encodings)))
+        self.assertEqual(sorted(encodings), encodings)
+        self.assertIn(0xe15400ff, encodings)
+        for e in encodings:
+            self.assertEqual(w.known, e & ~w.mask)
+
+    def test_erased_word_batches(self):
+        batch_words = ErasedWord.BATCH_WORDS
+        ErasedWord.BATCH_WORDS = 5
+        try:
+            w = ErasedWord(0xe1540006, ErasedWord.mask_of([(0, 4)]))
+            self.assertEqual(list(range(0xe1540000, 0xe1540010)), [e for b in w.encodings() for e in b.tolist()])
+        finally:
+            ErasedWord.BATCH_WORDS = batch_words
+
+    def test_same_candidates_than_eager(self):
+        interleave = build_2d_interleave_sp(16, flat=True)
+        eager = PacketCorruptor(16, 4, interleave, [2, 3, 4]).corrupt(self.program())
+        lazy = PacketCorruptor(16, 4, interleave, [2, 3, 4], lazy=True).corrupt(self.program())
+        self.assertIsInstance(lazy, LazyCorruptedProgram)
+        self.assertEqual(1, len(lazy.erased_words(0x1000)))
+        self.assertEqual(64, len(lazy.erased_words(0x1000)[0]))
+        for address in eager:
+            expected = [inst.encoding for inst in eager[address] if not inst.ignore]
+            self.assertEqual(expected, [inst.encoding for inst in lazy[address]])
+        # Once read, candidates are cached
+        self.assertEqual([], lazy.erased_words(0x1000))
+        self.assertIs(lazy[0x1000], lazy[0x1000])
+
+    def test_erase_twice(self):
+        program = LazyCorruptedProgram(self.program())
+        program.erase(0x1008, ErasedWord.mask_of([(0, 2)]))
+        program.erase(0x1008, ErasedWord.mask_of([(4, 6)]))
+        self.assertEqual(16, len(program.erased_words(0x1008)[0]))
+        self.assertEqual(len(set(i.encoding for i in program[0x1008])), len(program[0x1008]))
+
+    def test_mapping(self):
+        program = LazyCorruptedProgram(self.program())
+        program.erase(0x1000, ErasedWord.mask_of([(0, 2)]))
+        self.assertEqual([0x1000, 0x1004, 0x1008, 0x1028], sorted(program.keys()))
+        del program[0x1000]
+        self.assertNotIn(0x1000, program)
+        self.assertEqual([], program.erased_words(0x1000))
+        program[0x1004] = []
+        self.assertEqual([], program[0x1004])
+        self.assertEqual(3, len(program))
@@ -0,0 +1,87 @@
+import itertools
+import random
+from math import log
+from unittest import TestCase
+
+from semantic_codec.architecture.disassembler_readers import TextDisassembleReader
+from semantic_codec.corruption.corruptors import RandomCorruptor
+from semantic_codec.metadata.candidate_table import CandidateTable
+from semantic_codec.metadata.metadata_collector import MetadataCollector
+from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict
+from semantic_codec.solution.count_solver import CountTable
+from semantic_codec.solution.map_selection import MapSelector
+from tests import test_candidateTable, test_disassembler_readers, test_problemBuilder
+
+
+class TestMapSelector(TestCase):
+
+    @staticmethod
+    def cost(values, scores):
+        return sum(-log(scores[v.name]) for v in values)
+
+    def test_most_likely(self):
+        # Same cost than the best choice found by brute force, on random problems
+        rnd = random.Random(5)
+        for case in range(0, 30):
+            domains = {a: [test_problemBuilder.FieldValue('{}_{}'.format(a, i),
+                                                          [rnd.randint(1, 4) for f in range(0, rnd.randint(0, 3))])
+                           for i in range(0, rnd.randint(1, 4))] for a in range(0, rnd.randint(1, 5))}
+            scores = {v.name: rnd.uniform(0.05, 1) for d in domains.values() for v in d}
+            truth = [rnd.choice(d) for d in domains.values()]
+            fields = [f for v in truth for f in v.fields]
+            exactsum = {k: fields.count(k) for k in set(fields)}
+
+            best = None
+            for values in itertools.product(*domains.values()):
+                used = [f for v in values for f in v.fields]
+                if all(used.count(k) == n for k, n in exactsum.items()) and set(used) <= set(exactsum):
+                    cost = self.cost(values, scores)
+                    best = cost if best is None else min(best, cost)
+
+            solution, slack = MapSelector(domains, [(exactsum, lambda x: x.fields)], lambda x: scores[x.name]).select()
+            self.assertEqual([{}], slack)
+            self.assertEqual(set(domains.keys()), set(solution.keys()))
+            self.assertAlmostEqual(best, self.cost(solution.values(), scores))
+
+    def test_slack(self):
+        values = [test_problemBuilder.FieldValue(i, [i]) for i in range(1, 3)]
+        scores = {1: 0.9, 2: 0.2}
+        sums = [({1: 1, 2: 2}, lambda x: x.fields)]
+        domains = {'a': values, 'b': values}
+        # Only two fields can be used, one of them falls short
+        solution, slack = MapSelector(domains, sums, lambda x: scores[x.name]).select()
+        self.assertEqual([{2: -1}], slack)
+        self.assertEqual({1, 2}, {v.name for v in solution.values()})
+        self.assertEqual((None, []), MapSelector(domains, sums, lambda x: scores[x.name], slack_cost=0).select())
+
+    def test_program(self):
+        asm_path = test_disassembler_readers.TestTextDisassembleReader.ASM_PATH
+        instructions = TextDisassembleReader(asm_path).read_instructions()
+        collector = MetadataCollector()
+        collector.collect(instructions)
+
+        corruptor = RandomCorruptor(10.0, 2, True)
+        corruptor.save_corrupted_program = False
+        program = corruptor.corrupt(from_instruction_list_to_dict(instructions))
+
+        solution, slack = MapSelector.from_metadata(program, collector, lambda x: 0.5).select()
+        # The original program meets the counts, so the solution does too
+        self.assertEqual([{}, {}, {}], slack)
+        for address, candidates in program.items():
+            self.assertIn(solution[address], candidates)
+
+    def test_candidate_table(self):
+        # The fields read from the columns of a CandidateTable give the same selection
+        program, collector, fns = test_candidateTable.TestCandidateTable.corrupted_program()
+        table = CandidateTable.from_program(program)
+        expected = CountTable.from_program(program, collector)
+        counts = CountTable.from_program(table, collector)
+        self.assertEqual(expected.addresses, counts.addresses)
+        self.assertEqual([x.encoding for x in expected.candidates], [x.encoding for x in counts.candidates])
+        self.assertEqual(sorted(zip(expected.rows.tolist(), [expected.fields[c] for c in expected.cols])),
+                         sorted(zip(counts.rows.tolist(), [counts.fields[c] for c in counts.cols])))
+
+        solution, slack = MapSelector.from_metadata(program, collector, lambda x: 0.5).select()
+        from_table, table_slack = MapSelector.from_metadata(table, collector, lambda x: 0.5).select()
+        self.assertEqual(slack, table_slack)
+        self.assertEqual({a: x.encoding for a, x in solution.items()}, {a: x.encoding for a, x in from_table.items()})
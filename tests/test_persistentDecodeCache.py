@@ -0,0 +1,71 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+from semantic_codec.architecture.capstone_decoder import CapstoneDecoder, DecodedFeatures
+from semantic_codec.architecture.persistent_decode_cache import PersistentDecodeCache
+
+
+class TestPersistentDecodeCache(TestCase):
+
+    # push, undefined, bl, ldr, str, pop
+    ENCODINGS = [0xe92d4800, 0xe6000010, 0xebffffeb, 0xe59f502c, 0xe52de004, 0xe8bd8800]
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        CapstoneDecoder.use_persistent_cache(None)
+        CapstoneDecoder.clear_cache()
+        shutil.rmtree(self.path)
+
+    def assertSameFeatures(self, expected, features):
+        self.assertEqual(expected is None, features is None)
+        if expected is not None:
+            for k in DecodedFeatures.__slots__:
+                self.assertEqual(getattr(expected, k), getattr(features, k), k)
+
+    def test_save_and_lookup(self):
+        cache = PersistentDecodeCache(self.path)
+        self.assertIs(PersistentDecodeCache.MISSING, cache.lookup(0xe92d4800))
+        for e in self.ENCODINGS:
+            cache.add(e, CapstoneDecoder.features(e))
+        # Added encodings are found before saving
+        self.assertSameFeatures(CapstoneDecoder.features(0xe92d4800), cache.lookup(0xe92d4800))
+        cache.save()
+
+        cache = PersistentDecodeCache(self.path)
+        self.assertEqual(len(self.ENCODINGS), len(cache))
+        found = cache.lookup_many(self.ENCODINGS + [0xe1a00000])
+        for e, features in zip(self.ENCODINGS, found):
+            self.assertSameFeatures(CapstoneDecoder.features(e), features)
+        self.assertIs(PersistentDecodeCache.MISSING, found[-1])
+
+    def test_merge(self):
+        first, second = PersistentDecodeCache(self.path), PersistentDecodeCache(self.path)
+        first.add(0xe92d4800, CapstoneDecoder.features(0xe92d4800))
+        first.save()
+        second.add(0xebffffeb, CapstoneDecoder.features(0xebffffeb))
+        second.add(0xe6000010, None)
+        second.save()
+        cache = PersistentDecodeCache(self.path)
+        self.assertEqual(3, len(cache))
+        self.assertEqual('push', cache.lookup(0xe92d4800).mnemonic)
+        self.assertEqual(-76, cache.lookup(0xebffffeb).jump)
+        self.assertIsNone(cache.lookup(0xe6000010))
+
+    def test_decoder_uses_cache(self):
+        CapstoneDecoder.clear_cache()
+        cache = PersistentDecodeCache(self.path)
+        CapstoneDecoder.use_persistent_cache(cache)
+        expected = CapstoneDecoder.features_many(self.ENCODINGS)
+        cache.save()
+
+        CapstoneDecoder.clear_cache()
+        CapstoneDecoder.use_persistent_cache(PersistentDecodeCache(self.path))
+        features = CapstoneDecoder.features_many(self.ENCODINGS)
+        # Nothing was decoded by Capstone
+        self.assertEqual(0, CapstoneDecoder.cache_size())
+        for e, f in zip(expected, features):
+            self.assertSameFeatures(e, f)
+        self.assertSameFeatures(expected[2], CapstoneDecoder.features(0xebffffeb))
@@ -1,15 +1,53 @@
+import itertools
 from unittest import TestCase
 
 from semantic_codec.architecture.disassembler_readers import TextDisassembleReader
 from semantic_codec.corruption.corruptors import RandomCorruptor
 from semantic_codec.metadata.metadata_collector import MetadataCollector
 from semantic_codec.metadata.probabilistic_rules.rules import from_instruction_list_to_dict
-from semantic_codec.solution.solution_builders import ProblemBuilder
+from constraint import Problem
+
+from semantic_codec.solution.solution_builders import ProblemBuilder, ExactFieldSumConstraint
 from tests.test_disassembler_readers import TestTextDisassembleReader
 
 
+class FieldValue(object):
+    def __init__(self, name, fields, ignore=False):
+        self.name = name
+        self.fields = fields
+        self.ignore = ignore
+
+
 class TestProblemBuilder(TestCase):
 
+    @staticmethod
+    def solve(domains, exactsum):
+        problem = Problem()
+        for k, v in domains.items():
+            problem.addVariable(k, v)
+        problem.addConstraint(ExactFieldSumConstraint(exactsum, lambda x: x.fields))
+        return sorted(sorted((k, v.name) for k, v in s.items()) for s in problem.getSolutions())
+
+    def test_exact_field_sum(self):
+        values = [FieldValue(i, [i]) for i in range(1, 4)]
+        solutions = self.solve({'a': values, 'b': values}, {1: 1, 2: 1})
+        self.assertEqual([[('a', 1), ('b', 2)], [('a', 2), ('b', 1)]], solutions)
+
+    def test_exact_field_sum_many_fields(self):
+        # Values using several fields, some of them twice, are hidden once by the forward checking
+        domains = {'a': [FieldValue('a1', [1, 2, 2]), FieldValue('a2', [1, 3]), FieldValue('a3', [4], ignore=True)],
+                   'b': [FieldValue('b1', [3, 3]), FieldValue('b2', [2]), FieldValue('b3', [1, 2, 3])],
+                   'c': [FieldValue('c1', [3]), FieldValue('c2', [2, 1]), FieldValue('c3', [5])]}
+        exactsum = {1: 2, 2: 3, 3: 2}
+
+        expected = []
+        for values in itertools.product(*domains.values()):
+            fields = [f for v in values if not v.ignore for f in v.fields]
+            if all(fields.count(k) == n for k, n in exactsum.items()) and set(fields) <= set(exactsum):
+                expected.append(sorted(zip(domains.keys(), [v.name for v in values])))
+        self.assertEqual(2, len(expected))
+        self.assertEqual(sorted(expected), self.solve(domains, exactsum))
+
     def test_build(self):
         instructions = TextDisassembleReader(TestTextDisassembleReader.ASM_PATH).read_instructions()
 
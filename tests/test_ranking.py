@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+from semantic_codec.architecture.capstone_instruction import CAPSInstruction
+from semantic_codec.solution.ranking import SemanticEquivalence, CandidateRanking
+from semantic_codec.solution.solution_quality import SolutionQuality
+
+
+class TestRanking(TestCase):
+
+    ADDRESS = 0x1000
+
+    @staticmethod
+    def candidate(encoding, score):
+        inst = CAPSInstruction(encoding, TestRanking.ADDRESS)
+        inst.scores_by_rule['score'] = score
+        return inst
+
+    def program(self):
+        # mov r0, r1 has an alias with a different Rn field, printing the same
+        original = [CAPSInstruction(0xE1A00001, TestRanking.ADDRESS)]
+        candidates = [self.candidate(0xE1A00002, 0.5), self.candidate(0xE0800001, 0.9),
+                      self.candidate(0xE1A10001, 0.5), self.candidate(0xE1A00001, 0.2)]
+        return original, {TestRanking.ADDRESS: candidates}
+
+    def test_equivalence(self):
+        original, program = self.program()
+        mov_r2, add, alias, mov_r1 = program[TestRanking.ADDRESS]
+        equivalence = SemanticEquivalence(program, original)
+
+        self.assertTrue(equivalence.is_original(TestRanking.ADDRESS, mov_r1))
+        self.assertTrue(equivalence.is_original(TestRanking.ADDRESS, alias))
+        self.assertFalse(equivalence.is_original(TestRanking.ADDRESS, mov_r2))
+        self.assertFalse(equivalence.is_original(TestRanking.ADDRESS, add))
+        self.assertTrue(equivalence.same(TestRanking.ADDRESS, alias, mov_r1))
+        self.assertFalse(equivalence.same(TestRanking.ADDRESS, alias, mov_r2))
+        self.assertEqual(2, equivalence.original_index(TestRanking.ADDRESS))
+
+        # Every pair is in the same class if and only if it prints the same
+        for a in program[TestRanking.ADDRESS]:
+            for b in program[TestRanking.ADDRESS]:
+                self.assertEqual(str(a) == str(b), equivalence.same(TestRanking.ADDRESS, a, b))
+
+    def test_ranking(self):
+        original, program = self.program()
+        ranking = CandidateRanking(program, original)
+        self.assertEqual([0xE0800001, 0xE1A00002, 0xE1A10001, 0xE1A00001],
+                         [x.encoding for x in ranking.ranked(TestRanking.ADDRESS)])
+        self.assertEqual(2, ranking.original_rank(TestRanking.ADDRESS))
+        self.assertEqual(3, ranking.position(TestRanking.ADDRESS, 0xE1A00001))
+        self.assertIsNone(ranking.position(TestRanking.ADDRESS, 0xE1A03001))
+
+    def test_quality_ranks_again(self):
+        original, program = self.program()
+        mov_r1 = program[TestRanking.ADDRESS][3]
+        quality = SolutionQuality(program, original)
+        quality.evaluate()
+        self.assertEqual(3 / 4, quality.highest_depth)
+
+        # Rescored between evaluations, the original becomes the best candidate
+        mov_r1.scores_by_rule['score'] = 0.99
+        quality.evaluate()
+        self.assertEqual(1 / 4, quality.highest_depth)
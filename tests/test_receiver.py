@@ -0,0 +1,106 @@
+import io
+import os
+from unittest import TestCase
+
+import numpy
+
+from semantic_codec.architecture.disassembler_readers import ElfioTextDisassembleReader
+from semantic_codec.metadata.metadata_collector import MetadataCollector
+from semantic_codec.metadata.probabilistic_rules.rules import from_functions_to_list_and_addr
+from semantic_codec.receiver.packet_stream import StreamHeader, PacketStreamWriter, PacketStreamReader
+from semantic_codec.receiver.receiver import Receiver
+
+
+class TestReceiver(TestCase):
+
+    ASM_PATH = os.path.join(os.path.dirname(__file__), 'data/basicmath_small.disam')
+
+    @staticmethod
+    def program():
+        """
+        The text section of basic math, whose addresses are contiguous
+        """
+        instructions, fns = from_functions_to_list_and_addr(
+            ElfioTextDisassembleReader(TestReceiver.ASM_PATH).read_functions())
+        instructions = instructions[39:]
+        collector = MetadataCollector()
+        collector.collect(instructions)
+        words = numpy.array([inst.encoding for inst in instructions], dtype=numpy.uint32)
+        fns = {k: v for k, v in fns.items() if k >= instructions[0].address}
+        return StreamHeader(len(words), 80, 2, instructions[0].address), words, collector, fns
+
+    def test_stream(self):
+        header, words, _, _ = self.program()
+        stream = io.BytesIO()
+        PacketStreamWriter().write(stream, header, words, lost=[3, 7])
+        stream.seek(0)
+
+        reader = PacketStreamReader()
+        read = reader.read_header(stream)
+        self.assertEqual((header.word_count, 80, 2, header.base_address),
+                         (read.word_count, read.packet_count, read.bits_per_interleave, read.base_address))
+        packets = list(reader.packets(stream))
+        self.assertEqual([i for i in range(0, 80) if i not in [3, 7]], [i for i, _ in packets])
+
+    def test_receive_all(self):
+        header, words, collector, fns = self.program()
+        receiver = Receiver(header, collector, fns)
+        image, ambiguity = receiver.run(enumerate(PacketStreamWriter.payloads(header, words)))
+        self.assertTrue(numpy.array_equal(words, image))
+        self.assertEqual({}, ambiguity)
+        self.assertFalse(receiver.erasures.any())
+
+    def test_receive_lost_packets(self):
+        header, words, collector, fns = self.program()
+        stream = io.BytesIO()
+        PacketStreamWriter().write(stream, header, words, lost=[3])
+        stream.seek(0)
+        receiver, image, ambiguity = Receiver.from_stream(stream, collector, fns)
+
+        erased = receiver.erasures != 0
+        self.assertTrue(erased.any())
+        # The words not erased are received as sent, and the erased ones keep the bits received
+        self.assertTrue(numpy.array_equal(words[~erased], image[~erased]))
+        self.assertTrue(numpy.array_equal(words & ~receiver.erasures, image & ~receiver.erasures))
+        for addr in ambiguity:
+            self.assertTrue(erased[(addr - header.base_address) // 4])
+        # Most of the words erased are recovered
+        self.assertGreater((image[erased] == words[erased]).mean(), 0.5)
+
+    def test_receive_without_functions(self):
+        header, words, collector, _ = self.program()
+        stream = io.BytesIO()
+        PacketStreamWriter().write(stream, header, words, lost=[3])
+        stream.seek(0)
+        receiver, image, ambiguity = Receiver.from_stream(stream, collector)
+
+        # Branch candidates with a target are scored without the bounds of their function
+        branches = [inst for v in receiver.program.values() for inst in v
+                    if not inst.ignore and inst.is_branch and inst.jumping_address is not None]
+        self.assertGreater(len(branches), 0)
+        for inst in branches:
+            self.assertIn('pbd', inst.scores_by_rule)
+        erased = receiver.erasures != 0
+        self.assertTrue(numpy.array_equal(words[~erased], image[~erased]))
+
+    def test_words_completed_while_receiving(self):
+        header, words, collector, fns = self.program()
+        payloads = PacketStreamWriter.payloads(header, words)
+        receiver = Receiver(header, collector, fns, in_order=False)
+        completed = []
+        for index in range(0, 60):
+            completed.extend(receiver.receive(index, payloads[index]))
+        # Words whose packets all arrived are decoded before the stream ends
+        self.assertGreater(len(completed), 0)
+        self.assertLess(len(completed), header.word_count)
+        # Packets are lost out of order, the rest arrive afterwards
+        completed.extend(receiver.lose(79))
+        for index in range(60, 79):
+            completed.extend(receiver.receive(index, payloads[index]))
+        self.assertEqual(len(completed), len(set(completed)))
+        self.assertEqual(header.word_count, len(completed))
+        self.assertEqual(sorted(completed), sorted(receiver.program.keys()))
+        image, ambiguity = receiver.finish()
+        lost = receiver.erasures != 0
+        self.assertTrue(lost.any())
+        self.assertTrue(numpy.array_equal(words[~lost], image[~lost]))
@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+from semantic_codec.architecture.arm_constants import AReg
+from semantic_codec.metadata.register_write_index import RegisterWriteIndex
+from tests import test_candidateTable
+
+
+class TestRegisterWriteIndex(TestCase):
+
+    @staticmethod
+    def window_product(program, r, low, high):
+        """
+        The product computed address by address, as the register distance rule used to
+        """
+        p = 1
+        for a in range(low, high):
+            if a not in program:
+                continue
+            count, t = 0, 0
+            for x in program[a]:
+                if not x.ignore:
+                    t += 1
+                    if r in x.storages_written():
+                        count += 1
+            if t > 0:
+                p *= 1 - count / t
+                if p == 1:
+                    break
+        return p
+
+    def test_product(self):
+        program, collector, fns = test_candidateTable.TestCandidateTable.corrupted_program(600)
+        index = RegisterWriteIndex.from_program(program)
+        addresses = sorted(program.keys())
+        for addr in addresses[::7]:
+            for r in [AReg.R0, AReg.R3, AReg.SP, AReg.LR, AReg.STORE, AReg.CPSR, AReg.NOREG]:
+                for a, b in [(0, 1), (0, 4), (2, 9), (0, 40)]:
+                    expected = self.window_product(program, r, addr - 4 * b, addr - 4 * a)
+                    self.assertAlmostEqual(expected, float(index.product(r, addr - 4 * b, addr - 4 * a)), places=12)
+
+    def test_empty_window(self):
+        index = RegisterWriteIndex([0, 4, 8], [1, 0, 2], {AReg.R0: [1, 0, 1]})
+        self.assertEqual(1, index.product(AReg.R0, 4, 8))
+        self.assertEqual(1, index.product(AReg.R0, 20, 40))
+        self.assertEqual(0, index.product(AReg.R0, 0, 4))
+        self.assertEqual(0.5, index.product(AReg.R0, 4, 12))
+        self.assertEqual(1, index.product(AReg.R1, 0, 12))
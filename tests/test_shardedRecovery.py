@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+from semantic_codec.metadata.candidate_table import CandidateTable
+from semantic_codec.metadata.recuperator import ProbabilisticRecuperator, remove_bad_candidates_at_addr
+from semantic_codec.metadata.sharded_recovery import ShardedRecovery
+from tests import test_incrementalRescoring
+
+
+class TestShardedRecovery(TestCase):
+
+    def test_split(self):
+        program, collector, fns = test_incrementalRescoring.TestIncrementalRescoring.corrupted_program()
+        addresses = sorted(program.keys())
+        ranges = ShardedRecovery(collector, program, fns, workers=2, shards=8).split()
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(0, ranges[0][0])
+        self.assertEqual(len(addresses), ranges[-1][1])
+        for (_, last), (first, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(last, first)
+            self.assertIn(addresses[first], fns)
+
+    def test_same_scores_than_serial(self):
+        program, collector, fns = test_incrementalRescoring.TestIncrementalRescoring.corrupted_program()
+        table = CandidateTable.from_program(program)
+        serial, sharded = table.to_program(), table.to_program()
+
+        ProbabilisticRecuperator(collector, serial, functions=fns).recover()
+        ShardedRecovery(collector, sharded, fns, workers=2, shards=8, prune=False).recover()
+        self.assert_same(serial, sharded)
+
+    def assert_same(self, serial, sharded):
+        for addr, v in serial.items():
+            self.assertEqual([x.encoding for x in v], [x.encoding for x in sharded[addr]])
+            for inst, other in zip(v, sharded[addr]):
+                self.assertEqual(inst.scores_by_rule.keys(), other.scores_by_rule.keys())
+                for rule, score in inst.scores_by_rule.items():
+                    self.assertAlmostEqual(score, other.scores_by_rule[rule], places=12)
+                self.assertIs(inst.score_function, other.score_function)
+
+    def test_same_passes_than_serial(self):
+        # The passes of run_recovery: score, remove the bad candidates and rescore until none is removed
+        program, collector, fns = test_incrementalRescoring.TestIncrementalRescoring.corrupted_program()
+        table = CandidateTable.from_program(program)
+        serial, sharded = table.to_program(), table.to_program()
+        recuperators = [ProbabilisticRecuperator(collector, serial, functions=fns),
+                        ShardedRecovery(collector, sharded, fns, workers=2, shards=8, prune=False)]
+        for r in recuperators:
+            r.recover()
+
+        passes = 0
+        while True:
+            self.assert_same(serial, sharded)
+            changed = [addr for addr in sorted(serial) if remove_bad_candidates_at_addr(serial[addr]) > 0]
+            self.assertEqual(changed, [addr for addr in sorted(sharded)
+                                       if remove_bad_candidates_at_addr(sharded[addr]) > 0])
+            if not changed:
+                break
+            passes += 1
+            for r in recuperators:
+                r.rescore(changed)
+        self.assertGreater(passes, 0)
+
+    def test_prune(self):
+        program, collector, fns = test_incrementalRescoring.TestIncrementalRescoring.corrupted_program()
+        before = {addr: list(v) for addr, v in program.items()}
+        ShardedRecovery(collector, program, fns, workers=2, shards=8).recover()
+
+        self.assertLess(sum(len(v) for v in program.values()), sum(len(v) for v in before.values()))
+        for addr, v in program.items():
+            for inst in v:
+                self.assertIn(inst, before[addr])
+                self.assertIn('pc', inst.scores_by_rule)
@@ -31,4 +31,20 @@ class TestSolutionWriter(TestCase):
         ori_readed, readed = reader.read('data/data.sol')
 
         # Check that readed is identical to written
-        self.check_equals(readed, program)
\ No newline at end of file
+        self.check_equals(readed, program)
+
+    def test_write_erasures(self):
+        original, program = TestForwardConstraintSolutionBuilder.obtain_corrupted_program()
+        original = from_instruction_list_to_dict(original)
+        addresses = sorted(program.keys())
+        # Addresses marked without erasures are written from the original, their candidates are not read
+        erasures = [1] * len(addresses)
+        erasures[0] = 0
+        program[addresses[0]] = []
+
+        SolutionWriter().write_binary('data/data.sol', original, program, erasures)
+        ori_readed, readed = SolutionReader().read('data/data.sol')
+
+        self.assertEqual([original[addresses[0]][0].encoding], [i.encoding for i in readed[addresses[0]]])
+        del readed[addresses[0]]
+        self.check_equals(readed, program)
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+import numpy
+
+from semantic_codec.metadata.candidate_table import CandidateTable
+from semantic_codec.metadata.recuperator import ProbabilisticRecuperator
+from semantic_codec.metadata.vectorized_recuperator import VectorizedRecuperator
+from tests import test_candidateTable
+
+
+class TestVectorizedRecuperator(TestCase):
+
+    def assert_same_scores(self, functions=None):
+        program, collector, fns = test_candidateTable.TestCandidateTable.corrupted_program()
+        fns = fns if functions is None else functions
+        copy = CandidateTable.from_program(program).to_program()
+
+        ProbabilisticRecuperator(collector, program, functions=fns).recover()
+        VectorizedRecuperator(collector, copy, functions=fns).recover()
+
+        for addr, v in program.items():
+            for inst, other in zip(v, copy[addr]):
+                self.assertEqual(inst.scores_by_rule, other.scores_by_rule)
+                self.assertIs(inst.score_function, other.score_function)
+        return program
+
+    def test_same_scores_than_probabilistic(self):
+        self.assert_same_scores()
+
+    def test_same_scores_without_functions(self):
+        program = self.assert_same_scores({})
+        self.assertTrue(any('pbd' in inst.scores_by_rule for v in program.values() for inst in v))
+
+    def test_scores_on_table(self):
+        program, collector, fns = test_candidateTable.TestCandidateTable.corrupted_program(200)
+        table = CandidateTable.from_program(program)
+
+        ProbabilisticRecuperator(collector, program, functions=fns).recover()
+        VectorizedRecuperator(collector, table.program(), functions=fns).recover()
+
+        for addr, v in program.items():
+            for inst, row in zip(v, table.rows(addr)):
+                self.assertEqual(inst.scores_by_rule, dict(table.instruction(row).scores_by_rule))
+        # The first address has no previous instructions
+        self.assertTrue(numpy.isnan(table.scores['prd'][table.rows(table.addresses[0])]).all())